@@ -1,6 +1,23 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_migrate, post_save
 
 
 class ApiConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'api'
+
+    def ready(self):
+        from .schema import invalidate_schema_registry
+        from .values import value_dictionary
+        from .versions import bulk_write, bump_data_version
+
+        post_migrate.connect(invalidate_schema_registry, dispatch_uid="api_invalidate_schema_registry")
+        bulk_write.connect(bump_data_version, dispatch_uid="api_bump_data_version_bulk_write")
+        for model in self.get_models():
+            uid = f"api_bump_data_version_{model._meta.model_name}"
+            post_save.connect(bump_data_version, sender=model, dispatch_uid=f"{uid}_save")
+            post_delete.connect(bump_data_version, sender=model, dispatch_uid=f"{uid}_delete")
+            post_save.connect(
+                value_dictionary.record_saved, sender=model,
+                dispatch_uid=f"api_value_dictionary_{model._meta.model_name}",
+            )
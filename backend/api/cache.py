@@ -0,0 +1,294 @@
+import asyncio
+import hashlib
+import re
+import sys
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+from .sql import is_deterministic, normalize_sql, referenced_tables
+from .versions import get_table_versions
+
+_WHITESPACE_RE = re.compile(r"\s+")
+_EDGE_PUNCTUATION = " ?!.,;:'\""
+
+
+def normalize_question(question):
+    """'  Show me ALL customers? ' -> 'show me all customers'"""
+    question = unicodedata.normalize("NFKC", question).lower()
+    return _WHITESPACE_RE.sub(" ", question).strip(_EDGE_PUNCTUATION)
+
+
+class QuestionSQLCache:
+    """
+    Maps (normalized question, schema fingerprint) to generated SQL.
+
+    Two tiers: a bounded in-process LRU with TTL, and optionally a Django
+    cache alias shared between workers. Concurrent misses for the same key are
+    coalesced so only one of them calls the model (single-flight).
+    """
+
+    def __init__(self, max_entries=1024, ttl=3600, shared_alias=None):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.shared_alias = shared_alias
+        self._entries = OrderedDict()
+        self._in_flight = {}
+        self._lock = threading.Lock()
+        self._counters = {"local_hits": 0, "shared_hits": 0, "misses": 0, "coalesced": 0}
+
+    @staticmethod
+    def make_key(question, fingerprint):
+        digest = hashlib.sha1(normalize_question(question).encode("utf-8")).hexdigest()
+        return f"q2sql:{fingerprint}:{digest}"
+
+    def _shared(self):
+        return caches[self.shared_alias] if self.shared_alias else None
+
+    def _get_local(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        sql, expires_at = entry
+        if expires_at < time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return sql
+
+    def _set_local(self, key, sql):
+        self._entries[key] = (sql, time.monotonic() + self.ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def get(self, question, fingerprint):
+        key = self.make_key(question, fingerprint)
+        with self._lock:
+            return self._get_local(key)
+
+    def set(self, question, fingerprint, sql):
+        key = self.make_key(question, fingerprint)
+        with self._lock:
+            self._set_local(key, sql)
+        shared = self._shared()
+        if shared is not None:
+            shared.set(key, sql, self.ttl)
+
+    def _claim(self, key):
+        """
+        Returns (sql, None, False) on a local hit, otherwise
+        (None, future, leader) where the leader must compute the value.
+        """
+        with self._lock:
+            sql = self._get_local(key)
+            if sql is not None:
+                self._counters["local_hits"] += 1
+                return sql, None, False
+            future = self._in_flight.get(key)
+            if future is not None:
+                self._counters["coalesced"] += 1
+                return None, future, False
+            future = Future()
+            self._in_flight[key] = future
+            return None, future, True
+
+    def _record_shared_hit(self, key, sql):
+        with self._lock:
+            self._counters["shared_hits"] += 1
+            self._set_local(key, sql)
+
+    def _record_miss(self):
+        with self._lock:
+            self._counters["misses"] += 1
+
+    def _release(self, key):
+        with self._lock:
+            self._in_flight.pop(key, None)
+
+    def get_or_compute(self, question, fingerprint, compute, cacheable=None):
+        """
+        Returns the cached SQL or `compute()`'s result. `cacheable(sql)` can
+        veto storing a result (e.g. an error string returned by the Space).
+        """
+        key = self.make_key(question, fingerprint)
+        sql, future, leader = self._claim(key)
+        if future is None:
+            return sql
+        if not leader:
+            return future.result()
+
+        try:
+            shared = self._shared()
+            sql = shared.get(key) if shared is not None else None
+            if sql is not None:
+                self._record_shared_hit(key, sql)
+            else:
+                self._record_miss()
+                sql = compute()
+                if cacheable is None or cacheable(sql):
+                    with self._lock:
+                        self._set_local(key, sql)
+                    if shared is not None:
+                        shared.set(key, sql, self.ttl)
+            future.set_result(sql)
+            return sql
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    async def aget_or_compute(self, question, fingerprint, compute, cacheable=None):
+        """
+        `get_or_compute` for async callers; `compute` is a coroutine function.
+        Sync and async callers coalesce on the same in-flight futures.
+        """
+        key = self.make_key(question, fingerprint)
+        sql, future, leader = self._claim(key)
+        if future is None:
+            return sql
+        if not leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            shared = self._shared()
+            sql = await shared.aget(key) if shared is not None else None
+            if sql is not None:
+                self._record_shared_hit(key, sql)
+            else:
+                self._record_miss()
+                sql = await compute()
+                if cacheable is None or cacheable(sql):
+                    with self._lock:
+                        self._set_local(key, sql)
+                    if shared is not None:
+                        await shared.aset(key, sql, self.ttl)
+            future.set_result(sql)
+            return sql
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._release(key)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), max_entries=self.max_entries)
+        lookups = stats["local_hits"] + stats["shared_hits"] + stats["coalesced"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        return stats
+
+
+question_cache = QuestionSQLCache(
+    max_entries=settings.QUESTION_CACHE_MAX_ENTRIES,
+    ttl=settings.QUESTION_CACHE_TTL,
+    shared_alias=settings.QUESTION_CACHE_SHARED_ALIAS or None,
+)
+
+
+def _estimate_bytes(result, rows_key):
+    # Extrapolated from a sample of rows; exact sizing would cost a pass over every value.
+    rows = result[rows_key]
+    sample = rows[:32]
+    per_row = 0.0
+    if sample:
+        total = 0
+        for row in sample:
+            values = row.values() if isinstance(row, dict) else row
+            total += sys.getsizeof(row) + sum(sys.getsizeof(value) for value in values)
+        per_row = total / len(sample)
+    return int(per_row * len(rows)) + sys.getsizeof(rows) + len(result.get("sql", "")) + 256
+
+
+class QueryResultCache:
+    """
+    In-process LRU of executed query results, bounded by an estimated memory
+    budget (`max_bytes`) rather than an entry count.
+
+    Keys hold the normalized SQL, the page requested and the write counters
+    of every table the query reads (api/versions.py): a write to one of them
+    makes older entries unreachable, so a stale result is never served, and
+    they age out of the LRU. Queries reading anything else (other tables,
+    CTEs, the clock) are not cached. The counters must be shared by every
+    process that writes (DATA_VERSIONS_CACHE_ALIAS); callers don't use the
+    cache otherwise.
+    """
+
+    def __init__(self, max_bytes=64 * 1024 * 1024, max_entry_bytes=8 * 1024 * 1024, ttl=300):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.ttl = ttl
+        self._entries = OrderedDict()  # key -> (result, size, expires_at, cost)
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._counters = {"hits": 0, "misses": 0, "evictions": 0, "uncacheable": 0}
+
+    def make_key(self, sql, table_names, *page):
+        """Cache key for `sql` (already rewritten) and its page, or None when it can't be cached."""
+        tables = referenced_tables(sql, table_names)
+        if not tables or not is_deterministic(sql):
+            with self._lock:
+                self._counters["uncacheable"] += 1
+            return None
+        return normalize_sql(sql), page, tuple(sorted(tables)), get_table_versions(tables)
+
+    def get(self, key):
+        """(result, seconds it took to compute) for `key`, or None."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[2] < time.monotonic():
+                self._remove(key)
+                entry = None
+            if entry is None:
+                self._counters["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._counters["hits"] += 1
+        # Callers add keys (next_page_token) to the result; the rows are shared.
+        return dict(entry[0]), entry[3]
+
+    def set(self, key, result, rows_key, cost=0.0):
+        size = _estimate_bytes(result, rows_key)
+        if size > min(self.max_entry_bytes, self.max_bytes):
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (dict(result), size, time.monotonic() + self.ttl, cost)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                self._remove(next(iter(self._entries)))
+                self._counters["evictions"] += 1
+
+    def _remove(self, key):
+        _, size, _, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._counters, entries=len(self._entries), bytes=self._bytes, max_bytes=self.max_bytes)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = round(stats["hits"] / lookups, 4) if lookups else 0.0
+        return stats
+
+
+result_cache = QueryResultCache(
+    max_bytes=settings.RESULT_CACHE_MAX_BYTES,
+    max_entry_bytes=settings.RESULT_CACHE_MAX_ENTRY_BYTES,
+    ttl=settings.RESULT_CACHE_TTL,
+)
@@ -0,0 +1,282 @@
+import asyncio
+import itertools
+import queue
+import threading
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from contextlib import contextmanager
+
+from django.conf import settings
+from gradio_client import Client
+
+
+class ModelUnavailableError(Exception):
+    """Raised when the model Space cannot serve a prediction right now."""
+
+
+class ModelTimeoutError(ModelUnavailableError):
+    """The Space did not answer in time; not retried, so a hung Space fails fast."""
+
+
+class PoolExhaustedError(ModelUnavailableError):
+    """Every client of this process is busy; says nothing about the Space's health."""
+
+
+class CircuitBreaker:
+    """
+    Stops calling a failing Space for a while instead of letting every request
+    wait for its own timeout.
+
+    closed -> open after `failure_threshold` consecutive failures,
+    open -> half-open after `reset_timeout` seconds (one trial call allowed),
+    half-open -> closed on success, back to open on failure.
+    """
+
+    CLOSED = "closed"
+    OPEN = "open"
+    HALF_OPEN = "half-open"
+
+    def __init__(self, failure_threshold=5, reset_timeout=30.0):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._trial_in_flight = False
+        self._lock = threading.Lock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._current_state()
+
+    def _current_state(self):
+        if self._state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_timeout:
+            self._state = self.HALF_OPEN
+            self._trial_in_flight = False
+        return self._state
+
+    def allow(self):
+        with self._lock:
+            state = self._current_state()
+            if state == self.CLOSED:
+                return True
+            if state == self.HALF_OPEN and not self._trial_in_flight:
+                self._trial_in_flight = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            self._state = self.CLOSED
+            self._failures = 0
+            self._trial_in_flight = False
+
+    def release(self):
+        """Gives back a half-open trial slot whose call was cancelled."""
+        with self._lock:
+            self._trial_in_flight = False
+
+    def record_failure(self):
+        with self._lock:
+            self._failures += 1
+            if self._state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                self._state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._trial_in_flight = False
+
+
+class ModelClientPool:
+    """
+    Process-wide pool of warm gradio clients.
+
+    Creating a `Client` performs the Space handshake and config fetch, so the
+    clients are created lazily (up to `size`) and reused across requests.
+    """
+
+    def __init__(self, model_id, token=None, size=4, timeout=30.0, retries=2,
+                 backoff=0.5, breaker=None, client_factory=None):
+        self.model_id = model_id
+        self.token = token
+        self.size = size
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.breaker = breaker or CircuitBreaker()
+        self._client_factory = client_factory or self._default_client_factory
+        self._idle = queue.LifoQueue()
+        self._created = 0
+        self._lock = threading.Lock()
+        # The async path shares clients instead of checking them out: a gradio
+        # client multiplexes concurrent submits, and awaiting its jobs holds no thread.
+        self._shared = []
+        self._shared_lock = threading.Lock()
+        self._round_robin = itertools.count()
+
+    def _default_client_factory(self):
+        return Client(
+            self.model_id,
+            token=self.token,
+            verbose=False,
+            httpx_kwargs={"timeout": self.timeout},
+        )
+
+    def _checkout(self):
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+
+        with self._lock:
+            can_create = self._created < self.size
+            if can_create:
+                self._created += 1
+        if can_create:
+            try:
+                return self._client_factory()
+            except Exception:
+                with self._lock:
+                    self._created -= 1
+                raise
+
+        try:
+            return self._idle.get(timeout=self.timeout)
+        except queue.Empty:
+            raise PoolExhaustedError("Timed out waiting for a free model client.")
+
+    def _discard(self):
+        with self._lock:
+            self._created -= 1
+
+    @contextmanager
+    def client(self):
+        client = self._checkout()
+        try:
+            yield client
+        except Exception:
+            # A client that failed mid-call may hold a broken connection.
+            self._discard()
+            raise
+        else:
+            self._idle.put(client)
+
+    def _predict_once(self, *args, api_name=None):
+        with self.client() as client:
+            job = client.submit(*args, api_name=api_name)
+            try:
+                return job.result(timeout=self.timeout)
+            except FutureTimeoutError:
+                job.cancel()
+                raise ModelTimeoutError(
+                    f"Model did not answer within {self.timeout:g}s."
+                )
+
+    def predict(self, *args, api_name=None):
+        """
+        Calls the Space, retrying other errors with backoff. A timeout counts
+        against the breaker but is not retried; a busy pool counts as neither.
+        """
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise ModelUnavailableError(
+                    "Model Space is failing; circuit breaker is open."
+                )
+            try:
+                result = self._predict_once(*args, api_name=api_name)
+            except PoolExhaustedError:
+                self.breaker.release()
+                raise
+            except ModelTimeoutError:
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                last_error = e
+                if attempt < self.retries:
+                    time.sleep(self.backoff * (2 ** attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+        if isinstance(last_error, ModelUnavailableError):
+            raise last_error
+        raise ModelUnavailableError(str(last_error)) from last_error
+
+    def _shared_client(self):
+        with self._shared_lock:
+            if len(self._shared) < self.size:
+                # Handshake under the lock so concurrent callers don't all create clients.
+                self._shared.append(self._client_factory())
+                return self._shared[-1]
+            return self._shared[next(self._round_robin) % len(self._shared)]
+
+    async def _apredict_once(self, *args, api_name=None):
+        shared = self._shared
+        if len(shared) >= self.size:
+            client = shared[next(self._round_robin) % len(shared)]
+        else:
+            # Creating a client is a blocking handshake; keep it off the event loop.
+            client = await asyncio.to_thread(self._shared_client)
+        job = client.submit(*args, api_name=api_name)
+        try:
+            return await asyncio.wait_for(asyncio.wrap_future(job), self.timeout)
+        except asyncio.TimeoutError:
+            job.cancel()
+            raise ModelTimeoutError(f"Model did not answer within {self.timeout:g}s.")
+        except asyncio.CancelledError:
+            job.cancel()
+            raise
+
+    async def apredict(self, *args, api_name=None):
+        """Non-blocking `predict` for async views: same retries and breaker."""
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if not self.breaker.allow():
+                raise ModelUnavailableError(
+                    "Model Space is failing; circuit breaker is open."
+                )
+            try:
+                result = await self._apredict_once(*args, api_name=api_name)
+            except asyncio.CancelledError:
+                self.breaker.release()
+                raise
+            except ModelTimeoutError:
+                self.breaker.record_failure()
+                raise
+            except Exception as e:
+                self.breaker.record_failure()
+                last_error = e
+                if attempt < self.retries:
+                    await asyncio.sleep(self.backoff * (2 ** attempt))
+                continue
+            self.breaker.record_success()
+            return result
+
+        if isinstance(last_error, ModelUnavailableError):
+            raise last_error
+        raise ModelUnavailableError(str(last_error)) from last_error
+
+
+_pool = None
+_pool_lock = threading.Lock()
+
+
+def get_model_pool():
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ModelClientPool(
+                    settings.HF_MODEL_ID,
+                    token=settings.HF_TOKEN,
+                    size=settings.MODEL_CLIENT_POOL_SIZE,
+                    timeout=settings.MODEL_CLIENT_TIMEOUT,
+                    retries=settings.MODEL_CLIENT_RETRIES,
+                    backoff=settings.MODEL_CLIENT_BACKOFF,
+                    breaker=CircuitBreaker(
+                        failure_threshold=settings.MODEL_CIRCUIT_FAILURE_THRESHOLD,
+                        reset_timeout=settings.MODEL_CIRCUIT_RESET_TIMEOUT,
+                    ),
+                )
+    return _pool
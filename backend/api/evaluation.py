@@ -0,0 +1,400 @@
+import decimal
+import json
+import os
+import re
+import threading
+import time
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+
+from django.conf import settings
+from django.db import connections
+from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+
+from .clients import get_model_pool
+from .schema import schema_registry
+from .services import stream_query
+from .versions import get_data_version
+
+# The run ids EvaluationRun generates; anything else could name a path outside EVALUATION_RUNS_DIR.
+_RUN_ID_RE = re.compile(r"[0-9a-f]{12}")
+
+METRIC_NAME = "Execution Accuracy (ExMatch)"
+METRIC_DESCRIPTION = (
+    "Measures if the generated SQL returns the exact same database result as the Gold Standard query."
+)
+
+
+class _QueryFailed(Exception):
+    pass
+
+
+class _GoldResult:
+    def __init__(self, columns=None, row_counts=None, row_count=0, truncated=False, error=None):
+        self.columns = columns
+        self.row_counts = row_counts
+        self.row_count = row_count
+        self.truncated = truncated
+        self.error = error
+
+
+_gold_cache = OrderedDict()
+_gold_cache_lock = threading.Lock()
+
+
+def _normalize_value(value):
+    # 15, 15.0 and Decimal("15.00") are the same answer.
+    if isinstance(value, decimal.Decimal):
+        value = float(value)
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _open_result(sql_query):
+    """
+    Starts streaming `sql_query`; returns (columns, row iterator, footer, close).
+    Rows come out as normalized, hashable tuples; `footer` is filled in once
+    the iterator is exhausted. `close()` releases the cursor early.
+    """
+    events = stream_query(sql_query, max_rows=settings.EVALUATION_MAX_ROWS)
+    header = next(events)
+    if "error" in header:
+        events.close()
+        raise _QueryFailed(header["error"])
+    footer = {}
+
+    def rows():
+        for item in events:
+            if isinstance(item, dict):
+                if "error" in item:
+                    raise _QueryFailed(item["error"])
+                footer.update(item)
+                continue
+            for row in item:
+                yield tuple(_normalize_value(value) for value in row)
+
+    return header["columns"], rows(), footer, events.close
+
+
+def _gold_result(sql_expected):
+    """
+    Multiset of the gold query's rows, cached by SQL text + data version so
+    repeated evaluation runs don't re-execute it. Only cached when the data
+    version is shared (DATA_VERSIONS_CACHE_ALIAS): a per-process version
+    misses reseeds and other workers' writes.
+    """
+    key = (sql_expected, get_data_version()) if settings.DATA_VERSIONS_CACHE_ALIAS else None
+    if key is not None:
+        with _gold_cache_lock:
+            cached = _gold_cache.get(key)
+            if cached is not None:
+                _gold_cache.move_to_end(key)
+                return cached
+
+    try:
+        columns, rows, footer, close = _open_result(sql_expected)
+        try:
+            row_counts = Counter(rows)
+        finally:
+            close()
+        result = _GoldResult(
+            columns=columns,
+            row_counts=row_counts,
+            row_count=sum(row_counts.values()),
+            truncated=footer.get("truncated", False),
+        )
+    except _QueryFailed as e:
+        result = _GoldResult(error=str(e))
+
+    if key is not None:
+        with _gold_cache_lock:
+            _gold_cache[key] = result
+            while len(_gold_cache) > settings.EVALUATION_GOLD_CACHE_SIZE:
+                _gold_cache.popitem(last=False)
+    return result
+
+
+# --- Helper to compare two SQL results ---
+def compare_query_results(sql_generated, sql_expected):
+    """
+    Returns True if both queries return the exact same data.
+
+    Rows are compared as a multiset (order-insensitive) by hashing normalized
+    row tuples: the gold rows are counted once (and cached), then the
+    generated rows are streamed against those counts, stopping at the first
+    row that doesn't match.
+    """
+    try:
+        gold = _gold_result(sql_expected)
+
+        # Execute Generated
+        try:
+            columns, rows, footer, close = _open_result(sql_generated)
+        except _QueryFailed as e:
+            return False, str(e)
+
+        try:
+            # Execute Expected (Gold Standard)
+            if gold.error:
+                return False, "Gold standard query failed (bad test case)"
+            if gold.truncated:
+                return False, "Gold standard result is larger than EVALUATION_MAX_ROWS"
+            if columns != gold.columns:
+                return False, "Column mismatch"
+
+            # Compare Data
+            remaining = gold.row_counts.copy()
+            row_count = 0
+            for row in rows:
+                row_count += 1
+                if remaining[row] == 0:
+                    return False, "Row mismatch"
+                remaining[row] -= 1
+        finally:
+            close()
+
+        if footer.get("truncated"):
+            return False, "Generated result is larger than EVALUATION_MAX_ROWS"
+        if row_count != gold.row_count:
+            return False, "Row count mismatch"
+        return True, "Success"
+    except Exception as e:
+        return False, str(e)
+
+
+def resolve_test_set(name_or_path):
+    """
+    Test sets are referenced by their EVALUATION_TEST_SETS name over HTTP;
+    the management command may also pass a file path.
+    """
+    if name_or_path in settings.EVALUATION_TEST_SETS:
+        return Path(settings.EVALUATION_TEST_SETS[name_or_path])
+    return Path(name_or_path)
+
+
+def load_test_set(path):
+    """
+    Loads `[{"question": ..., "gold_sql": ...}, ...]`. The `answer` key used by
+    train.json is accepted as the gold query too.
+    """
+    with open(path, encoding="utf-8") as f:
+        items = json.load(f)
+    test_set = []
+    for item in items:
+        gold_sql = item.get("gold_sql") or item.get("answer")
+        if item.get("question") and gold_sql:
+            test_set.append({"question": item["question"], "gold_sql": gold_sql})
+    return test_set
+
+
+def evaluate_item(item, all_cols):
+    question = item["question"]
+    gold_sql = item["gold_sql"]
+    started = time.perf_counter()
+    predicted = started
+    try:
+        # 1. Get AI Prediction (straight from the model, not the question cache)
+        generated_sql = get_model_pool().predict(question, all_cols, api_name="/predict").strip()
+        predicted = time.perf_counter()
+
+        # 2. Calculate Execution Accuracy (The Logic Check)
+        is_correct, debug_msg = compare_query_results(generated_sql, gold_sql)
+        finished = time.perf_counter()
+
+        # 3. Calculate BLEU (The Syntax Check - purely for reference)
+        ref_tokens = gold_sql.lower().split()
+        cand_tokens = generated_sql.lower().split()
+        bleu = sentence_bleu([ref_tokens], cand_tokens, smoothing_function=SmoothingFunction().method1)
+
+        return {
+            "question": question,
+            "status": "PASS" if is_correct else "FAIL",
+            "generated_sql": generated_sql,
+            "expected_sql": gold_sql,
+            "execution_match": is_correct,
+            "bleu_score": round(bleu, 4),
+            "debug": debug_msg,
+            "latency_ms": {
+                "predict": round((predicted - started) * 1000, 1),
+                "execute": round((finished - predicted) * 1000, 1),
+                "total": round((finished - started) * 1000, 1),
+            },
+        }
+    except Exception as e:
+        return {
+            "question": question,
+            "status": "ERROR",
+            "error": str(e),
+            "latency_ms": {"total": round((time.perf_counter() - started) * 1000, 1)},
+        }
+    finally:
+        # Worker threads open their own DB connections; don't leak them.
+        connections.close_all()
+
+
+def _percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, int(round(fraction * (len(sorted_values) - 1))))
+    return sorted_values[index]
+
+
+def build_report(state):
+    results = [state["results"][key] for key in sorted(state["results"], key=int)]
+    completed = len(results)
+    total = state["total"]
+    correct_count = sum(1 for result in results if result.get("execution_match"))
+    accuracy = (correct_count / total) * 100 if total else 0.0
+    latencies = sorted(result["latency_ms"]["total"] for result in results)
+    elapsed = state.get("elapsed_seconds", 0.0)
+
+    report = {
+        "run_id": state["run_id"],
+        "status": state["status"],
+        "test_set": state["test_set"],
+        "completed": completed,
+        "total": total,
+        "metric": METRIC_NAME,
+        "description": METRIC_DESCRIPTION,
+        "overall_accuracy_percent": f"{accuracy}%",
+        "latency_ms": {
+            "mean": round(sum(latencies) / completed, 1) if completed else None,
+            "p50": _percentile(latencies, 0.50),
+            "p95": _percentile(latencies, 0.95),
+        },
+        "throughput_items_per_second": round(completed / elapsed, 3) if elapsed else None,
+        "elapsed_seconds": round(elapsed, 3),
+        "detailed_results": results,
+    }
+    if state.get("error"):
+        report["error"] = state["error"]
+    return report
+
+
+class EvaluationRun:
+    """
+    One evaluation of a test set, checkpointed to EVALUATION_RUNS_DIR/<run_id>.json
+    after every item. Re-running an existing run id skips the items already in
+    its checkpoint, so interrupted runs resume where they stopped.
+    """
+
+    def __init__(self, run_id=None, test_set="default", workers=None):
+        self.run_id = run_id or uuid.uuid4().hex[:12]
+        self.path = checkpoint_path(self.run_id)
+        self.workers = workers or settings.EVALUATION_WORKERS
+        self._lock = threading.Lock()
+
+        state = load_run_state(self.run_id)
+        if state is None:
+            items = load_test_set(resolve_test_set(test_set))
+            state = {
+                "run_id": self.run_id,
+                "test_set": str(test_set),
+                "status": "pending",
+                "total": len(items),
+                "items": items,
+                "results": {},
+                "elapsed_seconds": 0.0,
+                "error": None,
+            }
+            self._write(state)
+        self.state = state
+
+    def _write(self, state):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        tmp_path = self.path.with_suffix(".tmp")
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+    def _checkpoint(self, session_started):
+        self.state["elapsed_seconds"] = self._elapsed_before + (time.perf_counter() - session_started)
+        self._write(self.state)
+
+    def run(self, on_progress=None):
+        state = self.state
+        pending = [
+            (index, item) for index, item in enumerate(state["items"])
+            if str(index) not in state["results"]
+        ]
+        all_cols = schema_registry.get().columns_payload
+        self._elapsed_before = state.get("elapsed_seconds", 0.0)
+        session_started = time.perf_counter()
+
+        state["status"] = "running"
+        self._write(state)
+        try:
+            with ThreadPoolExecutor(max_workers=self.workers) as executor:
+                futures = {
+                    executor.submit(evaluate_item, item, all_cols): index
+                    for index, item in pending
+                }
+                for future in as_completed(futures):
+                    with self._lock:
+                        state["results"][str(futures[future])] = future.result()
+                        self._checkpoint(session_started)
+                    if on_progress:
+                        on_progress(len(state["results"]), state["total"])
+        except Exception as e:
+            state["status"] = "failed"
+            state["error"] = str(e)
+            self._checkpoint(session_started)
+            raise
+
+        state["status"] = "completed"
+        self._checkpoint(session_started)
+        return build_report(state)
+
+
+def is_valid_run_id(run_id):
+    return isinstance(run_id, str) and _RUN_ID_RE.fullmatch(run_id) is not None
+
+
+def checkpoint_path(run_id):
+    """EVALUATION_RUNS_DIR/<run_id>.json; raises ValueError for ids EvaluationRun doesn't generate."""
+    if not is_valid_run_id(run_id):
+        raise ValueError(f"Invalid run_id: {run_id!r}")
+    return Path(settings.EVALUATION_RUNS_DIR) / f"{run_id}.json"
+
+
+def load_run_state(run_id):
+    """The checkpointed state of `run_id`, or None for an unknown or invalid id."""
+    if not is_valid_run_id(run_id):
+        return None
+    path = checkpoint_path(run_id)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+_active_runs = set()
+_active_runs_lock = threading.Lock()
+
+
+def start_evaluation_job(test_set="default", run_id=None, workers=None):
+    """
+    Starts (or resumes) a run on a background thread and returns its id.
+    Progress is read back from the checkpoint file, so any worker can poll it.
+    """
+    run = EvaluationRun(run_id=run_id, test_set=test_set, workers=workers)
+    with _active_runs_lock:
+        if run.run_id in _active_runs:
+            return run.run_id
+        _active_runs.add(run.run_id)
+
+    def target():
+        try:
+            run.run()
+        except Exception:
+            pass  # recorded as "failed" in the checkpoint
+        finally:
+            with _active_runs_lock:
+                _active_runs.discard(run.run_id)
+            connections.close_all()
+
+    threading.Thread(target=target, name=f"evaluation-{run.run_id}", daemon=True).start()
+    return run.run_id
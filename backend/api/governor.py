@@ -0,0 +1,284 @@
+import json
+import math
+import re
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+from .schema import schema_registry
+from .sql import has_limit, table_aliases
+from .timing import stage
+from .workload import workload_log
+
+# `error_code` values of a stopped or failed query.
+SECURITY_VIOLATION = "security_violation"
+TIMEOUT = "timeout"
+PLAN_FULL_SCAN = "plan_full_scan"
+PLAN_NESTED_LOOP = "plan_nested_loop"
+DATABASE_ERROR = "database_error"
+
+# SQLite VM instructions between deadline checks.
+_PROGRESS_STEPS = 10000
+# "SCAN o", "SCAN api_order USING COVERING INDEX ..." (3.36+) or "SCAN TABLE api_order AS o" (older).
+_SQLITE_SCAN_RE = re.compile(r'^SCAN (?:TABLE )?"?([^\s"]+)"?')
+# PostgreSQL nodes that read all of their input before returning a row.
+_POSTGRESQL_MATERIALIZING = frozenset(("Sort", "Incremental Sort", "Hash", "WindowAgg", "SetOp", "Materialize"))
+
+
+class QueryRejected(Exception):
+    """A generated query stopped by the governor; `code` says why."""
+
+    def __init__(self, code, message):
+        super().__init__(message)
+        self.code = code
+
+
+def error_result(code, message, sql):
+    return {"error": message, "error_code": code, "sql": sql}
+
+
+def get_query_connection():
+    """Read-only connection generated queries run on (QUERY_DATABASE_ALIAS)."""
+    return connections[settings.QUERY_DATABASE_ALIAS]
+
+
+def _sqlite_table_rows(cursor, table):
+    """
+    Estimated row count of `table` without scanning it: from ANALYZE's
+    sqlite_stat1 when present, else its largest rowid (a b-tree seek; an
+    upper bound when rows were deleted).
+    """
+    try:
+        cursor.execute("SELECT stat FROM sqlite_stat1 WHERE tbl = %s", [table])
+        counts = [int(row[0].split()[0]) for row in cursor.fetchall()]
+    except DatabaseError:
+        counts = []  # never analyzed: there is no sqlite_stat1
+    if counts:
+        return max(counts)
+    try:
+        cursor.execute(f"SELECT MAX(rowid) FROM {cursor.db.ops.quote_name(table)}")
+    except DatabaseError:
+        return None  # WITHOUT ROWID table
+    return cursor.fetchone()[0] or 0
+
+
+def _postgresql_table_rows(cursor, table):
+    """The planner's row estimate for `table` (None until it is first vacuumed or analyzed)."""
+    cursor.execute("SELECT reltuples FROM pg_class WHERE oid = %s::regclass", [table])
+    row = cursor.fetchone()
+    return int(row[0]) if row and row[0] >= 0 else None
+
+
+def _judge(loops):
+    """
+    `loops` holds one list of (table, estimated rows, materialized) full
+    scans per loop nest. Rejects a materialized scan (its rows all go into a
+    sort, GROUP BY or DISTINCT before the first result row) above
+    QUERY_PLAN_MAX_SCAN_ROWS, or nested full scans whose row product is
+    above QUERY_PLAN_MAX_LOOP_ROWS. Streaming scans (into a LIMIT, which
+    stops them early, or a plain aggregate, a single pass) are left to the
+    deadline; so are tables without a row estimate.
+    """
+    for scans in loops:
+        for table, rows, materialized in scans:
+            if materialized and rows is not None and rows > settings.QUERY_PLAN_MAX_SCAN_ROWS:
+                raise QueryRejected(
+                    PLAN_FULL_SCAN,
+                    f"Query stopped: it would sort or group all {rows} rows of {table} "
+                    f"(limit {settings.QUERY_PLAN_MAX_SCAN_ROWS}).",
+                )
+        if len(scans) > 1 and all(rows is not None for _, rows, _ in scans):
+            combinations = math.prod(rows for _, rows, _ in scans)
+            if combinations > settings.QUERY_PLAN_MAX_LOOP_ROWS:
+                tables = " x ".join(table for table, _, _ in scans)
+                raise QueryRejected(
+                    PLAN_NESTED_LOOP,
+                    f"Query stopped: it would join {tables} without an index "
+                    f"({combinations} row combinations, limit {settings.QUERY_PLAN_MAX_LOOP_ROWS}).",
+                )
+
+
+def explain_sqlite(cursor, sql):
+    """
+    `EXPLAIN QUERY PLAN` rows as (parent, detail, scanned table): the table
+    is set for full scans ("SCAN o" -> "api_order"), None otherwise.
+    """
+    cursor.execute(f"EXPLAIN QUERY PLAN {sql}")
+    plan = cursor.fetchall()
+    aliases = table_aliases(sql, schema_registry.get().table_names)
+    rows = []
+    for _, parent, _, detail in plan:
+        match = _SQLITE_SCAN_RE.match(detail)
+        rows.append((parent, detail, aliases.get(match.group(1).lower()) if match else None))
+    return rows
+
+
+def _sqlite_loops(cursor, sql):
+    plan = explain_sqlite(cursor, sql)
+    # Plan rows sharing a parent are the nested loops of one SELECT. A temp
+    # B-tree materializes all of its rows, except a top-level ORDER BY under
+    # a LIMIT, which SQLite sorts into a LIMIT-sized buffer as it streams.
+    limited = has_limit(sql)
+    materialized = defaultdict(bool)
+    for parent, detail, _ in plan:
+        if detail.startswith("USE TEMP B-TREE FOR"):
+            top_n = parent == 0 and limited and "ORDER BY" in detail
+            materialized[parent] = materialized[parent] or not top_n
+    loops = defaultdict(list)
+    for parent, _, table in plan:
+        if table is not None:
+            loops[parent].append((table, _sqlite_table_rows(cursor, table), materialized[parent]))
+    return loops.values()
+
+
+def _postgresql_loops(cursor, sql):
+    cursor.execute(f"EXPLAIN (FORMAT JSON) {sql}")
+    plan = cursor.fetchone()[0]
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+
+    loops = []
+
+    def scanned(node):
+        # Inner side of a nested loop is often a Materialize over the scan.
+        while node["Node Type"] == "Materialize":
+            node = node["Plans"][0]
+        if node["Node Type"] == "Seq Scan":
+            return node["Relation Name"], _postgresql_table_rows(cursor, node["Relation Name"]), False
+        return None
+
+    def walk(node, materialized, under_limit):
+        node_type = node["Node Type"]
+        children = node.get("Plans", [])
+        if node_type == "Seq Scan":
+            relation = node["Relation Name"]
+            loops.append([(relation, _postgresql_table_rows(cursor, relation), materialized)])
+        elif node_type == "Nested Loop" and len(children) == 2:
+            inner = scanned(children[1])
+            if inner is not None:
+                outer = children[0]
+                loops.append([(outer.get("Relation Name", node_type), outer["Plan Rows"], False), inner])
+        # A Sort right under a Limit is a top-N heapsort; plain aggregates stream.
+        materialized = materialized or (
+            (node_type in _POSTGRESQL_MATERIALIZING and not (node_type == "Sort" and under_limit))
+            or (node_type == "Aggregate" and node.get("Strategy") not in (None, "Plain"))
+        )
+        for child in children:
+            walk(child, materialized, node_type == "Limit")
+
+    walk(plan[0]["Plan"], False, False)
+    return loops
+
+
+def check_plan(cursor, sql):
+    """Raises `QueryRejected` when `sql`'s plan scans or joins too many rows."""
+    if cursor.db.vendor == "sqlite":
+        _judge(_sqlite_loops(cursor, sql))
+    elif cursor.db.vendor == "postgresql":
+        _judge(_postgresql_loops(cursor, sql))
+
+
+class Deadline:
+    """
+    Execution-time budget of a governed query. Time spent inside `paused()`,
+    such as while a streaming client reads the rows fetched so far, is not
+    counted: only the database's own work is bounded.
+    """
+
+    def __init__(self, timeout):
+        self.timeout = timeout
+        self._spent = 0.0
+        self._resumed = time.monotonic()
+
+    @property
+    def elapsed(self):
+        running = time.monotonic() - self._resumed if self._resumed is not None else 0.0
+        return self._spent + running
+
+    def expired(self):
+        return bool(self.timeout) and self.elapsed > self.timeout
+
+    def stop(self):
+        """Stops the clock; `elapsed` keeps the time counted so far."""
+        if self._resumed is not None:
+            self._spent += time.monotonic() - self._resumed
+            self._resumed = None
+
+    @contextmanager
+    def paused(self):
+        if self._resumed is None:
+            yield
+            return
+        self.stop()
+        try:
+            yield
+        finally:
+            self._resumed = time.monotonic()
+
+
+@contextmanager
+def query_deadline(cursor, timeout):
+    """
+    Aborts the statement(s) run inside the block once they have run for
+    `timeout` seconds: SQLite's progress handler, `statement_timeout` on
+    PostgreSQL and `max_execution_time` on MySQL. Yields the `Deadline`;
+    errors raised once it has expired become `QueryRejected(TIMEOUT)`.
+
+    Rows of PostgreSQL/MySQL cursors are fetched by the execute itself, so
+    only SQLite, which steps the statement as rows are fetched, needs the
+    pauses between fetches taken out of the budget.
+    """
+    deadline = Deadline(timeout)
+    if not timeout:
+        try:
+            yield deadline
+        finally:
+            deadline.stop()
+        return
+
+    vendor = cursor.db.vendor
+    if vendor == "sqlite":
+        cursor.db.connection.set_progress_handler(deadline.expired, _PROGRESS_STEPS)
+    elif vendor == "postgresql":
+        cursor.execute(f"SET statement_timeout = {int(timeout * 1000)}")
+    elif vendor == "mysql":
+        cursor.execute(f"SET SESSION max_execution_time = {int(timeout * 1000)}")
+    try:
+        yield deadline
+    except DatabaseError as e:
+        if deadline.expired():
+            raise QueryRejected(TIMEOUT, f"Query stopped: it ran longer than {timeout:g}s.") from e
+        raise
+    finally:
+        deadline.stop()
+        if vendor == "sqlite":
+            cursor.db.connection.set_progress_handler(None, 0)
+        elif vendor == "postgresql":
+            cursor.execute("RESET statement_timeout")
+        elif vendor == "mysql":
+            cursor.execute("SET SESSION max_execution_time = DEFAULT")
+
+
+@contextmanager
+def governed_cursor(sql):
+    """
+    Yields (cursor, deadline): a cursor of the read-only query connection on
+    which `sql` has been executed under the governor. The plan pre-check
+    (QUERY_PLAN_CHECK) and then the statement run under the QUERY_TIMEOUT
+    `Deadline`, which stays armed while the caller fetches rows;
+    callers that hand rows to a slow consumer between fetches wrap that in
+    `deadline.paused()`.
+
+    Successful queries are recorded in the workload log with their execution time.
+    """
+    with get_query_connection().cursor() as cursor:
+        with query_deadline(cursor, settings.QUERY_TIMEOUT) as deadline:
+            if settings.QUERY_PLAN_CHECK:
+                with stage("plan"):
+                    check_plan(cursor, sql)
+            cursor.execute(sql)
+            yield cursor, deadline
+    workload_log.record(sql, deadline.elapsed)
@@ -0,0 +1,57 @@
+"""In-process stand-in for the model Space, shared by the benchmark commands."""
+import threading
+from concurrent.futures import Future
+from contextlib import contextmanager
+
+from api import clients, services
+from api.cache import normalize_question
+from api.clients import ModelClientPool
+from api.evaluation import load_test_set, resolve_test_set
+
+DEFAULT_SQL = "SELECT COUNT(*) FROM api_order"
+
+
+def canned_answers(test_set="default"):
+    """{normalized question: gold SQL} for a test set, so stubbed runs answer correctly."""
+    return {
+        normalize_question(item["question"]): item["gold_sql"]
+        for item in load_test_set(resolve_test_set(test_set))
+    }
+
+
+class CannedModelClient:
+    """
+    Stands in for a gradio Client: each job finishes after `latency` seconds
+    with canned SQL (`answers` by question, else `default_sql`). Handles the
+    same endpoints as the Space, including the schema handshake.
+    """
+
+    def __init__(self, latency=0.5, answers=None, default_sql=DEFAULT_SQL):
+        self.latency = latency
+        self.answers = answers or {}
+        self.default_sql = default_sql
+
+    def _answer(self, args, api_name):
+        if api_name == "/register_schema":
+            return "stub-schema"
+        return self.answers.get(normalize_question(args[0]), self.default_sql)
+
+    def submit(self, *args, api_name=None):
+        job = Future()
+        timer = threading.Timer(self.latency, job.set_result, args=(self._answer(args, api_name),))
+        timer.daemon = True
+        timer.start()
+        return job
+
+
+@contextmanager
+def stub_model_pool(client_factory, size):
+    """Swaps the process-wide model pool for one built on `client_factory`."""
+    original_pool = clients._pool
+    clients._pool = ModelClientPool("stub", size=size, timeout=60, retries=0, client_factory=client_factory)
+    services._space_schema_ids.clear()
+    try:
+        yield clients._pool
+    finally:
+        clients._pool = original_pool
+        services._space_schema_ids.clear()
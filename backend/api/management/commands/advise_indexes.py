@@ -0,0 +1,163 @@
+import statistics
+import time
+from collections import defaultdict
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError, connection, transaction
+
+from api.governor import explain_sqlite, get_query_connection
+from api.workload import workload_log
+
+
+def _candidates(entry):
+    """
+    Index column lists a logged query could use, per table: its equality
+    columns, then a range column or its sort columns. Join columns get
+    single-column candidates. Columns are (name, nocase) pairs.
+    """
+    by_table = defaultdict(lambda: {"eq": [], "range": [], "order": []})
+    for table, column, kind, nocase in entry["where"]:
+        by_table[table][kind].append((column, nocase))
+    order_tables = {table for table, _ in entry["order"]}
+    if len(order_tables) == 1:
+        # A sort can only come from an index when all its keys are on one table.
+        for table, column in entry["order"]:
+            by_table[table]["order"].append((column, False))
+    for table, column in entry["join"]:
+        yield table, ((column, False),)
+
+    for table, parts in by_table.items():
+        columns = parts["eq"][:2] + (parts["range"][:1] or parts["order"])
+        if columns:
+            yield table, tuple(dict.fromkeys(columns))
+
+
+def _index_name(table, columns):
+    return "advisor_" + "_".join([table] + [column + ("_nocase" if nocase else "") for column, nocase in columns])
+
+
+def _index_ddl(table, columns):
+    quote = connection.ops.quote_name
+    parts = ", ".join(quote(column) + (" COLLATE NOCASE" if nocase else "") for column, nocase in columns)
+    return f"CREATE INDEX IF NOT EXISTS {quote(_index_name(table, columns))} ON {quote(table)} ({parts})"
+
+
+def _explain(cursor, sql):
+    try:
+        return explain_sqlite(cursor, sql)
+    except DatabaseError:
+        return None  # the query no longer compiles (e.g. schema changed)
+
+
+def _needs_index(plan, table):
+    return any(scanned == table or "TEMP B-TREE FOR ORDER BY" in detail for _, detail, scanned in plan)
+
+
+class Command(BaseCommand):
+    help = (
+        "Propose indexes for the logged generated-query workload, ranked by the query time "
+        "they would serve; optionally create them and benchmark before/after latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--top", type=int, default=5, help="How many proposals to show/create.")
+        parser.add_argument("--create", action="store_true", help="Create the proposed indexes.")
+        parser.add_argument(
+            "--benchmark", action="store_true",
+            help="Time the affected queries before and after creating the indexes (implies --create).",
+        )
+        parser.add_argument("--repeat", type=int, default=5, help="Runs per query when benchmarking.")
+
+    def handle(self, *args, **options):
+        if connection.vendor != "sqlite":
+            raise CommandError("The index advisor relies on SQLite's EXPLAIN QUERY PLAN.")
+
+        queries = {}
+        candidates = defaultdict(set)
+        for entry in workload_log.entries():
+            query = queries.setdefault(entry["sql"], {"count": 0, "ms": 0.0})
+            query["count"] += 1
+            query["ms"] += entry["ms"]
+            for table, columns in _candidates(entry):
+                candidates[(table, columns)].add(entry["sql"])
+        if not queries:
+            raise CommandError(f"The workload log ({workload_log.path}) is empty.")
+        self.stdout.write(f"{sum(q['count'] for q in queries.values())} logged executions, {len(queries)} distinct queries")
+
+        proposals = self._rank(queries, candidates)[:options["top"]]
+        if not proposals:
+            self.stdout.write("No index would change the plan of a logged query.")
+            return
+
+        self.stdout.write(f"{'rank':>4} {'benefit_ms':>11} {'queries':>8}  index")
+        for rank, (benefit, table, columns, helped) in enumerate(proposals, 1):
+            self.stdout.write(f"{rank:>4} {benefit:>11.1f} {len(helped):>8}  {_index_ddl(table, columns)}")
+
+        if not (options["create"] or options["benchmark"]):
+            return
+
+        affected = sorted(
+            {sql for *_, helped in proposals for sql in helped},
+            key=lambda sql: -queries[sql]["count"],
+        )[:20]
+        before = self._time(affected, options["repeat"]) if options["benchmark"] else None
+
+        with connection.cursor() as cursor:
+            for _, table, columns, _ in proposals:
+                cursor.execute(_index_ddl(table, columns))
+            cursor.execute("ANALYZE")
+        self.stdout.write(f"Created {len(proposals)} index(es).")
+
+        if before is not None:
+            after = self._time(affected, options["repeat"])
+            self.stdout.write(f"{'before_ms':>10} {'after_ms':>10} {'speedup':>8}  query")
+            for sql in affected:
+                speedup = before[sql] / after[sql] if after[sql] else float("inf")
+                self.stdout.write(f"{before[sql]:>10.2f} {after[sql]:>10.2f} {speedup:>7.1f}x  {sql[:80]}")
+            total_before, total_after = sum(before.values()), sum(after.values())
+            self.stdout.write(f"{total_before:>10.2f} {total_after:>10.2f} {total_before / max(total_after, 1e-9):>7.1f}x  total")
+
+    def _rank(self, queries, candidates):
+        """
+        What-if check per candidate: build it inside a transaction that is
+        rolled back and keep it if it replaces a full scan or temporary sort
+        in some query's plan. Benefit is the logged time of those queries.
+        """
+        proposals = []
+        with connection.cursor() as cursor:
+            plans = {sql: _explain(cursor, sql) for sql in queries}
+            for (table, columns), sqls in candidates.items():
+                needy = [sql for sql in sqls if plans[sql] is not None and _needs_index(plans[sql], table)]
+                if not needy:
+                    continue
+                name = _index_name(table, columns)
+                with transaction.atomic():
+                    cursor.execute(_index_ddl(table, columns))
+                    helped = [
+                        sql for sql in needy
+                        if any(f"INDEX {name}" in detail for _, detail, _ in _explain(cursor, sql) or ())
+                    ]
+                    transaction.set_rollback(True)
+                if helped:
+                    benefit = sum(queries[sql]["ms"] for sql in helped)
+                    proposals.append((benefit, table, columns, helped))
+
+        # Keep the best proposal per (table, leading column); the rest are near duplicates.
+        proposals.sort(key=lambda proposal: -proposal[0])
+        best = {}
+        for proposal in proposals:
+            best.setdefault((proposal[1], proposal[2][0]), proposal)
+        return list(best.values())
+
+    def _time(self, sqls, repeat):
+        timings = {}
+        with get_query_connection().cursor() as cursor:
+            for sql in sqls:
+                samples = []
+                for _ in range(repeat):
+                    started = time.perf_counter()
+                    cursor.execute(sql)
+                    cursor.fetchall()
+                    samples.append((time.perf_counter() - started) * 1000)
+                timings[sql] = statistics.median(samples)
+        return timings
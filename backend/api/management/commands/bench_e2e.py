@@ -0,0 +1,250 @@
+import datetime
+import json
+import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.test import Client
+from django.test.utils import override_settings
+
+from api import views
+from api.cache import question_cache
+from api.evaluation import load_test_set, resolve_test_set
+from api.retrieval import retrieval_index
+
+from ._stub_model import CannedModelClient, canned_answers, stub_model_pool
+
+ENDPOINTS = ("ask", "schema", "evaluate")
+# Lower is better for these metrics, higher for the rest (throughput).
+_LOWER_IS_BETTER = ("p50", "p95", "p99")
+
+_stages = threading.local()
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {"p50": None, "p95": None, "p99": None}
+    pick = lambda fraction: round(values[min(len(values) - 1, int(fraction * len(values)))] * 1000, 2)
+    return {"p50": pick(0.50), "p95": pick(0.95), "p99": pick(0.99)}
+
+
+def _timed(stage, function):
+    # Attributes time spent in `function` to the current request's stage timings.
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return function(*args, **kwargs)
+        finally:
+            timings = getattr(_stages, "current", None)
+            if timings is not None:
+                timings[stage] = timings.get(stage, 0.0) + time.perf_counter() - started
+    return wrapper
+
+
+def _git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+class Command(BaseCommand):
+    help = (
+        "End-to-end benchmark of /api/ask/, /api/schema/ and /api/evaluate/ against a stubbed "
+        "model Space; prints a table and writes JSON results that can be compared between commits."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--endpoints", nargs="+", choices=ENDPOINTS, default=list(ENDPOINTS))
+        parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint (ask, schema).")
+        parser.add_argument("--concurrency", type=int, default=8, help="Requests in flight.")
+        parser.add_argument("--model-latency", type=float, default=0.2, help="Seconds per stubbed model call.")
+        parser.add_argument(
+            "--model-url",
+            help="Use a running stub Space (hf_app/stub_space.py) over HTTP instead of the in-process stub.",
+        )
+        parser.add_argument("--test-set", default="default", help="Questions to ask, and the set to evaluate.")
+        parser.add_argument(
+            "--question-cache", action="store_true",
+            help="Keep the question cache on (repeated questions then skip the model).",
+        )
+        parser.add_argument(
+            "--retrieval", action="store_true",
+            help="Keep the retrieval fast path on (test-set questions found in train.json then skip the model).",
+        )
+        parser.add_argument("--output", help="Write the results as JSON to this file.")
+        parser.add_argument("--compare", help="Baseline JSON from an earlier run to diff against.")
+        parser.add_argument(
+            "--max-regression", type=float, default=None,
+            help="With --compare, exit non-zero if a latency/throughput metric is worse by more than this fraction.",
+        )
+
+    def handle(self, *args, **options):
+        try:
+            questions = [item["question"] for item in load_test_set(resolve_test_set(options["test_set"]))]
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load test set: {e}")
+
+        if options["model_url"]:
+            from gradio_client import Client as GradioClient
+            client_factory = lambda: GradioClient(options["model_url"], verbose=False)
+        else:
+            answers = canned_answers(options["test_set"])
+            client_factory = lambda: CannedModelClient(options["model_latency"], answers)
+
+        original_max_entries = question_cache.max_entries
+        original_retrieval = retrieval_index.enabled
+        original_views = views.generate_sql, views.execute_query
+        if not options["question_cache"]:
+            question_cache.clear()
+            question_cache.max_entries = 0
+        # Off by default so /api/ask/ measures the model path, not answers looked up in train.json.
+        retrieval_index.enabled = options["retrieval"]
+        views.generate_sql = _timed("model", views.generate_sql)
+        views.execute_query = _timed("execute", views.execute_query)
+        results = {}
+        try:
+            with tempfile.TemporaryDirectory() as runs_dir, \
+                    stub_model_pool(client_factory, size=options["concurrency"]), \
+                    override_settings(ALLOWED_HOSTS=["testserver"], EVALUATION_RUNS_DIR=runs_dir):
+                for endpoint in options["endpoints"]:
+                    if endpoint == "evaluate":
+                        results[endpoint] = self._bench_evaluate(options["test_set"])
+                    else:
+                        results[endpoint] = self._bench_requests(endpoint, questions, options)
+        finally:
+            question_cache.max_entries = original_max_entries
+            retrieval_index.enabled = original_retrieval
+            views.generate_sql, views.execute_query = original_views
+
+        report = {
+            "meta": {
+                "commit": _git_commit(),
+                "timestamp": datetime.datetime.now(datetime.timezone.utc).isoformat(),
+                "options": {
+                    key: options[key] for key in (
+                        "endpoints", "requests", "concurrency", "model_latency", "model_url",
+                        "test_set", "question_cache", "retrieval",
+                    )
+                },
+            },
+            "results": results,
+        }
+        self._print(results)
+        if options["output"]:
+            with open(options["output"], "w", encoding="utf-8") as f:
+                json.dump(report, f, indent=2)
+            self.stdout.write(f"Results written to {options['output']}")
+        if options["compare"]:
+            self._compare(results, options["compare"], options["max_regression"])
+
+    def _bench_requests(self, endpoint, questions, options):
+        def one(index):
+            _stages.current = {}
+            started = time.perf_counter()
+            if endpoint == "ask":
+                response = Client().post(
+                    "/api/ask/", {"question": questions[index % len(questions)]}, content_type="application/json"
+                )
+            else:
+                response = Client().get("/api/schema/")
+            elapsed = time.perf_counter() - started
+            ok = response.status_code == 200 and "error" not in response.json()
+            return elapsed, ok, _stages.current
+
+        retrieval_hits = retrieval_index.stats()["hits"]
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options["concurrency"]) as executor:
+            outcomes = list(executor.map(one, range(options["requests"])))
+        elapsed = time.perf_counter() - started
+
+        stage_names = sorted({stage for _, _, stages in outcomes for stage in stages})
+        return {
+            "requests": len(outcomes),
+            "ok": sum(1 for _, ok, _ in outcomes if ok),
+            # Requests answered by the retrieval fast path instead of the (stubbed) model.
+            "retrieval_hits": retrieval_index.stats()["hits"] - retrieval_hits,
+            "elapsed_s": round(elapsed, 3),
+            "throughput_rps": round(len(outcomes) / elapsed, 2),
+            "latency_ms": _percentiles([latency for latency, _, _ in outcomes]),
+            "stages_ms": {
+                stage: _percentiles([stages[stage] for _, _, stages in outcomes if stage in stages])
+                for stage in stage_names
+            },
+        }
+
+    def _bench_evaluate(self, test_set):
+        client = Client()
+        started = time.perf_counter()
+        response = client.post("/api/evaluate/", {"test_set": test_set}, content_type="application/json")
+        if response.status_code != 202:
+            raise CommandError(f"Could not start an evaluation run: {response.json()}")
+        run_id = response.json()["run_id"]
+        while True:
+            report = client.get(f"/api/evaluate/{run_id}/").json()
+            if report["status"] in ("completed", "failed"):
+                break
+            time.sleep(0.05)
+        elapsed = time.perf_counter() - started
+
+        items = report["detailed_results"]
+        latencies = lambda stage: _percentiles([
+            item["latency_ms"][stage] / 1000 for item in items if stage in item["latency_ms"]
+        ])
+        return {
+            "status": report["status"],
+            "items": report["completed"],
+            "elapsed_s": round(elapsed, 3),
+            "throughput_items_per_s": round(report["completed"] / elapsed, 2),
+            "accuracy_percent": float(report["overall_accuracy_percent"].rstrip("%")),
+            "latency_ms": latencies("total"),
+            "stages_ms": {"predict": latencies("predict"), "execute": latencies("execute")},
+        }
+
+    def _print(self, results):
+        self.stdout.write(
+            f"{'endpoint':>9} {'n':>6} {'ok':>6} {'per_s':>8} {'p50_ms':>9} {'p95_ms':>9} {'p99_ms':>9}  stages p50_ms"
+        )
+        for endpoint, result in results.items():
+            count = result.get("requests", result.get("items"))
+            ok = result.get("ok", result.get("accuracy_percent"))
+            throughput = result.get("throughput_rps", result.get("throughput_items_per_s"))
+            latency = result["latency_ms"]
+            stages = " ".join(f"{stage}={timings['p50']}" for stage, timings in result["stages_ms"].items())
+            self.stdout.write(
+                f"{endpoint:>9} {count:>6} {ok:>6} {throughput:>8.1f} "
+                f"{latency['p50']:>9} {latency['p95']:>9} {latency['p99']:>9}  {stages}"
+            )
+
+    def _compare(self, results, baseline_path, max_regression):
+        with open(baseline_path, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+        regressions = []
+        self.stdout.write(f"Compared with {baseline_path}:")
+        for endpoint, result in results.items():
+            if endpoint not in baseline:
+                continue
+            metrics = [(f"latency {name}", result["latency_ms"][name], baseline[endpoint]["latency_ms"][name])
+                       for name in _LOWER_IS_BETTER]
+            for key in ("throughput_rps", "throughput_items_per_s"):
+                if key in result:
+                    metrics.append((key, result[key], baseline[endpoint][key]))
+
+            for name, current, previous in metrics:
+                if not current or not previous:
+                    continue
+                change = (current - previous) / previous
+                worse = -change if name.startswith("throughput") else change
+                self.stdout.write(f"  {endpoint:>9} {name:<24} {previous:>10} -> {current:>10} ({change:+.1%})")
+                if max_regression is not None and worse > max_regression:
+                    regressions.append(f"{endpoint} {name}")
+
+        if regressions:
+            raise CommandError(f"Regressed beyond {max_regression:.0%}: {', '.join(regressions)}")
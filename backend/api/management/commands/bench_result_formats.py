@@ -0,0 +1,56 @@
+import datetime
+import decimal
+import time
+
+from django.core.management.base import BaseCommand
+from rest_framework.renderers import JSONRenderer
+
+from api.renderers import ArrowIPCRenderer, ColumnarJSONRenderer, pyarrow
+
+
+def _synthetic_rows(count):
+    start = datetime.date(2024, 1, 1)
+    return [
+        (
+            index,
+            f"Customer {index % 5000}",
+            decimal.Decimal(f"{index % 9000 / 100:.2f}"),
+            start + datetime.timedelta(days=index % 365),
+            index % 8 + 1,
+        )
+        for index in range(count)
+    ]
+
+
+class Command(BaseCommand):
+    help = "Compare serialization time and payload size of the /api/ask/ result formats."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--rows", type=int, nargs="+", default=[10_000, 100_000, 1_000_000])
+
+    def handle(self, *args, **options):
+        columns = ["id", "name", "price", "order_date", "quantity"]
+        self.stdout.write(f"{'rows':>9} {'format':>9} {'ms':>10} {'bytes':>13}")
+
+        for count in options["rows"]:
+            rows = _synthetic_rows(count)
+            base = {"columns": columns, "sql": "SELECT ...", "truncated": False}
+
+            formats = [
+                # Records layout includes building the per-row dicts, as execute_query does.
+                ("records", lambda: JSONRenderer().render(
+                    dict(base, data=[dict(zip(columns, row)) for row in rows])
+                )),
+                ("columnar", lambda: ColumnarJSONRenderer().render(dict(base, rows=rows))),
+            ]
+            if pyarrow is not None:
+                formats.append(("arrow", lambda: ArrowIPCRenderer().render(dict(base, rows=rows))))
+
+            for name, render in formats:
+                start = time.perf_counter()
+                payload = render()
+                elapsed = (time.perf_counter() - start) * 1000
+                self.stdout.write(f"{count:>9} {name:>9} {elapsed:>10.1f} {len(payload):>13,}")
+
+        if pyarrow is None:
+            self.stdout.write("pyarrow is not installed; Arrow IPC was skipped.")
@@ -0,0 +1,139 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.pruning import SYNONYMS, SchemaIndex
+from api.schema import SchemaSnapshot
+
+MODULES = (
+    "sales", "crm", "billing", "inventory", "hr", "shipping", "support", "marketing", "finance", "procurement",
+    "payroll", "retail", "wholesale", "catalog", "logistics", "analytics", "legal", "fleet", "events", "loyalty",
+    "warranty", "returns", "pricing", "tax", "audit", "rental", "booking", "training", "compliance", "facilities",
+)
+ENTITIES = (
+    "customer", "product", "order", "invoice", "shipment", "warehouse", "employee", "department", "payment",
+    "refund", "ticket", "campaign", "supplier", "contract", "vehicle", "driver", "store", "region", "coupon",
+    "subscription", "account", "budget", "asset", "vendor", "project", "task", "course", "room", "reservation",
+    "claim", "policy", "batch", "carrier", "route", "lead", "opportunity", "quote", "receipt", "voucher", "member",
+)
+ATTRIBUTES = (
+    "status", "amount", "created_at", "updated_at", "city", "email", "price", "quantity", "title", "description",
+    "code", "phone", "country", "score", "priority", "balance", "weight", "currency", "rating", "notes",
+)
+# Reverse of the built-in synonyms, to phrase some questions the way users do.
+_SYNONYM_FOR = {}
+for _word, _targets in SYNONYMS.items():
+    for _target in _targets:
+        _SYNONYM_FOR.setdefault(_target, []).append(_word)
+
+
+def synthetic_schema(table_count, rng):
+    """`table_count` tables named <module>_<entity>, each referencing 0-3 tables of its module."""
+    names = [f"{module}_{entity}" for module in MODULES for entity in ENTITIES]
+    rng.shuffle(names)
+    names = sorted(names[:table_count])
+    by_module = {}
+    for name in names:
+        by_module.setdefault(name.split("_", 1)[0], []).append(name)
+
+    tables, foreign_keys = [], []
+    for name in names:
+        module = name.split("_", 1)[0]
+        fields = [("id", "BigAutoField"), ("name", "CharField")]
+        fields += [(attribute, "CharField") for attribute in rng.sample(ATTRIBUTES, rng.randint(3, 8))]
+        others = [other for other in by_module[module] if other != name]
+        for other in rng.sample(others, min(len(others), rng.randint(0, 3))):
+            field = other.split("_", 1)[1]
+            fields.append((field, "ForeignKey"))
+            foreign_keys.append((name, field, other))
+        tables.append((name, fields))
+    return SchemaSnapshot(tables, foreign_keys)
+
+
+def _entity_phrase(table, rng):
+    module, entity = table.split("_", 1)
+    if entity in _SYNONYM_FOR and rng.random() < 0.5:
+        entity = rng.choice(_SYNONYM_FOR[entity])
+    return f"{module} {entity}s" if rng.random() < 0.8 else f"{entity}s"
+
+
+def synthetic_questions(snapshot, count, rng):
+    """[(question, gold tables), ...]: single-table filters and joins along foreign keys."""
+    fields = {table: [name for name, _ in table_fields[2:]] for table, table_fields in snapshot.tables}
+    references = {}
+    for table, _, referenced in snapshot.foreign_keys:
+        references.setdefault(table, []).append(referenced)
+
+    questions = []
+    for _ in range(count):
+        table = rng.choice(snapshot.table_names)
+        attribute = rng.choice(fields[table]).replace("_", " ")
+        if table in references and rng.random() < 0.5:
+            parent = rng.choice(references[table])
+            parent_attribute = rng.choice(fields[parent]).replace("_", " ")
+            question = (
+                f"List {_entity_phrase(table, rng)} with their {parent.split('_', 1)[1]} "
+                f"{parent_attribute} sorted by {attribute}"
+            )
+            questions.append((question, {table, parent}))
+        else:
+            questions.append((f"Show {_entity_phrase(table, rng)} where {attribute} is above 10", {table}))
+    return questions
+
+
+def _percentile_ms(values, fraction):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(fraction * len(values)))] * 1000
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark backend schema pruning on a synthetic schema: recall of the tables each question "
+        "needs, tables and payload sent, and pruning latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--tables", type=int, default=1000)
+        parser.add_argument("--questions", type=int, default=500)
+        parser.add_argument("--top-k", type=int, nargs="+", default=[3, 5, 10])
+        parser.add_argument("--seed", type=int, default=0)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        snapshot = synthetic_schema(options["tables"], rng)
+        questions = synthetic_questions(snapshot, options["questions"], rng)
+
+        started = time.perf_counter()
+        index = SchemaIndex(snapshot)
+        build_ms = (time.perf_counter() - started) * 1000
+        full_payload = len(snapshot.columns_payload)
+        self.stdout.write(
+            f"{len(snapshot.tables)} tables, {len(snapshot.all_columns)} columns, "
+            f"{len(snapshot.foreign_keys)} foreign keys; index built in {build_ms:.1f}ms; "
+            f"full payload {full_payload / 1024:.0f}KB"
+        )
+        self.stdout.write(
+            f"{'top_k':>5} {'recall':>7} {'table_recall':>12} {'tables':>7} {'payload':>8} "
+            f"{'p50_ms':>7} {'p95_ms':>7} {'max_ms':>7}"
+        )
+        for top_k in options["top_k"]:
+            latencies, sent, payloads = [], [], []
+            complete = found = needed = 0
+            for question, gold in questions:
+                started = time.perf_counter()
+                pruned = index.prune(question, top_k)
+                latencies.append(time.perf_counter() - started)
+                selected = set(pruned.table_names)
+                complete += gold <= selected
+                found += len(gold & selected)
+                needed += len(gold)
+                sent.append(len(selected))
+                payloads.append(len(pruned.columns_payload))
+            self.stdout.write(
+                f"{top_k:>5} {complete / len(questions):>7.1%} {found / needed:>12.1%} "
+                f"{statistics.mean(sent):>7.1f} {statistics.mean(payloads) / full_payload:>8.1%} "
+                f"{_percentile_ms(latencies, 0.5):>7.3f} {_percentile_ms(latencies, 0.95):>7.3f} "
+                f"{max(latencies) * 1000:>7.3f}"
+            )
@@ -0,0 +1,74 @@
+import re
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.sql import prepare_query
+
+
+def legacy_apply_collation(sql_query, text_columns):
+    """
+    The per-column regex loop that execute_query used before api.sql, as it
+    was meant to work. The shipped pattern doubled its backslashes inside raw
+    strings, so it only matched literal backslashes and never rewrote anything;
+    timing that copy would compare against a no-op.
+    """
+    updated_query = sql_query
+    for column in text_columns:
+        pattern = re.compile(
+            rf"(?P<qual>(?:\b\w+\.)?)"
+            rf"(?P<col>{re.escape(column)})"
+            r"(?!\s+collate\s+nocase)"
+            r"\s*=\s*"
+            r"(?P<val>'[^']*'|\"[^\"]*\")",
+            re.IGNORECASE,
+        )
+        updated_query = pattern.sub(
+            lambda match: (
+                f"{match.group('qual')}{match.group('col')} COLLATE NOCASE = {match.group('val')}"
+            ),
+            updated_query,
+        )
+    return updated_query
+
+
+def _time(fn, repeats):
+    start = time.perf_counter()
+    for _ in range(repeats):
+        fn()
+    return (time.perf_counter() - start) / repeats
+
+
+class Command(BaseCommand):
+    help = "Micro-benchmark the single-pass SQL rewrite against the legacy per-column regex loop."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--columns", type=int, nargs="+", default=[5, 50, 500, 2000],
+            help="Number of text columns in the synthetic schema.",
+        )
+        parser.add_argument("--repeats", type=int, default=200)
+
+    def handle(self, *args, **options):
+        query = (
+            "SELECT c.name, c.email FROM api_customer c "
+            "JOIN api_order o ON o.customer_id = c.id "
+            "WHERE c.city = 'axum' AND c.name = 'abebe' AND o.quantity > 2 "
+            "ORDER BY c.name LIMIT 50"
+        )
+        self.stdout.write(f"{'columns':>8} {'legacy_us':>12} {'single_pass_us':>15} {'speedup':>8}")
+        for width in options["columns"]:
+            text_columns = ["name", "email", "city"] + [f"col_{i}" for i in range(max(width - 3, 0))]
+            text_column_set = frozenset(text_columns)
+            repeats = options["repeats"]
+
+            legacy_sql = legacy_apply_collation(query, text_columns)
+            single_pass_sql = prepare_query(query, text_column_set)
+            if legacy_sql != single_pass_sql:
+                raise CommandError(f"Rewrites differ:\n  legacy:      {legacy_sql}\n  single pass: {single_pass_sql}")
+
+            legacy = _time(lambda: legacy_apply_collation(query, text_columns), repeats)
+            single_pass = _time(lambda: prepare_query(query, text_column_set), repeats)
+            self.stdout.write(
+                f"{width:>8} {legacy * 1e6:>12.1f} {single_pass * 1e6:>15.1f} {legacy / single_pass:>7.1f}x"
+            )
@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from api.evaluation import EvaluationRun, load_run_state
+
+
+class Command(BaseCommand):
+    help = "Run (or resume) an execution-accuracy evaluation of the model over a JSON test set."
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--test-set", default="default",
+            help="Name from EVALUATION_TEST_SETS (e.g. default, train) or a path to a JSON file.",
+        )
+        parser.add_argument("--workers", type=int, default=None, help="Concurrent predictions.")
+        parser.add_argument("--resume", metavar="RUN_ID", help="Continue an interrupted run.")
+
+    def handle(self, *args, **options):
+        run_id = options["resume"]
+        if run_id and load_run_state(run_id) is None:
+            raise CommandError(f"No checkpoint found for run {run_id}.")
+
+        try:
+            run = EvaluationRun(run_id=run_id, test_set=options["test_set"], workers=options["workers"])
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Could not load test set: {e}")
+
+        self.stdout.write(f"Run {run.run_id}: {run.state['total']} items, checkpoint {run.path}")
+        report = run.run(
+            on_progress=lambda done, total: self.stdout.write(f"  {done}/{total}", ending="\r")
+        )
+        self.stdout.write("")
+
+        for result in report["detailed_results"]:
+            self.stdout.write(f"[{result['status']}] {result['question']}")
+        latency = report["latency_ms"]
+        self.stdout.write(
+            f"Accuracy: {report['overall_accuracy_percent']}  "
+            f"latency p50={latency['p50']}ms p95={latency['p95']}ms  "
+            f"throughput={report['throughput_items_per_second']} items/s"
+        )
+        self.stdout.write(self.style.SUCCESS(f"Evaluation {run.run_id} completed."))
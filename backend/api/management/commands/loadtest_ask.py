@@ -0,0 +1,80 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand
+from django.test import AsyncClient, Client
+from django.test.utils import override_settings
+
+from ._stub_model import CannedModelClient, stub_model_pool
+
+
+def _summary(mode, latencies, elapsed, statuses):
+    latencies = sorted(latencies)
+    ok = sum(1 for status in statuses if status == 200)
+    return (
+        f"{mode:>5} {len(latencies):>8} {ok:>5} {elapsed:>9.2f} {len(latencies) / elapsed:>9.1f} "
+        f"{latencies[len(latencies) // 2] * 1000:>9.0f} {latencies[int(len(latencies) * 0.95)] * 1000:>9.0f}"
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        "In-process load test of /api/ask/ (WSGI, fixed thread pool) against "
+        "/api/ask/async/ (one event loop) with a simulated model latency."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--requests", type=int, default=200)
+        parser.add_argument("--concurrency", type=int, default=100, help="Requests in flight from the client side.")
+        parser.add_argument("--wsgi-workers", type=int, default=8, help="Threads serving the WSGI path.")
+        parser.add_argument("--model-latency", type=float, default=0.5, help="Seconds per simulated model call.")
+
+    def handle(self, *args, **options):
+        total = options["requests"]
+        concurrency = options["concurrency"]
+        latency = options["model_latency"]
+
+        with stub_model_pool(lambda: CannedModelClient(latency), size=options["wsgi_workers"]):
+            with override_settings(ALLOWED_HOSTS=["testserver"]):
+                self.stdout.write(
+                    f"{'mode':>5} {'requests':>8} {'ok':>5} {'elapsed_s':>9} {'req_per_s':>9} {'p50_ms':>9} {'p95_ms':>9}"
+                )
+                self.stdout.write(self._run_wsgi(total, min(concurrency, options["wsgi_workers"])))
+                self.stdout.write(self._run_asgi(total, concurrency))
+
+    def _run_wsgi(self, total, workers):
+        # Like a sync server with `workers` threads: each request holds one for its whole duration.
+        def one(index, submitted):
+            response = Client().post(
+                "/api/ask/", {"question": f"wsgi load test {index}"}, content_type="application/json"
+            )
+            return time.perf_counter() - submitted, response.status_code
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            futures = [executor.submit(one, index, time.perf_counter()) for index in range(total)]
+            results = [future.result() for future in futures]
+        elapsed = time.perf_counter() - started
+        return _summary("wsgi", [r[0] for r in results], elapsed, [r[1] for r in results])
+
+    def _run_asgi(self, total, concurrency):
+        async def run():
+            client = AsyncClient()
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def one(index):
+                submitted = time.perf_counter()
+                async with semaphore:
+                    response = await client.post(
+                        "/api/ask/async/", {"question": f"asgi load test {index}"},
+                        content_type="application/json",
+                    )
+                return time.perf_counter() - submitted, response.status_code
+
+            started = time.perf_counter()
+            results = await asyncio.gather(*(one(index) for index in range(total)))
+            return results, time.perf_counter() - started
+
+        results, elapsed = asyncio.run(run())
+        return _summary("asgi", [r[0] for r in results], elapsed, [r[1] for r in results])
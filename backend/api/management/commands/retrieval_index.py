@@ -0,0 +1,101 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+
+from api.evaluation import compare_query_results, load_test_set, resolve_test_set
+from api.retrieval import retrieval_index
+from api.schema import schema_registry
+from api.services import add_validated_pair
+
+
+class Command(BaseCommand):
+    help = (
+        "Build the retrieval fast path index over known question/SQL pairs, add validated pairs, "
+        "and measure its hit rate, accuracy and lookup latency at different thresholds."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--add", nargs=2, metavar=("QUESTION", "SQL"), help="Add a validated pair.")
+        parser.add_argument(
+            "--evaluate", action="store_true",
+            help="Leave-one-out over the known pairs: each question is looked up against all the others.",
+        )
+        parser.add_argument(
+            "--test-set", help="Also look up the questions of this test set and check hits against its gold SQL.",
+        )
+        parser.add_argument(
+            "--thresholds", nargs="+", type=float, default=None,
+            help="Similarity thresholds to evaluate (default: the configured RETRIEVAL_THRESHOLD).",
+        )
+
+    def handle(self, *args, **options):
+        if options["add"]:
+            question, sql = options["add"]
+            error = add_validated_pair(question, sql)
+            if error:
+                raise CommandError(error)
+            self.stdout.write(self.style.SUCCESS(f"Added: {question!r} -> {sql}"))
+
+        started = time.perf_counter()
+        retrieval_index.reload()
+        stats = retrieval_index.stats()
+        self.stdout.write(
+            f"Indexed {stats['entries']} pairs in {(time.perf_counter() - started) * 1000:.1f}ms "
+            f"(threshold {stats['threshold']})."
+        )
+        if not (options["evaluate"] or options["test_set"]):
+            return
+
+        table_names = schema_registry.get().table_names
+        test_set = None
+        if options["test_set"]:
+            try:
+                test_set = load_test_set(resolve_test_set(options["test_set"]))
+            except (OSError, ValueError) as e:
+                raise CommandError(f"Could not load test set: {e}")
+
+        configured = retrieval_index.threshold
+        self.stdout.write(f"{'set':>13} {'threshold':>9} {'n':>5} {'hits':>5} {'hit_rate':>8} {'correct':>8}")
+        try:
+            for threshold in options["thresholds"] or [configured]:
+                retrieval_index.threshold = threshold
+                if options["evaluate"]:
+                    outcomes = [
+                        (match, match is not None and _same_sql(match.sql, gold_sql))
+                        for _, gold_sql, match in retrieval_index.leave_one_out(table_names)
+                    ]
+                    self._row("leave-one-out", threshold, outcomes)
+                if test_set is not None:
+                    outcomes = []
+                    for item in test_set:
+                        match = retrieval_index.lookup(item["question"], schema_registry.get())
+                        correct = match is not None and compare_query_results(match.sql, item["gold_sql"])[0]
+                        outcomes.append((match, correct))
+                    self._row(options["test_set"], threshold, outcomes)
+        finally:
+            retrieval_index.threshold = configured
+
+        if test_set is not None:
+            latencies = []
+            for item in test_set:
+                lookup_started = time.perf_counter()
+                retrieval_index.lookup(item["question"], schema_registry.get())
+                latencies.append((time.perf_counter() - lookup_started) * 1000)
+            self.stdout.write(
+                f"Lookup latency: median {statistics.median(latencies):.3f}ms, max {max(latencies):.3f}ms "
+                "(model latency on misses is reported by /api/cache/ at runtime)."
+            )
+
+    def _row(self, name, threshold, outcomes):
+        hits = sum(1 for match, _ in outcomes if match is not None)
+        correct = sum(1 for _, is_correct in outcomes if is_correct)
+        self.stdout.write(
+            f"{name:>13} {threshold:>9} {len(outcomes):>5} {hits:>5} "
+            f"{hits / len(outcomes) if outcomes else 0:>8.1%} "
+            f"{f'{correct / hits:.1%}' if hits else '-':>8}"
+        )
+
+
+def _same_sql(first, second):
+    return " ".join(first.lower().split()) == " ".join(second.lower().split())
@@ -1,16 +1,46 @@
+import datetime
+import decimal
+import itertools
 import random
+import time
 
 from django.core.management.base import BaseCommand
-from django.db import transaction
+from django.core.management.color import no_style
+from django.db import connection, transaction
 
 from api.models import Customer, Order, Product
+from api.versions import bulk_write
+
+
+CENT = decimal.Decimal("0.01")
+# Orders are dated within the two years before a fixed end date, so seeds reproduce.
+ORDER_DATES = [(datetime.date(2025, 12, 31) - datetime.timedelta(days=days)).isoformat() for days in range(730)]
+
+
+def _zipf_cum_weights(count, skew):
+    """Cumulative weights 1/rank**skew for `random.choices`; None (uniform) when skew is 0."""
+    if not skew or not count:
+        return None
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, count + 1)))
 
 
 class Command(BaseCommand):
     help = "Clear all data and populate the database with mock data."
 
+    def add_arguments(self, parser):
+        parser.add_argument("--customers", type=int, default=20)
+        parser.add_argument("--products", type=int, default=20)
+        parser.add_argument("--orders", type=int, default=20)
+        parser.add_argument("--seed", type=int, default=0, help="Same seed and options, same data.")
+        parser.add_argument(
+            "--distribution", choices=["uniform", "skewed"], default="uniform",
+            help="skewed: Zipf-distributed cities, and orders concentrated on a few customers/products.",
+        )
+        parser.add_argument("--skew", type=float, default=1.1, help="Zipf exponent for --distribution skewed.")
+        parser.add_argument("--chunk-size", type=int, default=50_000, help="Rows per insert batch.")
+
     def handle(self, *args, **options):
-        rng = random.Random()
+        rng = random.Random(options["seed"])
         names = [
             "Abebe", "Alemu", "Bekele", "Dawit", "Elias", "Fikre", "Girma",
             "Hailu", "Kebede", "Lemma", "Mulu", "Solomon", "Tadesse", "Tsegaye",
@@ -50,37 +80,87 @@ class Command(BaseCommand):
             {"name": "Aloe Skin Balm", "price": "7.95", "category": "Personal Care"},
         ]
 
+        customers, products, orders = options["customers"], options["products"], options["orders"]
+        chunk_size = options["chunk_size"]
+        skew = options["skew"] if options["distribution"] == "skewed" else 0.0
+
+        city_weights = _zipf_cum_weights(len(cities), skew)
+
+        def customer_rows(start, count):
+            picked_names = rng.choices(names, k=count)
+            picked_cities = rng.choices(cities, cum_weights=city_weights, k=count)
+            return [
+                (index, name, f"{name.lower()}.{index}@example.com", city)
+                for index, name, city in zip(range(start + 1, start + count + 1), picked_names, picked_cities)
+            ]
+
+        def product_rows(start, count):
+            rows = []
+            for index in range(start + 1, start + count + 1):
+                data = product_data[(index - 1) % len(product_data)]
+                if index <= len(product_data):
+                    rows.append((index, data["name"], data["price"], data["category"]))
+                else:
+                    # Long tail: variants of the catalogue with jittered prices.
+                    price = decimal.Decimal(data["price"]) * decimal.Decimal(rng.uniform(0.6, 1.6))
+                    rows.append((index, f"{data['name']} #{index}", str(price.quantize(CENT)), data["category"]))
+            return rows
+
+        # Low ids are the popular customers/products when the distribution is skewed.
+        customer_weights = _zipf_cum_weights(customers, skew)
+        product_weights = _zipf_cum_weights(products, skew)
+        customer_ids = range(1, customers + 1)
+        product_ids = range(1, products + 1)
+        quantities = range(1, 9)
+
+        def order_rows(start, count):
+            return list(zip(
+                range(start + 1, start + count + 1),
+                rng.choices(customer_ids, cum_weights=customer_weights, k=count),
+                rng.choices(product_ids, cum_weights=product_weights, k=count),
+                rng.choices(ORDER_DATES, k=count),
+                rng.choices(quantities, k=count),
+            ))
+
+        # One transaction for the whole reseed: a failure part-way leaves the
+        # previous data (and sequences) as they were, never a half-seeded database.
         with transaction.atomic():
-            Order.objects.all().delete()
-            Product.objects.all().delete()
-            Customer.objects.all().delete()
-
-            customers = []
-            for index in range(20):
-                name = rng.choice(names)
-                customers.append(
-                    Customer(
-                        name=name,
-                        email=f"{name.lower()}.{index}@example.com",
-                        city=rng.choice(cities),
-                    )
-                )
-            Customer.objects.bulk_create(customers)
-            customers = list(Customer.objects.all())
-
-            products = [Product(**data) for data in product_data[:20]]
-            Product.objects.bulk_create(products)
-            products = list(Product.objects.all())
-
-            orders = []
-            for _ in range(20):
-                orders.append(
-                    Order(
-                        customer=rng.choice(customers),
-                        product=rng.choice(products),
-                        quantity=rng.randint(1, 8),
-                    )
-                )
-            Order.objects.bulk_create(orders)
+            with connection.cursor() as cursor:
+                # Raw deletes: the ORM would load every row to send post_delete signals.
+                for model in (Order, Product, Customer):
+                    cursor.execute(f"DELETE FROM {connection.ops.quote_name(model._meta.db_table)}")
 
+            self._load(Customer, ["id", "name", "email", "city"], customers, customer_rows, chunk_size)
+            self._load(Product, ["id", "name", "price", "category"], products, product_rows, chunk_size)
+            self._load(
+                Order, ["id", "customer_id", "product_id", "order_date", "quantity"],
+                orders if customers and products else 0, order_rows, chunk_size,
+            )
+
+            with connection.cursor() as cursor:
+                # Rows were inserted with explicit ids; move the sequences past them.
+                for sql in connection.ops.sequence_reset_sql(no_style(), [Customer, Product, Order]):
+                    cursor.execute(sql)
+
+        # Raw inserts send no post_save signals
+        bulk_write.send(
+            sender=self.__class__, tables=[model._meta.db_table for model in (Customer, Product, Order)]
+        )
         self.stdout.write(self.style.SUCCESS("Mock data created."))
+
+    def _load(self, model, columns, total, make_rows, chunk_size):
+        """Inserts `total` rows in chunks of `chunk_size` (one executemany each, inside the caller's transaction)."""
+        quote = connection.ops.quote_name
+        sql = (
+            f"INSERT INTO {quote(model._meta.db_table)} ({', '.join(quote(column) for column in columns)}) "
+            f"VALUES ({', '.join(['%s'] * len(columns))})"
+        )
+        started = time.perf_counter()
+        for start in range(0, total, chunk_size):
+            rows = make_rows(start, min(chunk_size, total - start))
+            with connection.cursor() as cursor:
+                cursor.executemany(sql, rows)
+            done = start + len(rows)
+            rate = done / max(time.perf_counter() - started, 1e-9)
+            self.stdout.write(f"  {model._meta.db_table}: {done:,}/{total:,} ({rate:,.0f} rows/s)", ending="\r")
+        self.stdout.write(f"  {model._meta.db_table}: {total:,} rows in {time.perf_counter() - started:.1f}s".ljust(60))
@@ -0,0 +1,54 @@
+import time
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+
+from .timing import metrics, record_stage, server_timing, start_request
+
+
+class ServerTimingMiddleware:
+    """
+    Returns the stage timings recorded while serving a request (schema,
+    retrieve, prune, generate, model, rewrite, results, plan, execute,
+    serialize) in a `Server-Timing` header, and feeds the per-view request
+    metrics behind /metrics.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        if iscoroutinefunction(self.get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        started = time.perf_counter()
+        stages = start_request()
+        response = self.get_response(request)
+        return self._finish(request, response, started, stages)
+
+    async def __acall__(self, request):
+        started = time.perf_counter()
+        stages = start_request()
+        response = await self.get_response(request)
+        return self._finish(request, response, started, stages)
+
+    def process_template_response(self, request, response):
+        # Called right before DRF renders the response body.
+        request._render_started = time.perf_counter()
+        return response
+
+    def _finish(self, request, response, started, stages):
+        finished = time.perf_counter()
+        render_started = getattr(request, "_render_started", None)
+        if render_started is not None:
+            record_stage("serialize", finished - render_started)
+        total = finished - started
+        response["Server-Timing"] = server_timing(dict(stages, total=total))
+
+        view = request.resolver_match.url_name if request.resolver_match else "unmatched"
+        metrics.observe("text_to_sql_request_seconds", total, view=view)
+        metrics.inc("text_to_sql_requests_total", view=view, status=response.status_code)
+        return response
@@ -0,0 +1,18 @@
+from django.core import signing
+
+PAGE_TOKEN_SALT = "api.ask.page"
+
+
+def encode_page_token(sql_query, offset):
+    """
+    Opaque cursor for the next page. It carries the already generated SQL, so
+    following pages skip the model call; the signature stops clients from
+    swapping in their own SQL.
+    """
+    return signing.dumps({"sql": sql_query, "offset": offset}, salt=PAGE_TOKEN_SALT, compress=True)
+
+
+def decode_page_token(token):
+    """Returns (sql, offset); raises `signing.BadSignature` for tampered tokens."""
+    payload = signing.loads(token, salt=PAGE_TOKEN_SALT)
+    return payload["sql"], int(payload["offset"])
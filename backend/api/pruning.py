@@ -0,0 +1,185 @@
+import math
+import re
+import threading
+from collections import OrderedDict, defaultdict
+
+from django.conf import settings
+
+from .cache import normalize_question
+
+_TERM_RE = re.compile(r"[a-z0-9]+")
+
+# Question words -> the schema terms they usually mean (singular, lower-case).
+SYNONYMS = {
+    "client": ("customer",),
+    "buyer": ("customer",),
+    "people": ("customer",),
+    "person": ("customer",),
+    "user": ("customer",),
+    "item": ("product",),
+    "good": ("product",),
+    "merchandise": ("product",),
+    "purchase": ("order",),
+    "purchased": ("order",),
+    "ordered": ("order",),
+    "bought": ("order",),
+    "sold": ("order",),
+    "sale": ("order",),
+    "transaction": ("order",),
+    "location": ("city",),
+    "live": ("city",),
+    "based": ("city",),
+    "cost": ("price",),
+    "priced": ("price",),
+    "expensive": ("price",),
+    "cheap": ("price",),
+    "cheaper": ("price",),
+    "contact": ("email",),
+    "mail": ("email",),
+    "recent": ("date",),
+    "latest": ("date",),
+    "bulk": ("quantity",),
+}
+
+TABLE_NAME_WEIGHT = 2.0  # a table named after the term beats one with a column of that name
+SYNONYM_WEIGHT = 0.8
+
+
+def _stem(word):
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 4 and word.endswith("sses"):
+        return word[:-2]
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def terms(text):
+    """'api_order.order_date' / 'Which clients...' -> stemmed lower-case words."""
+    return [_stem(word) for word in _TERM_RE.findall(text.lower())]
+
+
+class SchemaIndex:
+    """
+    Inverted index from table-name, column-name and synonym terms to tables,
+    used to send the model only the tables a question is likely about.
+
+    Tables are ranked by the IDF-weighted terms they share with the question.
+    The top-k are kept, plus tables needed to join them: a table linking two
+    selected tables by foreign keys, and the tables the selected ones
+    reference (api_order -> api_customer, api_product).
+    """
+
+    def __init__(self, snapshot, synonyms=None, subset_cache_size=256):
+        self.snapshot = snapshot
+        self.synonyms = {
+            _stem(word): tuple(_stem(term) for term in targets)
+            for word, targets in {**SYNONYMS, **(synonyms or {})}.items()
+        }
+        postings = defaultdict(dict)
+        for table, fields in snapshot.tables:
+            for name, _ in fields:
+                for term in terms(name):
+                    postings[term][table] = 1.0
+            for term in terms(table):
+                postings[term][table] = TABLE_NAME_WEIGHT
+        table_count = len(snapshot.tables)
+        self._postings = {
+            term: {table: weight * (math.log((table_count + 1) / (len(tables) + 1)) + 1.0)
+                   for table, weight in tables.items()}
+            for term, tables in postings.items()
+        }
+
+        self._references = defaultdict(set)
+        self._neighbours = defaultdict(set)
+        for table, _, referenced in snapshot.foreign_keys:
+            if table != referenced:
+                self._references[table].add(referenced)
+                self._neighbours[table].add(referenced)
+                self._neighbours[referenced].add(table)
+
+        self._subsets = OrderedDict()
+        self._subset_cache_size = subset_cache_size
+        self._lock = threading.Lock()
+
+    def rank(self, question):
+        """[(table, score), ...] for tables sharing at least one term with `question`, best first."""
+        weights = {}
+        for term in terms(normalize_question(question)):
+            weights[term] = 1.0
+            for synonym in self.synonyms.get(term, ()):
+                weights.setdefault(synonym, SYNONYM_WEIGHT)
+        scores = defaultdict(float)
+        for term, weight in weights.items():
+            for table, term_weight in self._postings.get(term, {}).items():
+                scores[table] += weight * term_weight
+        return sorted(scores.items(), key=lambda item: (-item[1], item[0]))
+
+    def select(self, question, top_k, max_tables=None):
+        """
+        Table names to send for `question`: every table when the schema has
+        no more than `top_k` or nothing matches, else at most `max_tables`
+        (default 2 * top_k) around the top-k matches.
+        """
+        all_tables = self.snapshot.table_names
+        ranked = self.rank(question)
+        if len(all_tables) <= top_k or not ranked:
+            return all_tables
+        max_tables = max(max_tables or 2 * top_k, top_k)
+        scores = dict(ranked)
+        seeds = [table for table, _ in ranked[:top_k]]
+        seed_set = set(seeds)
+
+        bridges = {
+            table
+            for seed in seeds
+            for table in self._neighbours[seed]
+            if table not in seed_set and len(self._neighbours[table] & seed_set) >= 2
+        }
+        referenced = {table for seed in seeds for table in self._references[seed]} - seed_set - bridges
+        by_score = lambda table: (-scores.get(table, 0.0), table)
+        selected = seeds + sorted(bridges, key=by_score) + sorted(referenced, key=by_score)
+        return tuple(selected[:max_tables])
+
+    def prune(self, question, top_k, max_tables=None):
+        """The snapshot restricted to `select`'s tables (cached per table set)."""
+        tables = frozenset(self.select(question, top_k, max_tables))
+        if len(tables) == len(self.snapshot.table_names):
+            return self.snapshot
+        with self._lock:
+            subset = self._subsets.get(tables)
+            if subset is not None:
+                self._subsets.move_to_end(tables)
+                return subset
+        subset = self.snapshot.subset(tables)
+        with self._lock:
+            self._subsets[tables] = subset
+            while len(self._subsets) > self._subset_cache_size:
+                self._subsets.popitem(last=False)
+        return subset
+
+
+_index = None
+_index_lock = threading.Lock()
+
+
+def get_schema_index(snapshot):
+    """The `SchemaIndex` of `snapshot`, rebuilt when the schema changes."""
+    global _index
+    index = _index
+    if index is None or index.snapshot.fingerprint != snapshot.fingerprint:
+        with _index_lock:
+            if _index is None or _index.snapshot.fingerprint != snapshot.fingerprint:
+                _index = SchemaIndex(snapshot, synonyms=settings.SCHEMA_PRUNING_SYNONYMS)
+            index = _index
+    return index
+
+
+def prune_schema(question, snapshot):
+    """The part of `snapshot` to send with `question` (all of it when pruning is off)."""
+    if settings.SCHEMA_PRUNING_TOP_K <= 0:
+        return snapshot
+    return get_schema_index(snapshot).prune(
+        question, settings.SCHEMA_PRUNING_TOP_K, settings.SCHEMA_PRUNING_MAX_TABLES or None
+    )
@@ -0,0 +1,143 @@
+import datetime
+import decimal
+import json
+
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+except ImportError:  # Arrow output is optional
+    pyarrow = None
+
+
+def _json_value(value):
+    if isinstance(value, decimal.Decimal):
+        return float(value)
+    if isinstance(value, (datetime.date, datetime.time)):
+        return value.isoformat()
+    return value
+
+
+def _encode_column(values):
+    """
+    Converts one result column to JSON-native values.
+
+    The column kind is taken from its first non-null value, so Decimal/date
+    columns are converted with one comprehension instead of going through the
+    encoder's per-object `default()` hook. SQLite columns can mix types
+    (`CASE`, `UNION`); those are converted value by value.
+    """
+    sample = next((value for value in values if value is not None), None)
+    if isinstance(sample, decimal.Decimal):
+        kind = decimal.Decimal
+    elif isinstance(sample, (datetime.date, datetime.time)):
+        kind = (datetime.date, datetime.time)
+    else:
+        return values
+    if not all(value is None or isinstance(value, kind) for value in values):
+        return [_json_value(value) for value in values]
+    if kind is decimal.Decimal:
+        return [None if value is None else float(value) for value in values]
+    return [None if value is None else value.isoformat() for value in values]
+
+
+def _arrow_array(values):
+    """
+    The Arrow array of one result column. pyarrow infers its type; a column
+    mixing types (SQLite allows it) becomes a string column, or binary when
+    it holds blobs.
+    """
+    try:
+        return pyarrow.array(values)
+    except (pyarrow.ArrowInvalid, pyarrow.ArrowTypeError):
+        pass
+    if any(isinstance(value, (bytes, bytearray, memoryview)) for value in values):
+        return pyarrow.array(
+            [
+                None if value is None
+                else bytes(value) if isinstance(value, (bytes, bytearray, memoryview))
+                else str(_json_value(value)).encode("utf-8")
+                for value in values
+            ],
+            type=pyarrow.binary(),
+        )
+    return pyarrow.array(
+        [None if value is None else str(_json_value(value)) for value in values], type=pyarrow.string()
+    )
+
+
+class ColumnarJSONRenderer(BaseRenderer):
+    """
+    `{"columns": [...], "rows": [[...], ...]}`: column names are sent once
+    instead of once per row.
+
+    Expects the result dict built by `execute_query(..., row_format="rows")`.
+    """
+
+    media_type = "application/vnd.text-to-sql.columnar+json"
+    format = "columnar"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if "rows" not in data:
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+        rows = data["rows"]
+        raw_columns = [[row[index] for row in rows] for index in range(len(data["columns"]))]
+        columns = [_encode_column(values) for values in raw_columns]
+        if any(encoded is not raw for encoded, raw in zip(columns, raw_columns)):
+            rows = list(zip(*columns))
+        # Row tuples encode as JSON arrays directly.
+        payload = dict(data, rows=rows)
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=str).encode("utf-8")
+
+
+class ArrowIPCRenderer(BaseRenderer):
+    """
+    Apache Arrow IPC stream of the result rows. Query metadata (`sql`,
+    `truncated`, `next_page_token`) travels in the schema metadata.
+
+    Error payloads have no rows to encode and are sent as plain JSON.
+    """
+
+    media_type = "application/vnd.apache.arrow.stream"
+    format = "arrow"
+    charset = None
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b""
+        if "rows" not in data:
+            response = (renderer_context or {}).get("response")
+            if response is not None:
+                response["Content-Type"] = JSONRenderer.media_type
+            return JSONRenderer().render(data, accepted_media_type, renderer_context)
+
+        columns = data["columns"]
+        rows = data["rows"]
+        # pyarrow converts Decimal/date/datetime columns natively (decimal128, date32, ...).
+        arrays = [_arrow_array([row[index] for row in rows]) for index in range(len(columns))]
+        metadata = {
+            key: str(value)
+            for key, value in data.items()
+            if key not in ("columns", "rows") and value is not None
+        }
+        table = pyarrow.Table.from_arrays(arrays, names=columns, metadata=metadata)
+
+        sink = pyarrow.BufferOutputStream()
+        with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+            writer.write_table(table)
+        return sink.getvalue().to_pybytes()
+
+
+def result_renderer_classes():
+    """Renderers offered by the query endpoints, in negotiation order."""
+    from rest_framework.settings import api_settings
+
+    renderers = list(api_settings.DEFAULT_RENDERER_CLASSES) + [ColumnarJSONRenderer]
+    if pyarrow is not None:
+        renderers.append(ArrowIPCRenderer)
+    return renderers
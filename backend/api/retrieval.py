@@ -0,0 +1,268 @@
+import json
+import math
+import os
+import re
+import threading
+import time
+from collections import Counter, namedtuple
+
+from django.conf import settings
+
+from .cache import normalize_question
+from .sql import tokenize
+
+_WORD_RE = re.compile(r"[\w@.'-]+")
+# Question tokens that pin down a query's result (numbers, emails): a known pair
+# only matches a question that mentions the same ones.
+_SPECIFIC_RE = re.compile(r"\d|@")
+
+RetrievalMatch = namedtuple("RetrievalMatch", ["question", "sql", "score", "source"])
+
+
+def _words(normalized):
+    words = []
+    for word in _WORD_RE.findall(normalized):
+        word = word.strip(".'-")
+        if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+            word = word[:-1]
+        if word:
+            words.append(word)
+    return words
+
+
+def _features(words):
+    features = {f"w:{word}" for word in words}
+    features.update(f"b:{first} {second}" for first, second in zip(words, words[1:]))
+    return features
+
+
+def _sql_facts(sql):
+    """Tables read by `sql` and its literal values (lower-cased, unquoted)."""
+    tokens = [token for token in tokenize(sql) if token.kind not in ("ws", "comment")]
+    tables, literals = set(), set()
+    for previous, token in zip([None] + tokens, tokens):
+        if previous is not None and previous.text.upper() in ("FROM", "JOIN") and token.kind in ("word", "quoted"):
+            tables.add(token.text.strip('"`[]').lower())
+        if token.kind == "string":
+            literals.add(token.text[1:-1].replace("''", "'").lower())
+        elif token.kind == "number":
+            literals.add(token.text)
+    return frozenset(tables), literals
+
+
+class _Pair:
+    __slots__ = ("question", "sql", "source", "words", "features", "tables", "slots", "specific")
+
+    def __init__(self, question, sql, source):
+        normalized = normalize_question(question)
+        self.question = question
+        self.sql = sql.strip()
+        self.source = source
+        self.words = _words(normalized)
+        self.features = _features(self.words)
+        self.tables, literals = _sql_facts(self.sql)
+        # Literals the question spells out ('Axum', 15) are slots: another
+        # question only gets this SQL if it names the same values.
+        padded = f" {' '.join(self.words)} "
+        self.slots = frozenset(
+            literal for literal in literals if f" {' '.join(_words(literal))} " in padded
+        )
+        self.specific = frozenset(word for word in self.words if _SPECIFIC_RE.search(word))
+
+
+class RetrievalIndex:
+    """
+    Nearest-neighbour lookup over known question -> SQL pairs (train.json plus
+    answers validated later), consulted before the model is called.
+
+    Questions are indexed by word unigrams and bigrams in an inverted index
+    and scored by TF-IDF cosine similarity. A match must clear `threshold`,
+    read only tables the current schema has, and mention the same literal
+    values (cities, categories, numbers) as the known question, so
+    "Who lives in Gondar?" does not get the SQL for "Who lives in Axum?".
+
+    Built lazily on first use. `add` appends a validated pair to
+    `validated_path`; other processes pick up appended pairs on their next
+    lookup.
+    """
+
+    def __init__(self, pairs_path=None, validated_path=None, threshold=0.9, enabled=True):
+        self.pairs_path = pairs_path
+        self.validated_path = validated_path
+        self.threshold = threshold
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._loaded = False
+        self._pairs = {}  # normalized question -> _Pair
+        self._postings = {}  # feature -> {normalized question, ...}
+        self._norms = None  # normalized question -> vector norm; None when stale
+        self._validated_offset = 0
+        self._counters = Counter()
+        self._lookup_seconds = 0.0
+        self._model_seconds = 0.0
+
+    # -- building -----------------------------------------------------------
+
+    def _insert(self, question, sql, source):
+        key = normalize_question(question)
+        old = self._pairs.get(key)
+        if old is not None:
+            for feature in old.features:
+                self._postings[feature].discard(key)
+        pair = self._pairs[key] = _Pair(question, sql, source)
+        for feature in pair.features:
+            self._postings.setdefault(feature, set()).add(key)
+        self._norms = None
+
+    def _load(self):
+        if self.pairs_path and os.path.exists(self.pairs_path):
+            with open(self.pairs_path, encoding="utf-8") as f:
+                for item in json.load(f):
+                    sql = item.get("answer") or item.get("gold_sql")
+                    if item.get("question") and sql:
+                        self._insert(item["question"], sql, "train")
+        self._read_validated()
+        self._loaded = True
+
+    def _read_validated(self):
+        # Reads pairs appended to the validated file since the last call.
+        path = self.validated_path
+        if not path or not os.path.exists(path) or os.path.getsize(path) <= self._validated_offset:
+            return
+        with open(path, "rb") as f:
+            f.seek(self._validated_offset)
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break  # partially written; read it next time
+                self._validated_offset += len(line)
+                try:
+                    item = json.loads(line)
+                    self._insert(item["question"], item["sql"], "validated")
+                except (ValueError, KeyError, TypeError):
+                    continue
+
+    def _sync(self):
+        if not self._loaded:
+            self._load()
+        else:
+            self._read_validated()
+
+    def _idf(self, feature):
+        return math.log((len(self._pairs) + 1) / (len(self._postings.get(feature, ())) + 1)) + 1.0
+
+    def _ensure_norms(self):
+        if self._norms is None:
+            self._norms = {
+                key: math.sqrt(sum(self._idf(feature) ** 2 for feature in pair.features))
+                for key, pair in self._pairs.items()
+            }
+
+    def reload(self):
+        with self._lock:
+            self._pairs, self._postings, self._norms = {}, {}, None
+            self._validated_offset = 0
+            self._load()
+
+    def add(self, question, sql):
+        """Records a validated question -> SQL pair (persisted, and live in this process)."""
+        with self._lock:
+            self._sync()
+            if self.validated_path:
+                with open(self.validated_path, "a", encoding="utf-8") as f:
+                    f.write(json.dumps({"question": question, "sql": sql}) + "\n")
+                self._validated_offset = os.path.getsize(self.validated_path)
+            self._insert(question, sql, "validated")
+
+    # -- lookup -------------------------------------------------------------
+
+    def _search(self, question, table_names, exclude=None):
+        words = _words(normalize_question(question))
+        features = _features(words)
+        specific = {word for word in words if _SPECIFIC_RE.search(word)}
+        padded = f" {' '.join(words)} "
+        self._ensure_norms()
+
+        weights = {feature: self._idf(feature) for feature in features}
+        query_norm = math.sqrt(sum(weight * weight for weight in weights.values()))
+        if not query_norm:
+            return None
+        dots = Counter()
+        for feature, weight in weights.items():
+            for key in self._postings.get(feature, ()):
+                dots[key] += weight * weight
+
+        best = None
+        for key, dot in dots.most_common():
+            score = dot / (query_norm * self._norms[key])
+            if score < self.threshold:
+                break
+            pair = self._pairs[key]
+            if key == exclude or not pair.tables <= table_names:
+                continue
+            if specific - set(pair.words) or any(f" {' '.join(_words(slot))} " not in padded for slot in pair.slots):
+                continue
+            best = RetrievalMatch(pair.question, pair.sql, round(score, 4), pair.source)
+            break
+        return best
+
+    def lookup(self, question, snapshot):
+        """Returns the best `RetrievalMatch` above the threshold, or None."""
+        if not self.enabled:
+            return None
+        started = time.perf_counter()
+        table_names = frozenset(name.lower() for name in snapshot.table_names)
+        with self._lock:
+            self._sync()
+            match = self._search(question, table_names)
+            self._counters["hits" if match is not None else "misses"] += 1
+            self._lookup_seconds += time.perf_counter() - started
+        return match
+
+    def leave_one_out(self, table_names):
+        """
+        Looks every known question up against all the other pairs:
+        [(pair question, gold SQL, RetrievalMatch or None), ...]. For tuning `threshold`.
+        """
+        table_names = frozenset(name.lower() for name in table_names)
+        with self._lock:
+            self._sync()
+            return [
+                (pair.question, pair.sql, self._search(pair.question, table_names, exclude=key))
+                for key, pair in self._pairs.items()
+            ]
+
+    def record_model_call(self, seconds):
+        """Model latency on retrieval misses, to report what a hit saves."""
+        with self._lock:
+            self._counters["model_calls"] += 1
+            self._model_seconds += seconds
+
+    def stats(self):
+        with self._lock:
+            hits, misses = self._counters["hits"], self._counters["misses"]
+            model_calls = self._counters["model_calls"]
+            lookups = hits + misses
+            mean_lookup_ms = self._lookup_seconds * 1000 / lookups if lookups else None
+            mean_model_ms = self._model_seconds * 1000 / model_calls if model_calls else None
+            return {
+                "enabled": self.enabled,
+                "threshold": self.threshold,
+                "entries": len(self._pairs),
+                "hits": hits,
+                "misses": misses,
+                "hit_rate": round(hits / lookups, 4) if lookups else 0.0,
+                "mean_lookup_ms": round(mean_lookup_ms, 3) if mean_lookup_ms is not None else None,
+                "mean_model_ms": round(mean_model_ms, 1) if mean_model_ms is not None else None,
+                "estimated_saved_ms": (
+                    round(hits * (mean_model_ms - mean_lookup_ms), 1)
+                    if mean_model_ms is not None and mean_lookup_ms is not None else None
+                ),
+            }
+
+
+retrieval_index = RetrievalIndex(
+    pairs_path=settings.RETRIEVAL_PAIRS_PATH or None,
+    validated_path=settings.RETRIEVAL_VALIDATED_PATH or None,
+    threshold=settings.RETRIEVAL_THRESHOLD,
+    enabled=settings.RETRIEVAL_ENABLED,
+)
@@ -0,0 +1,113 @@
+import hashlib
+import json
+import threading
+
+from django.apps import apps
+
+TEXT_FIELD_MARKERS = ("char", "text", "email")
+
+
+class SchemaSnapshot:
+    """
+    Immutable view of the `api` models, computed once per schema version.
+
+    `fingerprint` is a stable hash of the tables/columns/types, so anything
+    derived from the schema (prompts, caches) can be keyed on it.
+    """
+
+    def __init__(self, tables, foreign_keys=()):
+        # tables: [(db_table, [(field_name, internal_type), ...]), ...]
+        # foreign_keys: [(db_table, field_name, referenced db_table), ...]
+        self.tables = tuple((table, tuple(fields)) for table, fields in tables)
+        self.foreign_keys = tuple(tuple(foreign_key) for foreign_key in foreign_keys)
+        self.table_names = tuple(table for table, _ in self.tables)
+        self.columns_by_table = {table: tuple(name for name, _ in fields) for table, fields in self.tables}
+        self.all_columns = tuple(
+            f"{table}.{name}" for table, fields in self.tables for name, _ in fields
+        )
+        # Column list as the Space expects it in the prediction payload.
+        self.columns_payload = str(list(self.all_columns))
+        self.text_columns = tuple(
+            name
+            for _, fields in self.tables
+            for name, internal_type in fields
+            if any(marker in internal_type.lower() for marker in TEXT_FIELD_MARKERS)
+        )
+        self.text_column_set = frozenset(column.lower() for column in self.text_columns)
+
+        schema_parts = []
+        for table, fields in self.tables:
+            columns = []
+            for name, internal_type in fields:
+                col_type = "INT" if "int" in internal_type.lower() else "TEXT"
+                columns.append(f"{name} {col_type}")
+            schema_parts.append(f"CREATE TABLE {table} ({', '.join(columns)})")
+        self.schema_string = " ".join(schema_parts)
+
+        canonical = json.dumps([self.tables, self.foreign_keys], separators=(",", ":"))
+        self.fingerprint = hashlib.sha256(canonical.encode("utf-8")).hexdigest()[:16]
+
+    def subset(self, table_names):
+        """Snapshot of only `table_names` and the foreign keys between them (for pruned prompts)."""
+        keep = set(table_names)
+        return SchemaSnapshot(
+            [(table, fields) for table, fields in self.tables if table in keep],
+            [fk for fk in self.foreign_keys if fk[0] in keep and fk[2] in keep],
+        )
+
+
+class SchemaRegistry:
+    """
+    Keeps the current `SchemaSnapshot` in memory.
+
+    The snapshot is built lazily on first use and rebuilt after `post_migrate`
+    (wired in `ApiConfig.ready`) or an explicit `reload()`.
+    """
+
+    def __init__(self, app_label="api"):
+        self.app_label = app_label
+        self._snapshot = None
+        self._lock = threading.Lock()
+
+    def _introspect(self):
+        tables = []
+        foreign_keys = []
+        for model in apps.get_app_config(self.app_label).get_models():
+            fields = [(field.name, field.get_internal_type()) for field in model._meta.fields]
+            tables.append((model._meta.db_table, fields))
+            foreign_keys.extend(
+                (model._meta.db_table, field.name, field.related_model._meta.db_table)
+                for field in model._meta.fields
+                if field.is_relation and field.related_model is not None
+            )
+        return SchemaSnapshot(tables, foreign_keys)
+
+    def get(self):
+        snapshot = self._snapshot
+        if snapshot is None:
+            with self._lock:
+                if self._snapshot is None:
+                    self._snapshot = self._introspect()
+                snapshot = self._snapshot
+        return snapshot
+
+    def reload(self):
+        snapshot = self._introspect()
+        with self._lock:
+            self._snapshot = snapshot
+        return snapshot
+
+    def invalidate(self):
+        with self._lock:
+            self._snapshot = None
+
+    @property
+    def fingerprint(self):
+        return self.get().fingerprint
+
+
+schema_registry = SchemaRegistry()
+
+
+def invalidate_schema_registry(sender=None, **kwargs):
+    schema_registry.invalidate()
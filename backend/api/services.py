@@ -1,43 +1,293 @@
-import re
-from django.db import connection
-from .utils import get_text_columns
-
-def _apply_case_insensitive_collation(sql_query):
-    if connection.vendor != "sqlite":
-        return sql_query
-
-    text_columns = get_text_columns()
-    updated_query = sql_query
-    for column in text_columns:
-        pattern = re.compile(
-            rf"(?P<qual>(?:\\b\\w+\\.)?)"
-            rf"(?P<col>{re.escape(column)})"
-            r"(?!\\s+collate\\s+nocase)"
-            r"\\s*=\\s*"
-            r"(?P<val>'[^']*'|\"[^\"]*\")",
-            re.IGNORECASE,
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from .cache import question_cache, result_cache
+from .clients import get_model_pool
+from .governor import (
+    DATABASE_ERROR, SECURITY_VIOLATION, QueryRejected,
+    error_result, get_query_connection, governed_cursor,
+)
+from .pruning import prune_schema
+from .retrieval import retrieval_index
+from .schema import schema_registry
+from .sql import SQLValidationError, prepare_query, table_aliases
+from .timing import stage
+from .values import value_dictionary
+from .workload import workload_log
+
+# Prefix the Space answers with when a schema id is not (or no longer) registered.
+UNKNOWN_SCHEMA_ERROR = "Error: Unknown schema_id"
+
+# Space schema id per local schema fingerprint (see _model_calls).
+_space_schema_ids = {}
+
+def _model_calls(question, snapshot):
+    """
+    The Space calls that answer `question`, for `_predict` and `_apredict` to
+    make: yields (args, api_name), is sent each answer, and returns the SQL.
+
+    The columns of `snapshot` (usually the pruned part of the schema) are
+    sent with the question. With MODEL_SCHEMA_HANDSHAKE the column list is
+    registered once and later predictions send only the returned schema id;
+    if the Space has forgotten the id (restart/eviction) it is registered again.
+    """
+    if not settings.MODEL_SCHEMA_HANDSHAKE:
+        return (yield (question, snapshot.columns_payload), "/predict")
+
+    for _ in range(2):
+        schema_id = _space_schema_ids.get(snapshot.fingerprint)
+        if schema_id is None:
+            schema_id = (yield (snapshot.columns_payload,), "/register_schema").strip()
+            if schema_id.startswith("Error:"):
+                return schema_id
+            _space_schema_ids[snapshot.fingerprint] = schema_id
+        sql = yield (question, schema_id), "/predict_with_schema"
+        if not sql.startswith(UNKNOWN_SCHEMA_ERROR):
+            return sql
+        _space_schema_ids.pop(snapshot.fingerprint, None)
+    return sql
+
+def _predict(question, snapshot):
+    """Asks the Space for SQL (see `_model_calls`)."""
+    pool = get_model_pool()
+    calls = _model_calls(question, snapshot)
+    try:
+        args, api_name = next(calls)
+        while True:
+            args, api_name = calls.send(pool.predict(*args, api_name=api_name))
+    except StopIteration as done:
+        return done.value
+
+async def _apredict(question, snapshot):
+    """`_predict` for async callers."""
+    pool = get_model_pool()
+    calls = _model_calls(question, snapshot)
+    try:
+        args, api_name = next(calls)
+        while True:
+            args, api_name = calls.send(await pool.apredict(*args, api_name=api_name))
+    except StopIteration as done:
+        return done.value
+
+def generate_sql(question):
+    """
+    Question -> SQL through the question cache; misses are looked up among
+    known question/SQL pairs (api/retrieval.py) and only then go to the
+    model Space, with the schema pruned to the relevant tables
+    (api/pruning.py). Error strings returned by the Space are not cached.
+    """
+    with stage("schema"):
+        snapshot = schema_registry.get()
+
+    def predict():
+        with stage("retrieve"):
+            match = retrieval_index.lookup(question, snapshot)
+        if match is not None:
+            return match.sql
+        with stage("prune"):
+            prompt_schema = prune_schema(question, snapshot)
+        started = time.perf_counter()
+        with stage("model"):
+            # T5 sometimes generates text, rarely extra junk
+            sql = _predict(question, prompt_schema).strip()
+        retrieval_index.record_model_call(time.perf_counter() - started)
+        return sql
+
+    with stage("generate"):
+        return question_cache.get_or_compute(question, snapshot.fingerprint, predict, cacheable=_is_cacheable_sql)
+
+async def agenerate_sql(question):
+    """`generate_sql` for async views: the model call is awaited, not blocking a thread."""
+    with stage("schema"):
+        snapshot = schema_registry.get()
+
+    async def predict():
+        with stage("retrieve"):
+            match = retrieval_index.lookup(question, snapshot)
+        if match is not None:
+            return match.sql
+        with stage("prune"):
+            prompt_schema = prune_schema(question, snapshot)
+        started = time.perf_counter()
+        with stage("model"):
+            sql = (await _apredict(question, prompt_schema)).strip()
+        retrieval_index.record_model_call(time.perf_counter() - started)
+        return sql
+
+    with stage("generate"):
+        return await question_cache.aget_or_compute(
+            question, snapshot.fingerprint, predict, cacheable=_is_cacheable_sql
         )
-        updated_query = pattern.sub(
-            lambda match: (
-                f"{match.group('qual')}{match.group('col')} COLLATE NOCASE = {match.group('val')}"
-            ),
-            updated_query,
+
+def add_validated_pair(question, sql):
+    """
+    Adds a question -> SQL pair confirmed correct by a user to the retrieval
+    index, after checking the SQL is read-only, reads the current schema and
+    runs. Returns an error message, or None once the pair is added.
+    """
+    sql = sql.strip()
+    try:
+        prepare_query(sql)
+    except SQLValidationError as e:
+        return f"Security violation: {e}"
+    if not table_aliases(sql, schema_registry.get().table_names):
+        return "The SQL does not read any table of the current schema"
+    result = execute_query(sql, limit=1)
+    if "error" in result:
+        return result["error"]
+    retrieval_index.add(question, sql)
+    # An earlier (possibly wrong) model answer may be cached for the same question.
+    question_cache.set(question, schema_registry.get().fingerprint, sql)
+    return None
+
+def _is_cacheable_sql(sql):
+    # The Space reports failures as an "Error: ..." string instead of raising.
+    return bool(sql) and not sql.startswith("Error:")
+
+def _resolves_literals():
+    # A stale dictionary entry would drop rows NOCASE matches, so only with
+    # write counters every process shares, as for the result cache.
+    return settings.VALUE_DICTIONARY_ENABLED and bool(settings.DATA_VERSIONS_CACHE_ALIAS)
+
+def _prepare(sql_query, row_limit):
+    # Single tokenizer pass: read-only check + literals resolved to their stored
+    # spelling (else NOCASE on SQLite) + LIMIT injection, so the database stops
+    # after the rows we would read anyway.
+    with stage("rewrite"):
+        return prepare_query(
+            sql_query,
+            schema_registry.get().text_column_set,
+            apply_nocase=get_query_connection().vendor == "sqlite",
+            limit=row_limit if settings.QUERY_AUTO_LIMIT else None,
+            resolve_literal=value_dictionary.resolver(sql_query) if _resolves_literals() else None,
         )
-    return updated_query
 
-def execute_query(sql_query):
-    forbidden = ["DROP", "DELETE", "UPDATE", "INSERT", "ALTER", "TRUNCATE"]
-    if any(word in sql_query.upper() for word in forbidden):
-        return {"error": "Security violation: Only SELECT allowed.", "sql": sql_query}
+def _fetch_chunks(cursor, chunk_size):
+    while True:
+        rows = cursor.fetchmany(chunk_size)
+        if not rows:
+            return
+        yield rows
+
+def execute_query(sql_query, offset=0, limit=None, row_format="records"):
+    """
+    Runs a generated query and returns at most `limit` rows (capped by
+    QUERY_MAX_ROWS) starting at `offset`. `truncated` is True when more rows
+    are available, which is what pagination builds its next page token from.
+
+    With `row_format="rows"` the result carries `rows` (one tuple per row, as
+    read from the cursor) instead of `data` (one dict per row).
+
+    Queries run under the execution governor (api/governor.py); a stopped or
+    failed query returns `error` plus a machine-readable `error_code`.
+    Successful results are kept in the result cache (when the write counters
+    are shared, see DATA_VERSIONS_CACHE_ALIAS) until a table they read is written. Cache hits are still recorded in the workload log, with the
+    execution time the query had when it last ran.
+    """
+    max_rows = settings.QUERY_MAX_ROWS
+    limit = min(limit, max_rows) if limit else max_rows
+    chunk_size = settings.QUERY_STREAM_CHUNK_SIZE
+
+    try:
+        # One extra row tells us whether the result was truncated.
+        sql_query = _prepare(sql_query, row_limit=offset + limit + 1)
+    except SQLValidationError as e:
+        return error_result(SECURITY_VIOLATION, f"Security violation: {e}", sql_query)
+
+    key = "rows" if row_format == "rows" else "data"
+    cache_key = None
+    # Only with a shared version store: otherwise writes by other processes go unnoticed.
+    if settings.RESULT_CACHE_ENABLED and settings.DATA_VERSIONS_CACHE_ALIAS:
+        with stage("results"):
+            cache_key = result_cache.make_key(sql_query, schema_registry.get().table_names, offset, limit, key)
+            cached = result_cache.get(cache_key) if cache_key is not None else None
+        if cached is not None:
+            result, cost = cached
+            workload_log.record(sql_query, cost, cached=True)
+            return result
+
+    try:
+        with stage("execute"), governed_cursor(sql_query) as (cursor, deadline):
+            if not cursor.description:
+                return {"columns": [], key: [], "sql": sql_query, "truncated": False}
+
+            columns = [col[0] for col in cursor.description]
+            # Skip to the requested page without holding skipped rows in memory.
+            skipped = 0
+            while skipped < offset:
+                rows = cursor.fetchmany(min(chunk_size, offset - skipped))
+                if not rows:
+                    break
+                skipped += len(rows)
+
+            data = []
+            truncated = False
+            for rows in _fetch_chunks(cursor, chunk_size):
+                remaining = limit - len(data)
+                if key == "rows":
+                    data.extend(rows[:remaining])
+                else:
+                    data.extend(dict(zip(columns, row)) for row in rows[:remaining])
+                if len(rows) > remaining:
+                    truncated = True
+                    break
+                if len(data) == limit and cursor.fetchone() is not None:
+                    truncated = True
+                    break
+    except QueryRejected as e:
+        return error_result(e.code, str(e), sql_query)
+    except Exception as e:
+        return error_result(DATABASE_ERROR, f"Database Error: {str(e)}", sql_query)
+
+    result = {"columns": columns, key: data, "sql": sql_query, "truncated": truncated}
+    if cache_key is not None:
+        result_cache.set(cache_key, result, key, cost=deadline.elapsed)
+    return result
+
+# Django's DB layer is synchronous; async views run queries on its
+# thread-sensitive executor so connections stay on one thread.
+aexecute_query = sync_to_async(execute_query)
+
+def stream_query(sql_query, chunk_size=None, max_rows=None):
+    """
+    Generator for streaming responses. Yields a header dict first
+    (`columns` + `sql`, or `error`), then lists of row tuples read with
+    `fetchmany`, and finally a footer dict with `row_count`/`truncated`.
+    Memory stays bounded by `chunk_size` rows whatever the result size;
+    `max_rows` defaults to QUERY_MAX_ROWS. The query deadline is paused
+    while the consumer holds a chunk, so a slow client doesn't time it out.
+    """
+    chunk_size = chunk_size or settings.QUERY_STREAM_CHUNK_SIZE
+    max_rows = max_rows or settings.QUERY_MAX_ROWS
+    try:
+        sql_query = _prepare(sql_query, row_limit=max_rows + 1)
+    except SQLValidationError as e:
+        yield error_result(SECURITY_VIOLATION, f"Security violation: {e}", sql_query)
+        return
 
     try:
-        sql_query = _apply_case_insensitive_collation(sql_query)
-        with connection.cursor() as cursor:
-            cursor.execute(sql_query)
-            if cursor.description:
-                columns = [col[0] for col in cursor.description]
-                data = [dict(zip(columns, row)) for row in cursor.fetchall()]
-                return {"columns": columns, "data": data, "sql": sql_query}
-            return {"columns": [], "data": [], "sql": sql_query}
+        with stage("execute"), governed_cursor(sql_query) as (cursor, deadline):
+            columns = [col[0] for col in cursor.description] if cursor.description else []
+            with deadline.paused():
+                yield {"columns": columns, "sql": sql_query}
+
+            row_count = 0
+            truncated = False
+            if columns:
+                for rows in _fetch_chunks(cursor, chunk_size):
+                    remaining = max_rows - row_count
+                    if len(rows) > remaining:
+                        rows = rows[:remaining]
+                        truncated = True
+                    row_count += len(rows)
+                    if rows:
+                        with deadline.paused():
+                            yield rows
+                    if truncated:
+                        break
+            yield {"row_count": row_count, "truncated": truncated}
+    except QueryRejected as e:
+        yield error_result(e.code, str(e), sql_query)
     except Exception as e:
-        return {"error": f"Database Error: {str(e)}", "sql": sql_query}
+        yield error_result(DATABASE_ERROR, f"Database Error: {str(e)}", sql_query)
@@ -0,0 +1,265 @@
+import re
+from collections import namedtuple
+
+Token = namedtuple("Token", ["kind", "text"])
+
+# One master pattern, scanned once with finditer: cost is linear in the query
+# length and independent of how many columns the schema has.
+_TOKEN_RE = re.compile(
+    r"""
+    (?P<ws>\s+)
+  | (?P<comment>--[^\n]*|/\*.*?(?:\*/|\Z))
+  | (?P<string>'(?:[^']|'')*'?)
+  | (?P<quoted>"(?:[^"]|"")*"?|`[^`]*`?|\[[^\]]*\]?)
+  | (?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:[eE][+-]?\d+)?)
+  | (?P<word>[A-Za-z_][A-Za-z0-9_$]*)
+  | (?P<param>[?:@$][A-Za-z0-9_]*)
+  | (?P<op><=|>=|<>|!=|==|\|\||<<|>>|[=<>+\-*/%&|~])
+  | (?P<punct>[(),;.])
+  | (?P<other>.)
+    """,
+    re.VERBOSE | re.DOTALL,
+)
+
+_SKIP = frozenset(("ws", "comment"))
+
+WRITE_KEYWORDS = frozenset((
+    "INSERT", "UPDATE", "DELETE", "DROP", "ALTER", "TRUNCATE", "CREATE",
+    "ATTACH", "DETACH", "PRAGMA", "VACUUM", "REINDEX", "GRANT", "REVOKE",
+))
+READ_STATEMENT_KEYWORDS = frozenset(("SELECT", "WITH", "VALUES"))
+EQUALITY_OPERATORS = frozenset(("=", "=="))
+# Words that can follow a table name in FROM/JOIN without being its alias.
+_NOT_ALIASES = frozenset((
+    "WHERE", "JOIN", "INNER", "LEFT", "RIGHT", "FULL", "CROSS", "NATURAL", "OUTER",
+    "ON", "USING", "GROUP", "ORDER", "LIMIT", "UNION", "INTERSECT", "EXCEPT",
+    "HAVING", "WINDOW", "INDEXED", "NOT",
+))
+
+
+class SQLValidationError(ValueError):
+    """Raised when generated SQL is not a single read-only statement."""
+
+
+def tokenize(sql):
+    return [Token(match.lastgroup, match.group()) for match in _TOKEN_RE.finditer(sql)]
+
+
+def _unquote(token):
+    if token.kind == "quoted":
+        return token.text[1:-1]
+    return token.text
+
+
+def table_aliases(sql, table_names):
+    """
+    Maps every name a table is referred to by in `sql` (the table itself and
+    any alias) to the table: `FROM api_order o` -> {"api_order": ..., "o": "api_order"}.
+    Keys and values are lower-cased.
+    """
+    table_names = {name.lower() for name in table_names}
+    tokens = [token for token in tokenize(sql) if token.kind not in _SKIP]
+    aliases = {}
+    for index, token in enumerate(tokens):
+        table = _unquote(token).lower()
+        if token.kind not in ("word", "quoted") or table not in table_names:
+            continue
+        aliases[table] = table
+        following = index + 1
+        if following < len(tokens) and tokens[following].text.upper() == "AS":
+            following += 1
+        if following < len(tokens):
+            alias = tokens[following]
+            if alias.kind in ("word", "quoted") and alias.text.upper() not in _NOT_ALIASES:
+                aliases[_unquote(alias).lower()] = table
+    return aliases
+
+
+def has_limit(sql):
+    """True when `sql` has a LIMIT outside parentheses (one that bounds the whole result)."""
+    depth = 0
+    for token in tokenize(sql):
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        elif depth == 0 and token.kind == "word" and token.text.upper() == "LIMIT":
+            return True
+    return False
+
+
+# Keywords that end a FROM clause's table list (ON/USING don't: `, t` may follow the condition).
+_FROM_CLAUSE_END = frozenset((
+    "WHERE", "GROUP", "ORDER", "LIMIT", "HAVING", "WINDOW", "UNION", "INTERSECT", "EXCEPT",
+))
+
+
+# Functions/values that make a result depend on more than the data read.
+_NONDETERMINISTIC = frozenset((
+    "CURRENT_DATE", "CURRENT_TIME", "CURRENT_TIMESTAMP", "NOW", "RANDOM", "RANDOMBLOB",
+    "CHANGES", "TOTAL_CHANGES", "LAST_INSERT_ROWID", "CLOCK_TIMESTAMP", "RAND", "UUID",
+))
+
+
+def is_deterministic(sql):
+    """False when `sql` reads the clock or a random source (`date('now')`, RANDOM())."""
+    for token in tokenize(sql):
+        if token.kind == "word" and token.text.upper() in _NONDETERMINISTIC:
+            return False
+        if token.kind == "string" and token.text.lower() in ("'now'", "'localtime'"):
+            return False
+    return True
+
+
+def normalize_sql(sql):
+    """Whitespace/comment/keyword-case insensitive form of `sql`, for cache keys."""
+    return " ".join(
+        token.text.lower() if token.kind == "word" else token.text
+        for token in tokenize(sql)
+        if token.kind not in _SKIP
+    )
+
+
+def referenced_tables(sql, table_names):
+    """
+    The tables (lower-cased) `sql` reads, or None when it may read anything
+    else (a table outside `table_names`, a CTE, a table-valued function) or
+    can't be parsed with certainty.
+    """
+    table_names = {name.lower() for name in table_names}
+    tokens = [token for token in tokenize(sql) if token.kind not in _SKIP]
+    tables = set()
+    # One [in_from, expect_table] frame per level of parentheses.
+    frames = [[False, False]]
+    for index, token in enumerate(tokens):
+        upper = token.text.upper() if token.kind == "word" else None
+        frame = frames[-1]
+        if upper == "WITH":
+            return None
+        if token.text == "(":
+            # In a table slot: a subquery or a parenthesized join, which fills
+            # the slot; elsewhere an expression, whose subqueries have their own FROM.
+            frames.append([frame[1], frame[1]])
+            frame[1] = False
+        elif token.text == ")":
+            if len(frames) == 1 or frame[1]:
+                return None
+            frames.pop()
+        elif frame[1]:
+            frame[1] = False
+            if upper in ("SELECT", "VALUES"):
+                frame[0] = False
+                continue
+            name = _unquote(token).lower()
+            following = tokens[index + 1].text if index + 1 < len(tokens) else ""
+            if token.kind not in ("word", "quoted") or name not in table_names or following in ("(", "."):
+                return None
+            tables.add(name)
+        elif upper in ("FROM", "JOIN"):
+            frame[0] = frame[1] = True
+        elif token.text == "," and frame[0]:
+            frame[1] = True
+        elif upper in _FROM_CLAUSE_END:
+            frame[0] = False
+    if len(frames) != 1 or frames[0][1]:
+        return None
+    # A table named anywhere else (say after a keyword this parser doesn't
+    # know) may be read too.
+    for token in tokens:
+        if token.kind in ("word", "quoted") and _unquote(token).lower() in table_names - tables:
+            return None
+    return tables
+
+
+def prepare_query(sql, text_columns=frozenset(), apply_nocase=True, limit=None, resolve_literal=None):
+    """
+    Validates that `sql` is a single read-only SELECT and, in the same pass,
+    makes `<text column> = '<literal>'` predicates case-insensitive and,
+    when `limit` is given and the statement has no top-level LIMIT, appends
+    `LIMIT <limit>`.
+
+    `resolve_literal(qualifier, column, value)` may return the stored
+    spelling of a literal (see api/values.py); `qualifier` is the lower-cased
+    table or alias before the column (`c.city`), or None. The literal is then
+    replaced by it and the predicate stays index-friendly. Otherwise, with `apply_nocase`, the
+    predicate gets `COLLATE NOCASE`.
+
+    `text_columns` is a set of lower-cased column names.
+    Returns the rewritten SQL; raises `SQLValidationError` otherwise.
+    """
+    tokens = tokenize(sql)
+    significant = [index for index, token in enumerate(tokens) if token.kind not in _SKIP]
+    if not significant:
+        raise SQLValidationError("Empty query.")
+
+    # A single trailing semicolon is fine; anything after it is a second statement.
+    semicolons = [index for index in significant if tokens[index].text == ";"]
+    if semicolons:
+        if len(semicolons) > 1 or semicolons[0] != significant[-1]:
+            raise SQLValidationError("Only a single statement is allowed.")
+        significant.pop()
+        if not significant:
+            raise SQLValidationError("Empty query.")
+
+    first = tokens[significant[0]]
+    if first.kind != "word" or first.text.upper() not in READ_STATEMENT_KEYWORDS:
+        raise SQLValidationError("Only SELECT allowed.")
+
+    insert_after = {}
+    replace = {}
+    depth = 0
+    has_limit = False
+    for position, index in enumerate(significant):
+        token = tokens[index]
+        if token.text == "(":
+            depth += 1
+        elif token.text == ")":
+            depth -= 1
+        if token.kind == "word":
+            upper = token.text.upper()
+            if upper == "LIMIT" and depth == 0:
+                has_limit = True
+            if upper in WRITE_KEYWORDS:
+                raise SQLValidationError("Only SELECT allowed.")
+            if upper == "REPLACE" and position + 1 < len(significant):
+                if tokens[significant[position + 1]].text.upper() == "INTO":
+                    raise SQLValidationError("Only SELECT allowed.")
+        elif token.kind != "quoted":
+            continue
+
+        if not (apply_nocase or resolve_literal) or position + 2 >= len(significant):
+            continue
+        column = _unquote(token).lower()
+        if column not in text_columns:
+            continue
+        operator = tokens[significant[position + 1]]
+        value = tokens[significant[position + 2]]
+        if operator.kind != "op" or operator.text not in EQUALITY_OPERATORS:
+            continue
+        # SQLite treats an unresolvable "..." as a string literal, as did the old rewrite.
+        if value.kind == "string" or (value.kind == "quoted" and value.text[0] == '"'):
+            canonical = None
+            if resolve_literal is not None:
+                qualifier = None
+                if position >= 2 and tokens[significant[position - 1]].text == ".":
+                    qualifier = _unquote(tokens[significant[position - 2]]).lower()
+                literal = value.text[1:-1].replace(value.text[0] * 2, value.text[0])
+                canonical = resolve_literal(qualifier, column, literal)
+            if canonical is not None:
+                replace[significant[position + 2]] = "'" + canonical.replace("'", "''") + "'"
+            elif apply_nocase:
+                insert_after[index] = " COLLATE NOCASE"
+
+    if limit is not None and not has_limit:
+        # After the last significant token, so a trailing comment can't swallow it.
+        last = significant[-1]
+        insert_after[last] = insert_after.get(last, "") + f" LIMIT {int(limit)}"
+
+    if not insert_after and not replace:
+        return sql
+    parts = []
+    for index, token in enumerate(tokens):
+        parts.append(replace.get(index, token.text))
+        if index in insert_after:
+            parts.append(insert_after[index])
+    return "".join(parts)
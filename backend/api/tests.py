@@ -1,3 +1,834 @@
-from django.test import TestCase
+import asyncio
+import datetime
+import decimal
+import io
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from unittest import mock, skipUnless
 
-# Create your tests here.
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+
+from .cache import QuestionSQLCache, question_cache, result_cache
+from .clients import (
+    CircuitBreaker, ModelClientPool, ModelTimeoutError, ModelUnavailableError, PoolExhaustedError,
+)
+from .evaluation import _gold_result, checkpoint_path, load_run_state
+from .governor import _sqlite_table_rows, get_query_connection
+from .management.commands import seed_mock_data
+from .models import Customer, Order, Product
+from .pagination import decode_page_token, encode_page_token
+from .renderers import ArrowIPCRenderer, ColumnarJSONRenderer, pyarrow
+from .retrieval import retrieval_index
+from .schema import SchemaSnapshot, schema_registry
+from .services import UNKNOWN_SCHEMA_ERROR, _apredict, _predict, execute_query, stream_query
+from .sql import SQLValidationError, prepare_query, referenced_tables
+from .values import value_dictionary
+from .versions import bulk_write
+from .workload import workload_log
+
+
+class GovernedQueryTestCase(TransactionTestCase):
+    """
+    Generated queries run on the read-only alias, a separate connection that
+    only sees committed rows, so these tests commit. The workload log is kept
+    out of tests.
+    """
+
+    databases = {"default", "readonly"}
+
+    def setUp(self):
+        patcher = mock.patch.object(workload_log, "path", "")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+
+class FakeSpaceClient:
+    """gradio Client stand-in: each submit answers with the next of `answers` (HANG: never)."""
+
+    HANG = object()
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.submits = 0
+
+    def submit(self, *args, api_name=None):
+        self.submits += 1
+        answer = self.answers.pop(0) if self.answers else self.HANG
+        job = Future()
+        if isinstance(answer, Exception):
+            raise answer
+        if answer is not self.HANG:
+            job.set_result(answer)
+        return job
+
+
+class ModelClientPoolTests(SimpleTestCase):
+    def pool(self, client, **kwargs):
+        options = {"size": 1, "timeout": 0.05, "retries": 2, "backoff": 0, "breaker": CircuitBreaker(failure_threshold=1)}
+        return ModelClientPool("stub", client_factory=lambda: client, **{**options, **kwargs})
+
+    def test_other_errors_are_retried(self):
+        client = FakeSpaceClient(ConnectionError("reset"), ConnectionError("reset"), "SELECT 1")
+        pool = self.pool(client, breaker=CircuitBreaker(failure_threshold=5))
+        self.assertEqual(pool.predict("question"), "SELECT 1")
+        self.assertEqual(client.submits, 3)
+
+    def test_timeouts_are_not_retried(self):
+        client = FakeSpaceClient()
+        pool = self.pool(client)
+        with self.assertRaises(ModelTimeoutError):
+            pool.predict("question")
+        self.assertEqual(client.submits, 1)
+        self.assertEqual(pool.breaker.state, CircuitBreaker.OPEN)
+
+    def test_async_timeouts_are_not_retried(self):
+        client = FakeSpaceClient()
+        pool = self.pool(client)
+        with self.assertRaises(ModelTimeoutError):
+            asyncio.run(pool.apredict("question"))
+        self.assertEqual(client.submits, 1)
+        self.assertEqual(pool.breaker.state, CircuitBreaker.OPEN)
+
+    def test_busy_pool_does_not_open_the_breaker(self):
+        client = FakeSpaceClient("SELECT 1")
+        pool = self.pool(client)
+        with pool.client():
+            with self.assertRaises(PoolExhaustedError):
+                pool.predict("question")
+        self.assertEqual(pool.breaker.state, CircuitBreaker.CLOSED)
+        self.assertEqual(pool.predict("question"), "SELECT 1")
+
+
+def wait_until(condition, timeout=5):
+    deadline = time.monotonic() + timeout
+    while not condition():
+        if time.monotonic() > deadline:
+            raise AssertionError("condition not reached in time")
+        time.sleep(0.01)
+
+
+class QuestionSQLCacheTests(SimpleTestCase):
+    FINGERPRINT = "schema"
+
+    def test_concurrent_misses_compute_once(self):
+        cache = QuestionSQLCache()
+        release = threading.Event()
+        calls = []
+
+        def compute():
+            calls.append(1)
+            release.wait(5)
+            return "SELECT 1"
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            futures = [
+                executor.submit(cache.get_or_compute, "How many customers?", self.FINGERPRINT, compute)
+                for _ in range(8)
+            ]
+            wait_until(lambda: cache.stats()["misses"] + cache.stats()["coalesced"] == 8)
+            release.set()
+            results = [future.result(5) for future in futures]
+        self.assertEqual(results, ["SELECT 1"] * 8)
+        self.assertEqual(len(calls), 1)
+        self.assertEqual(cache.stats()["coalesced"], 7)
+        # Normalized questions share the entry.
+        self.assertEqual(cache.get("  how many CUSTOMERS ", self.FINGERPRINT), "SELECT 1")
+
+    def test_errors_reach_every_waiter_and_are_not_cached(self):
+        cache = QuestionSQLCache()
+        release = threading.Event()
+
+        def compute():
+            release.wait(5)
+            raise ModelUnavailableError("Space is down")
+
+        with ThreadPoolExecutor(max_workers=4) as executor:
+            futures = [
+                executor.submit(cache.get_or_compute, "question", self.FINGERPRINT, compute) for _ in range(4)
+            ]
+            wait_until(lambda: cache.stats()["misses"] + cache.stats()["coalesced"] == 4)
+            release.set()
+            for future in futures:
+                with self.assertRaises(ModelUnavailableError):
+                    future.result(5)
+        self.assertEqual(cache.get_or_compute("question", self.FINGERPRINT, lambda: "SELECT 1"), "SELECT 1")
+
+    def test_async_misses_compute_once(self):
+        cache = QuestionSQLCache()
+        calls = []
+
+        async def compute():
+            calls.append(1)
+            await asyncio.sleep(0.05)
+            return "SELECT 1"
+
+        async def ask_all():
+            return await asyncio.gather(
+                *(cache.aget_or_compute("question", self.FINGERPRINT, compute) for _ in range(5))
+            )
+
+        self.assertEqual(asyncio.run(ask_all()), ["SELECT 1"] * 5)
+        self.assertEqual(len(calls), 1)
+
+    def test_uncacheable_answers_are_not_kept(self):
+        cache = QuestionSQLCache()
+        cacheable = lambda sql: not sql.startswith("Error:")
+        self.assertEqual(
+            cache.get_or_compute("question", self.FINGERPRINT, lambda: "Error: busy", cacheable), "Error: busy"
+        )
+        self.assertIsNone(cache.get("question", self.FINGERPRINT))
+        self.assertEqual(cache.get_or_compute("question", self.FINGERPRINT, lambda: "SELECT 1", cacheable), "SELECT 1")
+        self.assertEqual(cache.get("question", self.FINGERPRINT), "SELECT 1")
+
+    def test_lru_and_ttl_eviction(self):
+        cache = QuestionSQLCache(max_entries=2, ttl=60)
+        cache.set("first", self.FINGERPRINT, "SELECT 1")
+        cache.set("second", self.FINGERPRINT, "SELECT 2")
+        cache.get("first", self.FINGERPRINT)
+        cache.set("third", self.FINGERPRINT, "SELECT 3")
+        self.assertIsNone(cache.get("second", self.FINGERPRINT))
+        self.assertEqual(cache.get("first", self.FINGERPRINT), "SELECT 1")
+        # Another schema is another key.
+        self.assertIsNone(cache.get("first", "other schema"))
+
+        with mock.patch("api.cache.time.monotonic", return_value=time.monotonic() + 61):
+            self.assertIsNone(cache.get("first", self.FINGERPRINT))
+
+
+class FakeModelPool:
+    """ModelClientPool stand-in: answers each call with the next of `answers` and records the calls."""
+
+    def __init__(self, *answers):
+        self.answers = list(answers)
+        self.calls = []
+
+    def predict(self, *args, api_name=None):
+        self.calls.append((api_name, args))
+        return self.answers.pop(0)
+
+    async def apredict(self, *args, api_name=None):
+        return self.predict(*args, api_name=api_name)
+
+
+@override_settings(MODEL_SCHEMA_HANDSHAKE=True)
+class SchemaHandshakeTests(SimpleTestCase):
+    SNAPSHOT = SchemaSnapshot([("api_customer", [("id", "BigAutoField"), ("city", "CharField")])])
+
+    def setUp(self):
+        patcher = mock.patch("api.services._space_schema_ids", {})
+        self.schema_ids = patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def predict(self, pool, question="customers in Axum"):
+        with mock.patch("api.services.get_model_pool", return_value=pool):
+            return _predict(question, self.SNAPSHOT), asyncio.run(_apredict(question, self.SNAPSHOT))
+
+    def test_schema_is_registered_once(self):
+        pool = FakeModelPool("s1", "SELECT 1", "SELECT 2")
+        self.assertEqual(self.predict(pool), ("SELECT 1", "SELECT 2"))
+        self.assertEqual(pool.calls, [
+            ("/register_schema", (self.SNAPSHOT.columns_payload,)),
+            ("/predict_with_schema", ("customers in Axum", "s1")),
+            ("/predict_with_schema", ("customers in Axum", "s1")),
+        ])
+
+    def test_forgotten_schema_is_registered_again(self):
+        self.schema_ids[self.SNAPSHOT.fingerprint] = "s1"
+        pool = FakeModelPool(
+            f"{UNKNOWN_SCHEMA_ERROR}: s1", "s2", "SELECT 1",
+            f"{UNKNOWN_SCHEMA_ERROR}: s2", "s3", "SELECT 2",
+        )
+        self.assertEqual(self.predict(pool), ("SELECT 1", "SELECT 2"))
+        self.assertEqual([api_name for api_name, _ in pool.calls], [
+            "/predict_with_schema", "/register_schema", "/predict_with_schema",
+        ] * 2)
+        self.assertEqual(self.schema_ids, {self.SNAPSHOT.fingerprint: "s3"})
+
+    def test_registration_error_is_returned(self):
+        pool = FakeModelPool("Error: schema too large", "Error: schema too large")
+        self.assertEqual(self.predict(pool), ("Error: schema too large",) * 2)
+        self.assertEqual([api_name for api_name, _ in pool.calls], ["/register_schema"] * 2)
+        self.assertEqual(self.schema_ids, {})
+
+    @override_settings(MODEL_SCHEMA_HANDSHAKE=False)
+    def test_without_handshake_the_columns_are_sent(self):
+        pool = FakeModelPool("SELECT 1", "SELECT 2")
+        self.assertEqual(self.predict(pool), ("SELECT 1", "SELECT 2"))
+        self.assertEqual(pool.calls, [("/predict", ("customers in Axum", self.SNAPSHOT.columns_payload))] * 2)
+
+
+class StreamQueryTests(GovernedQueryTestCase):
+    COUNT_TO = "WITH RECURSIVE n(x) AS (SELECT 1 UNION ALL SELECT x + 1 FROM n WHERE x < {}) SELECT x FROM n"
+
+    @override_settings(QUERY_TIMEOUT=0.3, QUERY_PLAN_CHECK=False)
+    def test_slow_consumer_does_not_use_up_the_deadline(self):
+        items = []
+        for item in stream_query(self.COUNT_TO.format(50000), chunk_size=1000, max_rows=50000):
+            items.append(item)
+            time.sleep(0.01)  # 50 chunks: well past QUERY_TIMEOUT of wall-clock time
+        self.assertNotIn("error", items[0])
+        self.assertEqual(items[-1], {"row_count": 50000, "truncated": False})
+
+    @override_settings(QUERY_TIMEOUT=0.05, QUERY_PLAN_CHECK=False)
+    def test_slow_query_still_times_out(self):
+        items = list(stream_query(self.COUNT_TO.format(10 ** 9), chunk_size=10 ** 6, max_rows=10 ** 9))
+        self.assertEqual(items[-1]["error_code"], "timeout")
+
+
+@override_settings(QUERY_PLAN_CHECK=True, QUERY_PLAN_MAX_SCAN_ROWS=10, QUERY_PLAN_MAX_LOOP_ROWS=100)
+class PlanCheckTests(GovernedQueryTestCase):
+    reset_sequences = True
+    def setUp(self):
+        super().setUp()
+        Customer.objects.bulk_create(
+            Customer(name=f"Customer {i}", email=f"c{i}@example.com", city=("Axum", "Adama")[i % 2])
+            for i in range(50)
+        )
+        product = Product.objects.create(name="Coffee", price="9.50", category="Coffee")
+        Order.objects.bulk_create(
+            Order(customer=customer, product=product, quantity=1) for customer in Customer.objects.all()
+        )
+
+    def assertRuns(self, sql):
+        result = execute_query(sql)
+        self.assertNotIn("error", result, result.get("error"))
+        return result
+
+    def assertRejected(self, sql, code):
+        self.assertEqual(execute_query(sql).get("error_code"), code)
+
+    def test_streaming_scans_run(self):
+        self.assertEqual(len(self.assertRuns("SELECT * FROM api_customer LIMIT 5")["data"]), 5)
+        self.assertEqual(self.assertRuns("SELECT COUNT(*) AS n FROM api_order")["data"], [{"n": 50}])
+        # The auto LIMIT bounds the scan.
+        self.assertEqual(len(self.assertRuns("SELECT * FROM api_customer WHERE city = 'Axum'")["data"]), 25)
+
+    def test_top_level_order_by_with_limit_runs(self):
+        self.assertRuns("SELECT * FROM api_customer ORDER BY name LIMIT 3")
+
+    def test_grouping_a_large_scan_is_rejected(self):
+        self.assertRejected("SELECT city, COUNT(*) FROM api_customer GROUP BY city", "plan_full_scan")
+        self.assertRejected("SELECT DISTINCT name FROM api_customer", "plan_full_scan")
+
+    def test_unindexed_nested_loop_is_rejected(self):
+        self.assertRejected(
+            "SELECT a.name, b.name FROM api_customer a JOIN api_customer b ON a.name < b.name", "plan_nested_loop"
+        )
+
+    def test_row_estimates_come_from_statistics(self):
+        with get_query_connection().cursor() as cursor:
+            self.assertEqual(_sqlite_table_rows(cursor, "api_customer"), 50)
+        with connection.cursor() as cursor:
+            cursor.execute("ANALYZE")
+        Customer.objects.filter(id__gt=5).delete()
+        with get_query_connection().cursor() as cursor:
+            # sqlite_stat1 (50 rows at ANALYZE time) wins over the largest rowid (now 5).
+            self.assertEqual(_sqlite_table_rows(cursor, "api_customer"), 50)
+
+
+SHARED_VERSIONS = override_settings(
+    CACHES={
+        "default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache"},
+        "versions": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "versions"},
+    },
+    DATA_VERSIONS_CACHE_ALIAS="versions",
+    RESULT_CACHE_ENABLED=True,
+)
+
+
+@SHARED_VERSIONS
+class WorkloadLogTests(GovernedQueryTestCase):
+    def setUp(self):
+        super().setUp()
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+        log_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(log_dir.cleanup)
+        patcher = mock.patch.object(workload_log, "path", os.path.join(log_dir.name, "workload.jsonl"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Customer.objects.create(name="Abebe", email="abebe@example.com", city="Axum")
+
+    def test_result_cache_hits_are_logged(self):
+        sql = "SELECT name FROM api_customer WHERE city = 'Axum'"
+        hits = result_cache.stats()["hits"]
+        first, second = execute_query(sql), execute_query(sql)
+        self.assertEqual(first, second)
+        self.assertEqual(result_cache.stats()["hits"], hits + 1)
+
+        entries = list(workload_log.entries())
+        self.assertEqual(len(entries), 2)
+        self.assertNotIn("cached", entries[0])
+        self.assertTrue(entries[1]["cached"])
+        self.assertEqual(entries[1]["where"], entries[0]["where"])
+        self.assertEqual(entries[1]["ms"], entries[0]["ms"])
+
+
+@SHARED_VERSIONS
+class ResultCacheInvalidationTests(GovernedQueryTestCase):
+    COUNT = "SELECT COUNT(*) AS n FROM api_product"
+
+    def setUp(self):
+        super().setUp()
+        result_cache.clear()
+        self.addCleanup(result_cache.clear)
+        Product.objects.create(name="Gadget", price=10, category="Tools")
+
+    def count(self):
+        return execute_query(self.COUNT)["data"][0]["n"]
+
+    def test_writes_to_a_read_table_invalidate(self):
+        self.assertEqual(self.count(), 1)
+        Product.objects.create(name="Widget", price=5, category="Tools")
+        self.assertEqual(self.count(), 2)
+        Product.objects.filter(name="Widget").delete()
+        self.assertEqual(self.count(), 1)
+
+    def test_writes_to_other_tables_keep_entries(self):
+        self.assertEqual(self.count(), 1)
+        hits = result_cache.stats()["hits"]
+        Customer.objects.create(name="Abebe", email="abebe@example.com", city="Axum")
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(result_cache.stats()["hits"], hits + 1)
+
+    def test_writes_by_other_processes_invalidate(self):
+        self.assertEqual(self.count(), 1)
+        # What seed_mock_data does from its own process: raw inserts, then `bulk_write`,
+        # whose bump reaches this process through the shared store.
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO api_product (name, price, category) VALUES ('Widget', 5, 'Tools')")
+        bulk_write.send(sender=None, tables=["api_product"])
+        self.assertEqual(self.count(), 2)
+
+    @override_settings(DATA_VERSIONS_CACHE_ALIAS="")
+    def test_off_without_a_shared_version_store(self):
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(self.count(), 1)
+        self.assertEqual(result_cache.stats()["entries"], 0)
+
+    def test_result_read_before_commit_is_not_kept_after_it(self):
+        with transaction.atomic():
+            Product.objects.create(name="Widget", price=5, category="Tools")
+            # The read-only connection doesn't see the uncommitted row yet.
+            self.assertEqual(self.count(), 1)
+        self.assertEqual(self.count(), 2)
+
+
+class PrepareQueryTests(SimpleTestCase):
+    TEXT_COLUMNS = frozenset(("city", "name"))
+
+    def prepare(self, sql, **kwargs):
+        return prepare_query(sql, self.TEXT_COLUMNS, **kwargs)
+
+    def assertRejected(self, sql, message):
+        with self.assertRaisesMessage(SQLValidationError, message):
+            self.prepare(sql)
+
+    def test_single_statement_only(self):
+        self.assertRejected("SELECT 1; SELECT 2", "Only a single statement is allowed.")
+        self.assertRejected("SELECT 1; -- then\nDROP TABLE api_customer", "Only a single statement is allowed.")
+        self.assertRejected(";", "Empty query.")
+        self.assertEqual(self.prepare("SELECT 1;"), "SELECT 1;")
+        self.assertEqual(self.prepare("SELECT 1; -- done"), "SELECT 1; -- done")
+
+    def test_write_keywords_are_rejected_anywhere_but_in_comments_and_strings(self):
+        for sql in (
+            "INSERT INTO api_customer (name) VALUES ('x')",
+            "PRAGMA table_info(api_customer)",
+            "WITH gone AS (DELETE FROM api_customer RETURNING *) SELECT * FROM gone",
+            "REPLACE INTO api_customer (id) VALUES (1)",
+        ):
+            self.assertRejected(sql, "Only SELECT allowed.")
+        for sql in (
+            "SELECT * FROM api_customer -- DROP TABLE api_customer",
+            "SELECT * FROM api_customer /* delete everything */",
+            "SELECT 'DROP TABLE api_customer' AS text",
+            "SELECT replace(name, 'a', 'b'), updated_at, deleted FROM api_customer",
+            'SELECT "delete" FROM api_customer',
+        ):
+            self.assertEqual(self.prepare(sql), sql)
+
+    def test_nocase_on_text_column_equality(self):
+        self.assertEqual(
+            self.prepare("SELECT * FROM api_customer WHERE city = 'Axum' AND id = 1"),
+            "SELECT * FROM api_customer WHERE city COLLATE NOCASE = 'Axum' AND id = 1",
+        )
+        # SQLite reads an unresolvable "..." as a string literal.
+        self.assertEqual(
+            self.prepare('SELECT * FROM api_customer WHERE "city" = "Axum"'),
+            'SELECT * FROM api_customer WHERE "city" COLLATE NOCASE = "Axum"',
+        )
+        self.assertEqual(
+            self.prepare("SELECT * FROM api_customer WHERE city = 'Axum'", apply_nocase=False),
+            "SELECT * FROM api_customer WHERE city = 'Axum'",
+        )
+
+    def test_limit_placement(self):
+        self.assertEqual(self.prepare("SELECT * FROM t;", limit=10), "SELECT * FROM t LIMIT 10;")
+        self.assertEqual(self.prepare("SELECT * FROM t -- all", limit=10), "SELECT * FROM t LIMIT 10 -- all")
+        self.assertEqual(self.prepare("SELECT * FROM t LIMIT 3", limit=10), "SELECT * FROM t LIMIT 3")
+        # A subquery's LIMIT doesn't bound the result.
+        self.assertEqual(
+            self.prepare("SELECT * FROM t WHERE id IN (SELECT id FROM u LIMIT 5)", limit=10),
+            "SELECT * FROM t WHERE id IN (SELECT id FROM u LIMIT 5) LIMIT 10",
+        )
+
+
+class ResultRendererTests(SimpleTestCase):
+    RESULT = {
+        "columns": ["name", "price", "ordered", "mixed"],
+        "rows": [
+            ("Gadget", decimal.Decimal("9.50"), datetime.date(2024, 1, 31), 1),
+            ("Widget", None, None, "many"),
+        ],
+        "sql": "SELECT ...",
+        "truncated": False,
+    }
+
+    def test_columnar_json(self):
+        rendered = json.loads(ColumnarJSONRenderer().render(self.RESULT))
+        self.assertEqual(rendered["columns"], self.RESULT["columns"])
+        self.assertEqual(rendered["rows"], [["Gadget", 9.5, "2024-01-31", 1], ["Widget", None, None, "many"]])
+        self.assertEqual(rendered["sql"], "SELECT ...")
+
+    def test_columnar_json_with_mixed_kinds(self):
+        rows = [(decimal.Decimal("1.5"),), ("n/a",), (datetime.date(2024, 1, 31),)]
+        result = dict(self.RESULT, columns=["value"], rows=rows)
+        self.assertEqual(json.loads(ColumnarJSONRenderer().render(result))["rows"], [[1.5], ["n/a"], ["2024-01-31"]])
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_arrow(self):
+        table = pyarrow.ipc.open_stream(ArrowIPCRenderer().render(self.RESULT)).read_all()
+        self.assertEqual(table.column_names, self.RESULT["columns"])
+        self.assertEqual(table.column("price").to_pylist(), [decimal.Decimal("9.50"), None])
+        self.assertEqual(table.column("ordered").to_pylist(), [datetime.date(2024, 1, 31), None])
+        # int and text in one column: sent as text rather than failing the request.
+        self.assertEqual(table.column("mixed").to_pylist(), ["1", "many"])
+        self.assertEqual(table.schema.metadata[b"sql"], b"SELECT ...")
+
+    @skipUnless(pyarrow, "pyarrow is not installed")
+    def test_arrow_mixed_with_blobs_is_binary(self):
+        result = dict(self.RESULT, columns=["value"], rows=[(b"\x00\x01",), (7,), (None,)])
+        table = pyarrow.ipc.open_stream(ArrowIPCRenderer().render(result)).read_all()
+        self.assertEqual(table.column("value").to_pylist(), [b"\x00\x01", b"7", None])
+
+    def test_errors_are_plain_json(self):
+        error = {"error": "Query stopped", "error_code": "timeout", "sql": "SELECT ..."}
+        self.assertEqual(json.loads(ColumnarJSONRenderer().render(error)), error)
+        if pyarrow is not None:
+            self.assertEqual(json.loads(ArrowIPCRenderer().render(error)), error)
+
+
+class ReferencedTablesTests(SimpleTestCase):
+    TABLES = ("api_customer", "api_order", "api_product")
+
+    def assertTables(self, sql, expected):
+        tables = referenced_tables(sql, self.TABLES)
+        self.assertEqual(tables if tables is None else sorted(tables), expected, sql)
+
+    def test_from_list_continues_after_a_join_condition(self):
+        all_tables = ["api_customer", "api_order", "api_product"]
+        self.assertTables(
+            "SELECT * FROM api_customer c JOIN api_order o ON o.customer_id = c.id, api_product p", all_tables
+        )
+        self.assertTables("SELECT * FROM api_order JOIN api_product USING (id), api_customer", all_tables)
+
+    def test_parenthesized_tables_and_subqueries(self):
+        self.assertTables("SELECT * FROM api_customer JOIN (api_order) ON 1", ["api_customer", "api_order"])
+        self.assertTables(
+            "SELECT * FROM api_customer c JOIN (api_order o JOIN api_product p ON p.id = o.product_id) ON 1",
+            ["api_customer", "api_order", "api_product"],
+        )
+        self.assertTables(
+            "SELECT * FROM (SELECT * FROM api_order) o, api_product WHERE o.quantity IN (SELECT 1 FROM api_customer)",
+            ["api_customer", "api_order", "api_product"],
+        )
+
+    def test_uncertain_parses_are_not_cached(self):
+        for sql in (
+            "WITH recent AS (SELECT * FROM api_order) SELECT * FROM recent",
+            "SELECT * FROM api_order, json_each('[1]')",
+            "SELECT * FROM main.api_order",
+            "SELECT * FROM sqlite_master",
+            "SELECT * FROM api_order WHERE (quantity > 1",
+            "SELECT * FROM api_order LEFT OUTER LATERAL api_customer",
+        ):
+            self.assertTables(sql, None)
+
+
+class SeedMockDataTests(TransactionTestCase):
+    def test_failed_reseed_leaves_previous_data(self):
+        call_command("seed_mock_data", customers=5, products=5, orders=5, stdout=io.StringIO())
+        load = seed_mock_data.Command._load
+
+        def fail_on_orders(command, model, *args):
+            if model is Order:
+                raise RuntimeError("disk full")
+            return load(command, model, *args)
+
+        with mock.patch.object(seed_mock_data.Command, "_load", fail_on_orders), self.assertRaises(RuntimeError):
+            call_command("seed_mock_data", customers=50, products=50, orders=50, stdout=io.StringIO())
+        self.assertEqual(
+            (Customer.objects.count(), Product.objects.count(), Order.objects.count()), (5, 5, 5)
+        )
+
+
+class PageTokenTests(GovernedQueryTestCase):
+    SQL = "SELECT name FROM api_customer ORDER BY id"
+
+    def setUp(self):
+        super().setUp()
+        self.names = [f"Customer {number}" for number in range(5)]
+        Customer.objects.bulk_create(
+            Customer(name=name, email=f"{number}@example.com", city="Axum") for number, name in enumerate(self.names)
+        )
+
+    def ask(self, **data):
+        response = self.client.post("/api/ask/", data, content_type="application/json")
+        return response.status_code, response.json()
+
+    def test_token_round_trip(self):
+        self.assertEqual(decode_page_token(encode_page_token(self.SQL, 40)), (self.SQL, 40))
+
+    def test_tampered_tokens_are_rejected(self):
+        payload, signature = encode_page_token(self.SQL, 2).split(":", 1)
+        # Another query's payload under this token's signature.
+        other_payload = encode_page_token("SELECT email FROM api_customer", 0).split(":", 1)[0]
+        for token in (f"{other_payload}:{signature}", "not-a-token"):
+            self.assertEqual(self.ask(page_token=token), (400, {"error": "Invalid page_token"}))
+
+    def test_pages_follow_next_page_token(self):
+        with mock.patch("api.views.generate_sql", return_value=self.SQL) as generate:
+            status, page = self.ask(question="list customers", page_size=2)
+            names = []
+            while True:
+                self.assertEqual(status, 200, page)
+                names += [row["name"] for row in page["data"]]
+                if "next_page_token" not in page:
+                    break
+                status, page = self.ask(page_token=page["next_page_token"], page_size=2)
+        self.assertEqual(names, self.names)
+        generate.assert_called_once()
+
+
+class GoldResultCacheTests(GovernedQueryTestCase):
+    GOLD = "SELECT name FROM api_product"
+
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("api.evaluation._gold_cache", OrderedDict())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        Product.objects.create(name="Gadget", price=10, category="Tools")
+
+    def insert_elsewhere(self):
+        # A raw write sends no signal, like a write by another process.
+        with connection.cursor() as cursor:
+            cursor.execute("INSERT INTO api_product (name, price, category) VALUES ('Widget', 5, 'Tools')")
+
+    @override_settings(DATA_VERSIONS_CACHE_ALIAS="")
+    def test_not_cached_without_a_shared_data_version(self):
+        self.assertEqual(_gold_result(self.GOLD).row_count, 1)
+        self.insert_elsewhere()
+        self.assertEqual(_gold_result(self.GOLD).row_count, 2)
+
+    @SHARED_VERSIONS
+    def test_cached_until_the_shared_data_version_moves(self):
+        self.assertEqual(_gold_result(self.GOLD).row_count, 1)
+        self.insert_elsewhere()
+        self.assertEqual(_gold_result(self.GOLD).row_count, 1)
+        bulk_write.send(sender=None, tables=["api_product"])
+        self.assertEqual(_gold_result(self.GOLD).row_count, 2)
+
+
+class EvaluationRunIdTests(SimpleTestCase):
+    def setUp(self):
+        root = tempfile.TemporaryDirectory()
+        self.addCleanup(root.cleanup)
+        self.runs_dir = os.path.join(root.name, "runs")
+        os.mkdir(self.runs_dir)
+        self.victim = os.path.join(root.name, "outside", "victim.json")
+        os.mkdir(os.path.dirname(self.victim))
+        with open(self.victim, "w") as f:
+            json.dump({"run_id": "victim"}, f)
+        override = override_settings(EVALUATION_RUNS_DIR=self.runs_dir)
+        override.enable()
+        self.addCleanup(override.disable)
+
+    def test_traversal_run_ids_are_rejected(self):
+        with mock.patch("api.views.start_evaluation_job") as start:
+            for run_id in ("../outside/victim", "0123456789ab/../../outside/victim", 42):
+                response = self.client.post("/api/evaluate/", {"run_id": run_id}, content_type="application/json")
+                self.assertEqual(response.status_code, 404, run_id)
+        start.assert_not_called()
+        with open(self.victim) as f:
+            self.assertEqual(json.load(f), {"run_id": "victim"})
+        self.assertIsNone(load_run_state("../outside/victim"))
+        with self.assertRaises(ValueError):
+            checkpoint_path("../outside/victim")
+
+    def test_only_generated_run_ids_are_looked_up(self):
+        self.assertEqual(self.client.get("/api/evaluate/..%2Foutside%2Fvictim/").status_code, 404)
+        self.assertEqual(self.client.get("/api/evaluate/0123456789ab/").status_code, 404)
+        with open(os.path.join(self.runs_dir, "0123456789ab.json"), "w") as f:
+            json.dump({"run_id": "0123456789ab"}, f)
+        self.assertEqual(load_run_state("0123456789ab"), {"run_id": "0123456789ab"})
+
+
+class AskAsyncTests(GovernedQueryTestCase):
+    SQL = "SELECT name, price FROM api_product ORDER BY id"
+
+    def setUp(self):
+        super().setUp()
+        Product.objects.bulk_create(
+            Product(name=f"Product {number}", price=number, category="Tools") for number in range(3)
+        )
+
+    async def ask(self, data, **headers):
+        return await self.async_client.post("/api/ask/async/", data, content_type="application/json", **headers)
+
+    async def test_pages_follow_next_page_token(self):
+        with mock.patch("api.views.agenerate_sql", mock.AsyncMock(return_value=self.SQL)) as generate:
+            first = (await self.ask({"question": "list products", "page_size": 2})).json()
+            second = (await self.ask({"page_token": first["next_page_token"], "page_size": 2})).json()
+        self.assertEqual([row["name"] for row in first["data"]], ["Product 0", "Product 1"])
+        self.assertEqual([row["name"] for row in second["data"]], ["Product 2"])
+        self.assertNotIn("next_page_token", second)
+        generate.assert_awaited_once()
+
+    async def test_tampered_page_token(self):
+        response = await self.ask({"page_token": "not-a-token"})
+        self.assertEqual((response.status_code, response.json()), (400, {"error": "Invalid page_token"}))
+
+    async def test_columnar_format(self):
+        with mock.patch("api.views.agenerate_sql", mock.AsyncMock(return_value=self.SQL)):
+            response = await self.ask(
+                {"question": "list products"}, headers={"Accept": ColumnarJSONRenderer.media_type}
+            )
+        self.assertEqual(response["Content-Type"], ColumnarJSONRenderer.media_type)
+        body = json.loads(response.content)
+        self.assertEqual(body["columns"], ["name", "price"])
+        self.assertEqual(body["rows"], [["Product 0", 0.0], ["Product 1", 1.0], ["Product 2", 2.0]])
+
+    async def test_model_unavailable_is_503(self):
+        generate = mock.AsyncMock(side_effect=ModelUnavailableError("circuit breaker is open"))
+        with mock.patch("api.views.agenerate_sql", generate):
+            response = await self.ask({"question": "list products"})
+        self.assertEqual(response.status_code, 503)
+        self.assertIn("circuit breaker is open", response.json()["error"])
+
+    @override_settings(ASK_REQUEST_TIMEOUT=0.05)
+    async def test_request_timeout_is_504(self):
+        async def hang(question):
+            await asyncio.sleep(5)
+
+        with mock.patch("api.views.agenerate_sql", hang):
+            response = await self.ask({"question": "list products"})
+        self.assertEqual((response.status_code, response.json()), (504, {"error": "Request timed out"}))
+
+
+class RetrievalPairsTests(GovernedQueryTestCase):
+    def setUp(self):
+        super().setUp()
+        pairs_dir = tempfile.TemporaryDirectory()
+        self.addCleanup(pairs_dir.cleanup)
+        patcher = mock.patch.object(retrieval_index, "validated_path", os.path.join(pairs_dir.name, "pairs.jsonl"))
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.pair = {"question": "who are our customers in axum", "sql": "SELECT * FROM api_customer"}
+
+    def test_anonymous_clients_cannot_add_pairs(self):
+        with mock.patch("api.views.add_validated_pair") as add:
+            response = self.client.post("/api/retrieval/", self.pair, content_type="application/json")
+        self.assertIn(response.status_code, (401, 403))
+        add.assert_not_called()
+        self.assertEqual(self.client.get("/api/retrieval/").status_code, 200)
+
+    def test_non_staff_users_cannot_add_pairs(self):
+        self.client.force_login(User.objects.create_user("analyst", password="secret"))
+        response = self.client.post("/api/retrieval/", self.pair, content_type="application/json")
+        self.assertEqual(response.status_code, 403)
+
+    def test_staff_can_add_pairs(self):
+        self.client.force_login(User.objects.create_user("admin", password="secret", is_staff=True))
+        response = self.client.post("/api/retrieval/", self.pair, content_type="application/json")
+        self.assertEqual(response.status_code, 201, response.content)
+        self.assertEqual(
+            question_cache.get(self.pair["question"], schema_registry.get().fingerprint), self.pair["sql"]
+        )
+
+
+class ValueDictionaryTests(GovernedQueryTestCase):
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch.object(value_dictionary, "_columns", {})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        customers = [("Abebe", "Axum"), ("Almaz", "Adama"), ("Widget", "Addis Ababa")]
+        Customer.objects.bulk_create(
+            Customer(name=name, email=f"{name.lower()}@example.com", city=city) for name, city in customers
+        )
+        Product.objects.create(name="Gadget", price=10, category="Tools")
+
+    def prepare(self, sql):
+        return prepare_query(
+            sql, schema_registry.get().text_column_set, resolve_literal=value_dictionary.resolver(sql)
+        )
+
+    def test_case_and_whitespace_are_corrected_to_the_stored_spelling(self):
+        self.assertEqual(
+            self.prepare("SELECT * FROM api_customer WHERE city = 'AXUM'"),
+            "SELECT * FROM api_customer WHERE city = 'Axum'",
+        )
+        self.assertEqual(
+            self.prepare("SELECT * FROM api_customer c WHERE c.city = ' addis  ababa'"),
+            "SELECT * FROM api_customer c WHERE c.city = 'Addis Ababa'",
+        )
+
+    def test_near_misses_are_not_rewritten_to_other_values(self):
+        self.assertEqual(
+            self.prepare("SELECT * FROM api_customer WHERE city = 'Adam'"),
+            "SELECT * FROM api_customer WHERE city COLLATE NOCASE = 'Adam'",
+        )
+        with mock.patch.object(value_dictionary, "fuzzy_cutoff", 0.85):
+            self.assertIn("'Adama'", self.prepare("SELECT * FROM api_customer WHERE city = 'Adam'"))
+
+    def test_columns_of_the_same_name_are_kept_apart(self):
+        join = "SELECT * FROM api_order o JOIN api_customer c ON c.id = o.customer_id JOIN api_product p ON p.id = o.product_id"
+        self.assertIn("c.name = 'Widget'", self.prepare(f"{join} WHERE c.name = 'widget'"))
+        self.assertIn("p.name COLLATE NOCASE = 'widget'", self.prepare(f"{join} WHERE p.name = 'widget'"))
+        # Unqualified, `name` could be either table's.
+        self.assertIn("name COLLATE NOCASE = 'gadget'", self.prepare(f"{join} WHERE name = 'gadget'"))
+        self.assertIn("name = 'Gadget'", self.prepare("SELECT * FROM api_product WHERE name = 'gadget'"))
+
+    def test_queries_use_it_only_with_a_shared_data_version(self):
+        sql = "SELECT name FROM api_customer WHERE city = 'axum'"
+        with override_settings(DATA_VERSIONS_CACHE_ALIAS=""):
+            self.assertIn("city COLLATE NOCASE = 'axum'", execute_query(sql)["sql"])
+        with SHARED_VERSIONS:
+            result = execute_query(sql)
+        self.assertIn("city = 'Axum'", result["sql"])
+        self.assertEqual(result["data"], [{"name": "Abebe"}])
+
+    def test_only_committed_saves_are_added(self):
+        self.assertEqual(value_dictionary.resolve("api_customer", "city", "axum"), "Axum")
+        try:
+            with transaction.atomic():
+                Customer.objects.create(name="Tesfaye", email="tesfaye@example.com", city="Gondar")
+                raise RuntimeError("rolled back")
+        except RuntimeError:
+            pass
+        self.assertIsNone(value_dictionary.resolve("api_customer", "city", "gondar"))
+
+        Customer.objects.create(name="Tesfaye", email="tesfaye@example.com", city="Gondar")
+        builds = value_dictionary.stats().get("builds", 0)
+        self.assertEqual(value_dictionary.resolve("api_customer", "city", "gondar"), "Gondar")
+        self.assertEqual(value_dictionary.stats().get("builds", 0), builds)
@@ -0,0 +1,185 @@
+import bisect
+import contextvars
+import sys
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
+
+# Seconds; covers cache hits (sub-millisecond) up to slow model calls.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+# Stage durations of the current request ({stage: seconds}); None outside a request.
+_request_stages = contextvars.ContextVar("request_stages", default=None)
+
+
+class Histogram:
+    def __init__(self, buckets=DEFAULT_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.total = 0.0
+
+    def observe(self, value):
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.total += value
+
+
+class MetricsRegistry:
+    """
+    In-process counters and histograms, rendered in the Prometheus text format.
+    Each worker process keeps its own registry (scrape every worker, or sum).
+    """
+
+    def __init__(self):
+        self._histograms = {}
+        self._counters = Counter()
+        self._help = {}
+        self._lock = threading.Lock()
+
+    def describe(self, name, help_text):
+        self._help[name] = help_text
+
+    def observe(self, name, value, **labels):
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = Histogram()
+            histogram.observe(value)
+
+    def inc(self, name, amount=1, **labels):
+        with self._lock:
+            self._counters[(name, tuple(sorted(labels.items())))] += amount
+
+    def render(self, extra_counters=()):
+        """`extra_counters`: (name, labels dict, value) read at scrape time, e.g. cache stats."""
+        lines = []
+        with self._lock:
+            counters = list(self._counters.items())
+            histograms = [(key, list(h.counts), h.total) for key, h in self._histograms.items()]
+        counters += [((name, tuple(sorted(labels.items()))), value) for name, labels, value in extra_counters]
+
+        seen = set()
+
+        def header(name, kind):
+            if name not in seen:
+                seen.add(name)
+                if name in self._help:
+                    lines.append(f"# HELP {name} {self._help[name]}")
+                lines.append(f"# TYPE {name} {kind}")
+
+        for (name, labels), value in sorted(counters):
+            header(name, "counter")
+            lines.append(f"{name}{_labels(labels)} {value}")
+        for (name, labels), counts, total in sorted(histograms, key=lambda item: item[0]):
+            header(name, "histogram")
+            cumulative = 0
+            for bound, count in zip(DEFAULT_BUCKETS + (float("inf"),), counts):
+                cumulative += count
+                le = "+Inf" if bound == float("inf") else repr(bound)
+                lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{_labels(labels)} {total}")
+            lines.append(f"{name}_count{_labels(labels)} {cumulative}")
+        return "\n".join(lines) + "\n"
+
+
+def _labels(labels):
+    if not labels:
+        return ""
+    escaped = (str(value).replace("\\", "\\\\").replace('"', '\\"') for _, value in labels)
+    return "{" + ",".join(f'{key}="{value}"' for (key, _), value in zip(labels, escaped)) + "}"
+
+
+metrics = MetricsRegistry()
+metrics.describe("text_to_sql_stage_seconds", "Time spent per pipeline stage.")
+metrics.describe("text_to_sql_request_seconds", "Request latency per view.")
+metrics.describe("text_to_sql_requests_total", "Requests per view and status code.")
+
+
+def start_request():
+    """Starts collecting stage timings for the current request; returns the dict they go in."""
+    stages = {}
+    _request_stages.set(stages)
+    return stages
+
+
+def record_stage(name, seconds):
+    stages = _request_stages.get()
+    if stages is not None:
+        stages[name] = stages.get(name, 0.0) + seconds
+    metrics.observe("text_to_sql_stage_seconds", seconds, stage=name)
+
+
+@contextmanager
+def stage(name):
+    """Times the block as pipeline stage `name` (Server-Timing + stage histogram)."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record_stage(name, time.perf_counter() - started)
+
+
+def server_timing(stages):
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in stages.items())
+
+
+class SamplingProfiler:
+    """
+    Low-overhead wall-clock profiler: a background thread snapshots every
+    thread's stack each `interval` seconds and counts the collapsed stacks
+    (`frame;frame;frame count` lines, the flamegraph.pl / speedscope input).
+    Started and stopped at runtime through /api/profiler/.
+    """
+
+    def __init__(self):
+        self.interval = 0.005
+        self.samples = Counter()
+        self._thread = None
+        self._stop = threading.Event()
+        self._control_lock = threading.Lock()
+        self._lock = threading.Lock()
+
+    @property
+    def running(self):
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self, interval=None):
+        with self._control_lock:
+            if self.running:
+                return
+            self.interval = interval or self.interval
+            self.samples = Counter()
+            self._stop.clear()
+            self._thread = threading.Thread(target=self._sample, name="sampling-profiler", daemon=True)
+            self._thread.start()
+
+    def stop(self):
+        with self._control_lock:
+            self._stop.set()
+            if self._thread is not None:
+                self._thread.join()
+            self._thread = None
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        while not self._stop.wait(self.interval):
+            for thread_id, frame in sys._current_frames().items():
+                if thread_id == own_id:
+                    continue
+                names = []
+                while frame is not None:
+                    code = frame.f_code
+                    names.append(f"{code.co_name} ({code.co_filename.rsplit('/', 1)[-1]}:{code.co_firstlineno})")
+                    frame = frame.f_back
+                stack = ";".join(reversed(names))
+                with self._lock:
+                    self.samples[stack] += 1
+
+    def collapsed(self):
+        with self._lock:
+            samples = self.samples.most_common()
+        return "".join(f"{stack} {count}\n" for stack, count in samples)
+
+
+profiler = SamplingProfiler()
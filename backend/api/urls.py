@@ -1,8 +1,16 @@
 from django.urls import path
-from .views import ask_question, get_schema_info, run_evaluation
+from .views import (
+    ask_question, ask_question_async, get_cache_stats, get_evaluation, get_schema_info, profiler_control,
+    retrieval_pairs, run_evaluation,
+)
 
 urlpatterns = [
     path('ask/', ask_question, name='ask_question'),
+    path('ask/async/', ask_question_async, name='ask_question_async'),
     path('schema/', get_schema_info, name='get_schema'),
     path('evaluate/', run_evaluation, name='run_evaluation'),
+    path('evaluate/<str:run_id>/', get_evaluation, name='get_evaluation'),
+    path('cache/', get_cache_stats, name='get_cache_stats'),
+    path('retrieval/', retrieval_pairs, name='retrieval_pairs'),
+    path('profiler/', profiler_control, name='profiler_control'),
 ]
\ No newline at end of file
@@ -1,41 +1,17 @@
-from django.apps import apps
+from .schema import schema_registry
 
 def get_schema_string():
-    app_models = apps.get_app_config('api').get_models()
-    schema_parts = []
-
-    for model in app_models:
-        table_name = model._meta.db_table
-        columns = []
-        for field in model._meta.fields:
-            col_type = "INT" if "int" in field.get_internal_type().lower() else "TEXT"
-            columns.append(f"{field.name} {col_type}")
-        
-        schema_parts.append(f"CREATE TABLE {table_name} ({', '.join(columns)})")
-
-    return " ".join(schema_parts)
+    return schema_registry.get().schema_string
 
 def get_text_columns():
-    app_models = apps.get_app_config('api').get_models()
-    text_columns = []
-    for model in app_models:
-        for field in model._meta.fields:
-            field_type = field.get_internal_type().lower()
-            if "char" in field_type or "text" in field_type or "email" in field_type:
-                text_columns.append(field.name)
-    return text_columns
+    return list(schema_registry.get().text_columns)
 
 def get_all_columns_list():
     """
     Returns a simple list of all columns in the database.
     Format: ['table_name.column_name', ...]
     """
-    app_models = apps.get_app_config('api').get_models()
-    col_list = []
-
-    for model in app_models:
-        table_name = model._meta.db_table
-        for field in model._meta.fields:
-            col_list.append(f"{table_name}.{field.name}")
+    return list(schema_registry.get().all_columns)
 
-    return col_list
+def get_schema_fingerprint():
+    return schema_registry.get().fingerprint
@@ -0,0 +1,216 @@
+import difflib
+import threading
+import time
+from collections import Counter
+
+from django.apps import apps
+from django.conf import settings
+from django.db import DatabaseError, transaction
+
+from .governor import QueryRejected, get_query_connection, query_deadline
+from .schema import TEXT_FIELD_MARKERS, schema_registry
+from .sql import table_aliases
+from .versions import get_table_versions
+
+
+def _key(value):
+    """The form two spellings share when they differ only in case or whitespace."""
+    return " ".join(value.split()).casefold()
+
+
+class _Column:
+    """Dictionary of one column: `values` maps `_key` -> stored value (None if ambiguous)."""
+
+    __slots__ = ("values", "version", "built_at")
+
+    def __init__(self, values, version):
+        self.values = values  # None: too many values, unique, or the build failed
+        self.version = version
+        self.built_at = time.monotonic()
+
+
+class ValueDictionary:
+    """
+    Distinct stored values of the low-cardinality text columns (city,
+    category), per (table, column), so a generated literal can be rewritten
+    to the exact stored spelling ('axum' -> 'Axum', ' addis  ababa' ->
+    'Addis Ababa') and compared with a plain, index-friendly `=` instead of
+    `COLLATE NOCASE`. Only case and whitespace are corrected: other near
+    misses match different rows, so fuzzy matching is opt-in (`fuzzy_cutoff`).
+
+    Unique columns (emails) are never tracked. A column is read on first
+    use, under the query deadline and by one request at a time (the others
+    fall back to NOCASE meanwhile). Committed saves add their values
+    (`record_saved`); any other write to the table (deletes, bulk loads)
+    and `ttl` expiry rebuild the column on next use. Queries only use it
+    when those writes are seen from every process (DATA_VERSIONS_CACHE_ALIAS):
+    a stale entry would turn a NOCASE match into a miss.
+    """
+
+    def __init__(self, max_distinct=1000, fuzzy_cutoff=0.0, ttl=300):
+        self.max_distinct = max_distinct
+        self.fuzzy_cutoff = fuzzy_cutoff
+        self.ttl = ttl
+        self._fingerprint = None
+        self._tracked = {}  # (table, column) -> (db_table, db_column), lower-cased keys
+        self._table_columns = {}  # table -> lower-cased column names
+        self._columns = {}  # (table, column) -> _Column
+        self._building = set()
+        self._lock = threading.Lock()
+        self._counters = Counter()
+
+    def _schema(self):
+        snapshot = schema_registry.get()
+        with self._lock:
+            if self._fingerprint == snapshot.fingerprint:
+                return self._tracked, self._table_columns
+        tracked = {}
+        for model in apps.get_app_config(schema_registry.app_label).get_models():
+            for field in model._meta.fields:
+                internal_type = field.get_internal_type().lower()
+                if field.unique or not any(marker in internal_type for marker in TEXT_FIELD_MARKERS):
+                    continue
+                tracked[(model._meta.db_table.lower(), field.name.lower())] = (model._meta.db_table, field.column)
+        table_columns = {
+            table.lower(): frozenset(column.lower() for column in columns)
+            for table, columns in snapshot.columns_by_table.items()
+        }
+        with self._lock:
+            if self._fingerprint != snapshot.fingerprint:
+                self._fingerprint = snapshot.fingerprint
+                self._tracked, self._table_columns = tracked, table_columns
+                self._columns = {}
+            return self._tracked, self._table_columns
+
+    def _distinct_values(self, db_table, db_column):
+        with get_query_connection().cursor() as cursor:
+            quote = cursor.db.ops.quote_name
+            with query_deadline(cursor, settings.QUERY_TIMEOUT):
+                cursor.execute(
+                    f"SELECT DISTINCT {quote(db_column)} FROM {quote(db_table)} "
+                    f"WHERE {quote(db_column)} IS NOT NULL LIMIT %s",
+                    [self.max_distinct + 1],
+                )
+                values = [row[0] for row in cursor.fetchall()]
+        if len(values) > self.max_distinct:
+            return None
+        entries = {}
+        for value in values:
+            self._add(entries, value)
+        return entries
+
+    def _entries(self, table, column):
+        """The column's `values`, building them if needed; None while another request builds them."""
+        tracked, _ = self._schema()
+        if (table, column) not in tracked:
+            return None
+        version = get_table_versions([table])
+        with self._lock:
+            entry = self._columns.get((table, column))
+            if entry is not None and entry.version == version and time.monotonic() - entry.built_at < self.ttl:
+                return entry.values
+            if (table, column) in self._building:
+                self._counters["busy"] += 1
+                return None
+            self._building.add((table, column))
+        try:
+            try:
+                values = self._distinct_values(*tracked[(table, column)])
+                outcome = "builds"
+            except (QueryRejected, DatabaseError):
+                values = None  # untracked until the table changes or `ttl` passes
+                outcome = "build_failures"
+            with self._lock:
+                self._columns[(table, column)] = _Column(values, version)
+                self._counters[outcome] += 1
+        finally:
+            with self._lock:
+                self._building.discard((table, column))
+        return values
+
+    @staticmethod
+    def _add(entries, value):
+        key = _key(value)
+        if key in entries and entries[key] != value:
+            entries[key] = None  # stored in several spellings; only NOCASE finds them all
+        else:
+            entries[key] = value
+
+    def resolve(self, table, column, literal):
+        """The stored spelling of `literal` in `table.column`, or None (then NOCASE applies)."""
+        entries = self._entries(table, column)
+        if not entries:
+            return None
+        key = _key(literal)
+        with self._lock:
+            value = entries.get(key)
+            outcome = "exact" if key in entries else "unresolved"
+            candidates = list(entries) if outcome == "unresolved" and self.fuzzy_cutoff > 0 else ()
+        if candidates:
+            matches = difflib.get_close_matches(key, candidates, n=1, cutoff=self.fuzzy_cutoff)
+            if matches:
+                outcome, value = "fuzzy", entries.get(matches[0])
+        if value is None:
+            outcome = "unresolved"
+        with self._lock:
+            self._counters[outcome] += 1
+        return value
+
+    def resolver(self, sql):
+        """
+        `resolve_literal` for `prepare_query(sql)`: finds the table of each
+        compared column from its qualifier, or as the only table of `sql`
+        that has a column of that name.
+        """
+        _, table_columns = self._schema()
+        aliases = {}  # parsed on the first literal, so other queries keep a single tokenizer pass
+
+        def resolve(qualifier, column, literal):
+            if not aliases:
+                aliases.update(table_aliases(sql, table_columns))
+            if qualifier is not None:
+                table = aliases.get(qualifier)
+            else:
+                owners = [table for table in set(aliases.values()) if column in table_columns[table]]
+                table = owners[0] if len(owners) == 1 else None
+            return self.resolve(table, column, literal) if table is not None else None
+
+        return resolve
+
+    def record_saved(self, sender, instance, using=None, **kwargs):
+        """post_save receiver: adds the row's values once the save is committed."""
+        table = sender._meta.db_table.lower()
+        values = {field.name.lower(): getattr(instance, field.attname, None) for field in sender._meta.fields}
+        transaction.on_commit(lambda: self._add_saved(table, values), using=using)
+
+    def _add_saved(self, table, values):
+        epoch, version = get_table_versions([table])
+        with self._lock:
+            for (column_table, column), entry in self._columns.items():
+                if column_table != table or entry.values is None:
+                    continue
+                value = values.get(column)
+                if isinstance(value, str):
+                    self._add(entry.values, value)
+                    if len(entry.values) > self.max_distinct:
+                        entry.values = None
+                # Runs after bump_data_version (registered first): if this save
+                # is the only write since the build, the column is still complete.
+                if entry.version == (epoch, version - 1):
+                    entry.version = (epoch, version)
+
+    def stats(self):
+        with self._lock:
+            columns = {
+                f"{table}.{column}": len(entry.values)
+                for (table, column), entry in self._columns.items()
+                if entry.values is not None
+            }
+            return dict(self._counters, columns=columns)
+
+
+value_dictionary = ValueDictionary(
+    max_distinct=settings.VALUE_DICTIONARY_MAX_DISTINCT,
+    fuzzy_cutoff=settings.VALUE_DICTIONARY_FUZZY_CUTOFF,
+    ttl=settings.VALUE_DICTIONARY_TTL,
+)
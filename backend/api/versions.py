@@ -0,0 +1,90 @@
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.dispatch import Signal
+
+_KEY_PREFIX = "api_data_version:"
+# Write counters: "all" moves on every write, "table:<db_table>" on writes to
+# that table, "epoch" when a writer doesn't say which tables it touched.
+# Kept here unless DATA_VERSIONS_CACHE_ALIAS names a cache shared by all processes.
+_local = Counter()
+_lock = threading.Lock()
+
+# Sent by code that writes `api` tables without model signals (bulk_create,
+# QuerySet.update, raw SQL loaders), with `tables=[db_table, ...]`.
+bulk_write = Signal()
+
+
+def _shared_store():
+    alias = settings.DATA_VERSIONS_CACHE_ALIAS
+    return caches[alias] if alias else None
+
+
+def _read(names):
+    store = _shared_store()
+    if store is None:
+        with _lock:
+            return tuple(_local[name] for name in names)
+    keys = [_KEY_PREFIX + name for name in names]
+    found = store.get_many(keys)
+    missing = [key for key in keys if key not in found]
+    if missing:
+        for key in missing:
+            # Start from the clock, so a counter lost to eviction or a restart
+            # of the store doesn't come back with a value it had before.
+            store.add(key, time.time_ns(), timeout=None)
+        found.update(store.get_many(missing))
+    return tuple(found.get(key) for key in keys)
+
+
+def _increment(names):
+    store = _shared_store()
+    if store is None:
+        with _lock:
+            _local.update(names)
+        return
+    for name in names:
+        key = _KEY_PREFIX + name
+        try:
+            store.incr(key)
+        except ValueError:  # not there (yet, or any more): any fresh value is a change
+            store.add(key, time.time_ns(), timeout=None)
+
+
+def get_data_version():
+    """
+    Token that changes whenever `api` data is written through the ORM (or a
+    bulk loader sends `bulk_write`). Caches of query results key on it.
+    """
+    return _read(["all"])[0]
+
+
+def get_table_versions(tables):
+    """
+    Token that changes whenever one of `tables` is written, but not on writes
+    to other tables: `(epoch, version of each table in sorted order)`.
+    """
+    return _read(["epoch"] + [f"table:{table.lower()}" for table in sorted(tables)])
+
+
+def bump_data_version(sender=None, tables=None, using=None, **kwargs):
+    """
+    Receiver for post_save/post_delete (the sender model's table changed) and
+    `bulk_write` (`tables` changed). Without either, every table counts as changed.
+
+    The counters move when the write commits (at once outside a transaction):
+    a query run between an earlier bump and the commit would still read the
+    old rows and cache them under the new version.
+    """
+    if tables is None and sender is not None and hasattr(sender, "_meta"):
+        tables = [sender._meta.db_table]
+    transaction.on_commit(lambda: _bump(tables), using=using)
+
+
+def _bump(tables):
+    names = ["epoch"] if tables is None else [f"table:{table.lower()}" for table in tables]
+    _increment(["all"] + names)
@@ -1,169 +1,284 @@
-import os
-from rest_framework.decorators import api_view
+import asyncio
+import json
+
+from django.conf import settings
+from django.core import signing
+from django.http import Http404, HttpResponse, StreamingHttpResponse
+from django.views.decorators.csrf import csrf_exempt
+from django.views.decorators.http import require_POST
+from rest_framework.decorators import api_view, permission_classes, renderer_classes
+from rest_framework.permissions import SAFE_METHODS, BasePermission
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
-from gradio_client import Client
-from nltk.translate.bleu_score import sentence_bleu, SmoothingFunction
+from rest_framework.utils.encoders import JSONEncoder
 
-from .utils import get_schema_string, get_all_columns_list
-from .services import execute_query
+from .utils import get_schema_string, get_schema_fingerprint
+from .cache import question_cache, result_cache
+from .services import (
+    add_validated_pair, aexecute_query, agenerate_sql, execute_query, generate_sql, stream_query,
+)
+from .clients import ModelUnavailableError
+from .evaluation import build_report, load_run_state, start_evaluation_job
+from .pagination import decode_page_token, encode_page_token
+from .renderers import result_renderer_classes
+from .retrieval import retrieval_index
+from .values import value_dictionary
+from .timing import metrics, profiler
 
-# --- Helper to compare two SQL results ---
-def compare_query_results(sql_generated, sql_expected):
-    """
-    Returns True if both queries return the exact same data.
-    """
-    try:
-        # Execute Generated
-        res_gen = execute_query(sql_generated)
-        if "error" in res_gen:
-            return False, res_gen["error"]
+def _wants_stream(request):
+    if "application/x-ndjson" in request.headers.get("Accept", ""):
+        return True
+    flag = request.data.get("stream", request.query_params.get("stream"))
+    return str(flag).lower() in ("1", "true", "yes")
+
+def _ndjson_lines(sql_query):
+    # Header line, one line per row, then a footer line with the row count.
+    encoder = JSONEncoder()
+    columns = []
+    for item in stream_query(sql_query):
+        if isinstance(item, dict):
+            columns = item.get("columns", columns)
+            yield encoder.encode(item) + "\n"
+        else:
+            yield "".join(encoder.encode(dict(zip(columns, row))) + "\n" for row in item)
 
-        # Execute Expected (Gold Standard)
-        res_exp = execute_query(sql_expected)
-        if "error" in res_exp:
-            return False, "Gold standard query failed (bad test case)"
+def _parse_page_size(value):
+    """Returns (page_size, error message)."""
+    if value is None:
+        return None, None
+    try:
+        page_size = min(int(value), settings.QUERY_MAX_PAGE_SIZE)
+    except (TypeError, ValueError):
+        return None, "page_size must be an integer"
+    if page_size < 1:
+        return None, "page_size must be positive"
+    return page_size, None
 
-        # Compare Data
-        # We sort the data to ensure column order doesn't fail the test
-        data_gen = sorted(str(d) for d in res_gen.get("data", []))
-        data_exp = sorted(str(d) for d in res_exp.get("data", []))
+def _decode_page(page_token):
+    """Returns (generated_sql, offset), or None for a tampered/garbled token."""
+    try:
+        return decode_page_token(page_token)
+    except (signing.BadSignature, KeyError, TypeError, ValueError):
+        return None
 
-        return data_gen == data_exp, "Success"
-    except Exception as e:
-        return False, str(e)
+def _add_next_page_token(execution_result, generated_sql, offset, page_size, row_format):
+    if page_size and execution_result.get("truncated"):
+        returned = len(execution_result["rows" if row_format == "rows" else "data"])
+        execution_result["next_page_token"] = encode_page_token(generated_sql, offset + returned)
+    return execution_result
 
 @api_view(['POST'])
+@renderer_classes(result_renderer_classes())
 def ask_question(request):
-    user_question = request.data.get("question")
-    if not user_question:
-        return Response({"error": "No question provided"}, status=400)
+    page_token = request.data.get("page_token")
+    page_size, error = _parse_page_size(request.data.get("page_size"))
+    if error:
+        return Response({"error": error}, status=400)
+    offset = 0
+
+    if page_token:
+        # Follow-up page: the token already carries the generated SQL.
+        page = _decode_page(page_token)
+        if page is None:
+            return Response({"error": "Invalid page_token"}, status=400)
+        generated_sql, offset = page
+    else:
+        user_question = request.data.get("question")
+        if not user_question:
+            return Response({"error": "No question provided"}, status=400)
+
+        try:
+            # 1-3. Question cache, or predict on a pooled HF Space client
+            # (Send Question + List of Columns) and clean up the output
+            generated_sql = generate_sql(user_question)
+
+        except ModelUnavailableError as e:
+            return Response({"error": f"AI Error: {str(e)}"}, status=503)
+        except Exception as e:
+            return Response({"error": f"AI Error: {str(e)}"}, status=500)
 
-    # 1. Get all columns to send to the Vectorizer
-    all_cols = get_all_columns_list()
+    # 4. Execute (streamed, paginated, or capped at QUERY_MAX_ROWS)
+    if _wants_stream(request):
+        return StreamingHttpResponse(_ndjson_lines(generated_sql), content_type="application/x-ndjson")
 
+    # Columnar JSON / Arrow renderers take the raw row tuples.
+    row_format = "rows" if request.accepted_renderer.format in ("columnar", "arrow") else "records"
+    execution_result = execute_query(generated_sql, offset=offset, limit=page_size, row_format=row_format)
+    return Response(_add_next_page_token(execution_result, generated_sql, offset, page_size, row_format))
+
+def _negotiate_renderer(request):
+    # Plain Django view, so pick among the result renderers by hand.
+    accept = request.headers.get("Accept", "")
+    for renderer_class in result_renderer_classes():
+        if renderer_class.format in ("columnar", "arrow") and renderer_class.media_type in accept:
+            return renderer_class()
+    return JSONRenderer()
+
+def _async_response(request, data, status=200):
+    renderer = _negotiate_renderer(request)
+    response = HttpResponse(status=status, content_type=renderer.media_type)
+    response.content = renderer.render(data, renderer_context={"response": response})
+    return response
+
+@csrf_exempt
+@require_POST
+async def ask_question_async(request):
+    """
+    ask_question for ASGI deployments: the model call is awaited instead of
+    holding a worker thread, and the whole request is bounded by
+    ASK_REQUEST_TIMEOUT. A client disconnect cancels the in-flight Space job.
+    Supports the same pagination and columnar/Arrow formats (not NDJSON streaming).
+    """
     try:
-        # 2. Connect to HF Space
-        model_id = os.getenv("HF_MODEL_ID", "hmyunis/text-to-sql-bot")
-        client = Client(model_id, token=os.getenv("HF_TOKEN"))
+        data = json.loads(request.body or b"{}")
+    except ValueError:
+        return _async_response(request, {"error": "Invalid JSON body"}, status=400)
+
+    page_token = data.get("page_token")
+    page_size, error = _parse_page_size(data.get("page_size"))
+    if error:
+        return _async_response(request, {"error": error}, status=400)
+    offset = 0
 
-        # 3. Predict (Send Question + List of Columns)
-        generated_sql = client.predict(user_question, str(all_cols))
+    if page_token:
+        page = _decode_page(page_token)
+        if page is None:
+            return _async_response(request, {"error": "Invalid page_token"}, status=400)
+        generated_sql, offset = page
+    elif not data.get("question"):
+        return _async_response(request, {"error": "No question provided"}, status=400)
 
-        # 4. Clean up output (T5 sometimes generates text, rarely extra junk)
-        generated_sql = generated_sql.strip()
+    row_format = "rows" if _negotiate_renderer(request).format in ("columnar", "arrow") else "records"
 
-        # 5. Execute
-        execution_result = execute_query(generated_sql)
-        return Response(execution_result)
+    try:
+        async with asyncio.timeout(settings.ASK_REQUEST_TIMEOUT):
+            if not page_token:
+                try:
+                    generated_sql = await agenerate_sql(data["question"])
+                except ModelUnavailableError as e:
+                    return _async_response(request, {"error": f"AI Error: {str(e)}"}, status=503)
+                except Exception as e:
+                    return _async_response(request, {"error": f"AI Error: {str(e)}"}, status=500)
 
-    except Exception as e:
-        return Response({"error": f"AI Error: {str(e)}"}, status=500)
+            execution_result = await aexecute_query(
+                generated_sql, offset=offset, limit=page_size, row_format=row_format
+            )
+    except TimeoutError:
+        return _async_response(request, {"error": "Request timed out"}, status=504)
 
-@api_view(['GET'])
+    return _async_response(
+        request, _add_next_page_token(execution_result, generated_sql, offset, page_size, row_format)
+    )
+
+@api_view(['POST'])
 def run_evaluation(request):
     """
     Evaluation Metric: Execution Accuracy (ExMatch)
     This is superior to BLEU because it checks if the code WORKS, not just if it looks right.
+
+    Starts (or, with `run_id`, resumes) a background run over a named test set;
+    poll GET /api/evaluate/<run_id>/ for progress and the report.
     """
-    # 1. The Gold Standard Test Set
-    test_set = [
-        {
-            "question": "Show me all customers",
-            "gold_sql": "SELECT * FROM api_customer"
-        },
-        {
-            "question": "Who lives in Axum?",
-            "gold_sql": "SELECT * FROM api_customer WHERE city = 'Axum'"
-        },
-        {
-            "question": "Count total orders",
-            "gold_sql": "SELECT COUNT(*) FROM api_order"
-        },
-        {
-            "question": "Show me products with price higher than 15",
-            "gold_sql": "SELECT * FROM api_product WHERE price > 15"
-        },
-        {
-            "question": "List valuable products",
-            "gold_sql": "SELECT * FROM api_product ORDER BY price DESC LIMIT 5"
-        },
-        {
-            "question": "Show all orders",
-            "gold_sql": "SELECT * FROM api_order"
-        },
-        {
-            "question": "List all products",
-            "gold_sql": "SELECT * FROM api_product"
-        },
-        {
-            "question": "How many customers are there?",
-            "gold_sql": "SELECT COUNT(*) FROM api_customer"
-        },
-        {
-            "question": "Show customers from Addis Ababa",
-            "gold_sql": "SELECT * FROM api_customer WHERE city = 'Addis Ababa'"
-        },
-        {
-            "question": "Show products cheaper than 10",
-            "gold_sql": "SELECT * FROM api_product WHERE price < 10"
-        }
-    ]
+    test_set = request.data.get("test_set", "default")
+    if test_set not in settings.EVALUATION_TEST_SETS:
+        return Response({"error": f"Unknown test set: {test_set}"}, status=400)
 
-    all_cols = str(get_all_columns_list())
-    client = Client(os.getenv("HF_MODEL_ID", "hmyunis/text-to-sql-bot"), token=os.getenv("HF_TOKEN"))
+    run_id = request.data.get("run_id")
+    if run_id is not None and load_run_state(run_id) is None:
+        return Response({"error": "Unknown evaluation run"}, status=404)
 
-    results = []
-    correct_count = 0
+    try:
+        run_id = start_evaluation_job(test_set=test_set, run_id=run_id)
+    except (OSError, ValueError) as e:
+        return Response({"error": f"Could not load test set: {str(e)}"}, status=500)
+    return Response({"run_id": run_id, "status": "running"}, status=202)
+
+@api_view(['GET'])
+def get_evaluation(request, run_id):
+    state = load_run_state(run_id)
+    if state is None:
+        return Response({"error": "Unknown evaluation run"}, status=404)
+    return Response(build_report(state))
+
+@api_view(['GET'])
+def get_schema_info(request):
+    return Response({"schema": get_schema_string(), "fingerprint": get_schema_fingerprint()})
 
-    for item in test_set:
-        question = item["question"]
-        gold_sql = item["gold_sql"]
+@api_view(['GET'])
+def get_cache_stats(request):
+    return Response({
+        "question_cache": question_cache.stats(),
+        "result_cache": result_cache.stats(),
+        "retrieval": retrieval_index.stats(),
+        "value_dictionary": value_dictionary.stats(),
+    })
 
+def get_metrics(request):
+    """Prometheus scrape endpoint (text exposition format), per worker process."""
+    cache_stats = question_cache.stats()
+    cache_counters = [
+        ("text_to_sql_question_cache_lookups_total", {"result": result}, cache_stats[result])
+        for result in ("local_hits", "shared_hits", "coalesced", "misses")
+    ]
+    result_stats = result_cache.stats()
+    cache_counters += [
+        ("text_to_sql_result_cache_lookups_total", {"result": result}, result_stats[result])
+        for result in ("hits", "misses")
+    ]
+    cache_counters.append(("text_to_sql_result_cache_evictions_total", {}, result_stats["evictions"]))
+    retrieval_stats = retrieval_index.stats()
+    cache_counters += [
+        ("text_to_sql_retrieval_lookups_total", {"result": result}, retrieval_stats[result])
+        for result in ("hits", "misses")
+    ]
+    return HttpResponse(
+        metrics.render(extra_counters=cache_counters), content_type="text/plain; version=0.0.4; charset=utf-8"
+    )
+
+@api_view(['GET', 'POST'])
+def profiler_control(request):
+    """
+    POST {"enabled": true, "interval_ms": 5} starts the sampling profiler,
+    {"enabled": false} stops it; GET returns the collapsed stacks sampled so far.
+    """
+    if not settings.PROFILER_ENABLED:
+        raise Http404
+    if request.method == "GET":
+        return HttpResponse(profiler.collapsed(), content_type="text/plain; charset=utf-8")
+
+    if request.data.get("enabled"):
         try:
-            # 2. Get AI Prediction
-            generated_sql = client.predict(question, all_cols)
-            generated_sql = generated_sql.strip()
-
-            # 3. Calculate Execution Accuracy (The Logic Check)
-            is_correct, debug_msg = compare_query_results(generated_sql, gold_sql)
-
-            if is_correct:
-                correct_count += 1
-                status = "PASS"
-            else:
-                status = "FAIL"
-
-            # 4. Calculate BLEU (The Syntax Check - purely for reference)
-            ref_tokens = gold_sql.lower().split()
-            cand_tokens = generated_sql.lower().split()
-            bleu = sentence_bleu([ref_tokens], cand_tokens, smoothing_function=SmoothingFunction().method1)
-
-            results.append({
-                "question": question,
-                "status": status,
-                "generated_sql": generated_sql,
-                "expected_sql": gold_sql,
-                "execution_match": is_correct,
-                "bleu_score": round(bleu, 4),
-                "debug": debug_msg
-            })
+            interval = float(request.data.get("interval_ms", 5)) / 1000
+        except (TypeError, ValueError):
+            return Response({"error": "interval_ms must be a number"}, status=400)
+        profiler.start(interval=interval)
+    else:
+        profiler.stop()
+    return Response({"running": profiler.running, "interval_ms": profiler.interval * 1000})
 
-        except Exception as e:
-            results.append({
-                "question": question,
-                "status": "ERROR",
-                "error": str(e)
-            })
+class IsStaffOrReadOnly(BasePermission):
+    """Reads for everyone; writes only for staff users."""
 
-    accuracy = (correct_count / len(test_set)) * 100
+    def has_permission(self, request, view):
+        return request.method in SAFE_METHODS or bool(request.user and request.user.is_staff)
 
-    return Response({
-        "metric": "Execution Accuracy (ExMatch)",
-        "description": "Measures if the generated SQL returns the exact same database result as the Gold Standard query.",
-        "overall_accuracy_percent": f"{accuracy}%",
-        "detailed_results": results
-    })
+@api_view(['GET', 'POST'])
+@permission_classes([IsStaffOrReadOnly])
+def retrieval_pairs(request):
+    """
+    GET returns the retrieval fast path's stats; POST {"question", "sql"}
+    adds a validated pair, answered from the index from then on. A pair
+    replaces the cached answer to its question for every user, so POST
+    needs a staff user (session or basic auth).
+    """
+    if request.method == "GET":
+        return Response({"retrieval": retrieval_index.stats()})
 
-@api_view(['GET'])
-def get_schema_info(request):
-    return Response({"schema": get_schema_string()})
+    question = request.data.get("question")
+    sql = request.data.get("sql")
+    if not question or not sql:
+        return Response({"error": "question and sql are required"}, status=400)
+    error = add_validated_pair(question, sql)
+    if error:
+        return Response({"error": error}, status=400)
+    return Response({"retrieval": retrieval_index.stats()}, status=201)
@@ -0,0 +1,151 @@
+import json
+import os
+import random
+import threading
+from functools import lru_cache
+
+from django.apps import apps
+from django.conf import settings
+
+from .schema import schema_registry
+from .sql import table_aliases, tokenize
+
+EQUALITY_PREDICATES = frozenset(("=", "==", "IN", "IS"))
+RANGE_PREDICATES = frozenset(("<", ">", "<=", ">=", "BETWEEN", "LIKE", "GLOB"))
+# Clause keywords that decide what a column reference is used for.
+_CLAUSES = {
+    "WHERE": "where", "HAVING": "where", "ON": "join", "ORDER": "order",
+    "SELECT": None, "FROM": None, "GROUP": None, "LIMIT": None, "JOIN": None,
+}
+
+
+@lru_cache(maxsize=4)
+def _db_columns(fingerprint):
+    # {table: {column, ...}} by database column name (`customer_id`, not `customer`).
+    columns = {}
+    for model in apps.get_app_config("api").get_models():
+        columns[model._meta.db_table.lower()] = {field.column.lower() for field in model._meta.fields}
+    return columns
+
+
+def access_columns(sql):
+    """
+    Columns `sql` filters, sorts and joins on, resolved to their tables:
+
+        {"where": [[table, column, "eq"|"range", nocase], ...],
+         "order": [[table, column], ...],
+         "join": [[table, column], ...]}
+
+    `nocase` is True when the predicate carries the `COLLATE NOCASE` rewrite.
+    """
+    snapshot = schema_registry.get()
+    db_columns = _db_columns(snapshot.fingerprint)
+    aliases = table_aliases(sql, snapshot.table_names)
+    query_tables = set(aliases.values())
+    tokens = [token for token in tokenize(sql) if token.kind not in ("ws", "comment")]
+
+    def name(index):
+        if index < len(tokens) and tokens[index].kind in ("word", "quoted"):
+            text = tokens[index].text
+            return (text[1:-1] if tokens[index].kind == "quoted" else text).lower()
+        return None
+
+    def text(index):
+        return tokens[index].text.upper() if index < len(tokens) else ""
+
+    def column_at(index):
+        """Returns ((table, column), index after the reference) or (None, index + 1)."""
+        first = name(index)
+        if first is None or (index > 0 and tokens[index - 1].text == "."):
+            return None, index + 1
+        if text(index + 1) == "." and name(index + 2) is not None:
+            table, column, end = aliases.get(first), name(index + 2), index + 3
+        else:
+            owners = [table for table in query_tables if first in db_columns.get(table, ())]
+            table, column, end = (owners[0] if len(owners) == 1 else None), first, index + 1
+        if table is None or column not in db_columns.get(table, ()) or text(end) == "(":
+            return None, index + 1
+        return (table, column), end
+
+    where, order, join = [], [], []
+    clause = None
+    index = 0
+    while index < len(tokens):
+        keyword = text(index)
+        if tokens[index].kind == "word" and keyword in _CLAUSES:
+            clause = _CLAUSES[keyword]
+            index += 1
+            continue
+        reference, end = column_at(index)
+        if reference is None or clause is None:
+            index = end
+            continue
+
+        nocase = text(end) == "COLLATE" and text(end + 1) == "NOCASE"
+        if nocase:
+            end += 2
+        if clause == "order":
+            order.append(list(reference))
+        elif text(end) in EQUALITY_PREDICATES or text(end) in RANGE_PREDICATES:
+            other, after = column_at(end + 1)
+            if other is not None:
+                # `a.x = b.y`: a join condition, whether written in ON or WHERE.
+                join.extend([list(reference), list(other)])
+                end = after
+            else:
+                kind = "eq" if text(end) in EQUALITY_PREDICATES else "range"
+                where.append([*reference, kind, nocase])
+        index = end
+    return {"where": where, "order": order, "join": join}
+
+
+class WorkloadLog:
+    """
+    Append-only JSON-lines log of executed generated queries: the SQL as run
+    (so it can be EXPLAINed later), its latency and its `access_columns`.
+    Queries answered from the result cache are logged too, flagged `cached`
+    with the latency they had when they last ran, so the hottest queries
+    keep their weight.
+    Rotated to `<path>.1` once it grows past `max_bytes`; read by the
+    `advise_indexes` command.
+    """
+
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, sample_rate=1.0):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.sample_rate = sample_rate
+        self._lock = threading.Lock()
+
+    def record(self, sql, elapsed, cached=False):
+        if not self.path or random.random() >= self.sample_rate:
+            return
+        try:
+            entry = {"sql": sql, "ms": round(elapsed * 1000, 3), **access_columns(sql)}
+            if cached:
+                entry["cached"] = True
+            line = json.dumps(entry, separators=(",", ":")) + "\n"
+            with self._lock:
+                if os.path.exists(self.path) and os.path.getsize(self.path) > self.max_bytes:
+                    os.replace(self.path, f"{self.path}.1")
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+        except Exception:
+            pass  # the log is advisory; never fail a query over it
+
+    def entries(self):
+        for path in (f"{self.path}.1", self.path):
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding="utf-8") as f:
+                for line in f:
+                    try:
+                        yield json.loads(line)
+                    except ValueError:
+                        continue  # torn line from a concurrent writer
+
+
+workload_log = WorkloadLog(
+    settings.WORKLOAD_LOG_PATH,
+    max_bytes=settings.WORKLOAD_LOG_MAX_BYTES,
+    sample_rate=settings.WORKLOAD_LOG_SAMPLE_RATE,
+)
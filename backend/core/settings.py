@@ -10,6 +10,8 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/5.2/ref/settings/
 """
 
+import json
+
 import dj_database_url
 from decouple import config
 from pathlib import Path
@@ -42,6 +44,7 @@ INSTALLED_APPS = [
 
 MIDDLEWARE = [
     'corsheaders.middleware.CorsMiddleware',
+    'api.middleware.ServerTimingMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -85,12 +88,17 @@ WSGI_APPLICATION = 'core.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
+DATABASE_URL = config('DATABASE_URL', default=f"sqlite:///{BASE_DIR / 'db.sqlite3'}")
+
 DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
-    }
+    'default': dj_database_url.parse(DATABASE_URL),
 }
+if DATABASES['default']['ENGINE'] == 'django.db.backends.sqlite3':
+    # WAL lets the read-only query connections read while the app writes.
+    DATABASES['default']['OPTIONS'] = {'init_command': 'PRAGMA journal_mode = WAL; PRAGMA synchronous = NORMAL'}
+    # Tests too: connections to an in-memory test database share one cache, where
+    # reading a table with uncommitted writes fails instead of seeing the last commit.
+    DATABASES['default']['TEST'] = {'NAME': str(BASE_DIR / 'test_db.sqlite3')}
 
 
 # Password validation
@@ -133,3 +141,165 @@ STATIC_URL = 'static/'
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
+
+
+# Hugging Face model Space
+# Clients are pooled per process; see api/clients.py
+
+HF_MODEL_ID = config('HF_MODEL_ID', default='hmyunis/text-to-sql-bot')
+HF_TOKEN = config('HF_TOKEN', default=None)
+
+MODEL_CLIENT_POOL_SIZE = config('MODEL_CLIENT_POOL_SIZE', default=4, cast=int)
+MODEL_CLIENT_TIMEOUT = config('MODEL_CLIENT_TIMEOUT', default=30.0, cast=float)
+MODEL_CLIENT_RETRIES = config('MODEL_CLIENT_RETRIES', default=2, cast=int)
+MODEL_CLIENT_BACKOFF = config('MODEL_CLIENT_BACKOFF', default=0.5, cast=float)
+MODEL_CIRCUIT_FAILURE_THRESHOLD = config('MODEL_CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int)
+MODEL_CIRCUIT_RESET_TIMEOUT = config('MODEL_CIRCUIT_RESET_TIMEOUT', default=30.0, cast=float)
+
+
+# Generated query execution
+# Results are capped server-side; larger results can be paged or streamed.
+
+QUERY_MAX_ROWS = config('QUERY_MAX_ROWS', default=10000, cast=int)
+QUERY_MAX_PAGE_SIZE = config('QUERY_MAX_PAGE_SIZE', default=1000, cast=int)
+QUERY_STREAM_CHUNK_SIZE = config('QUERY_STREAM_CHUNK_SIZE', default=500, cast=int)
+
+# Execution governor (api/governor.py)
+# Queries get a deadline (seconds of execution, 0 disables), a LIMIT when they have
+# none, and are rejected before running when their plan sorts/groups a full scan of
+# more than QUERY_PLAN_MAX_SCAN_ROWS rows or nested-loop joins too many rows. Row
+# counts are estimates from table statistics; streaming scans are left to the deadline.
+QUERY_TIMEOUT = config('QUERY_TIMEOUT', default=5.0, cast=float)
+QUERY_AUTO_LIMIT = config('QUERY_AUTO_LIMIT', default=True, cast=bool)
+QUERY_PLAN_CHECK = config('QUERY_PLAN_CHECK', default=True, cast=bool)
+QUERY_PLAN_MAX_SCAN_ROWS = config('QUERY_PLAN_MAX_SCAN_ROWS', default=1000000, cast=int)
+QUERY_PLAN_MAX_LOOP_ROWS = config('QUERY_PLAN_MAX_LOOP_ROWS', default=10000000, cast=int)
+
+# Generated queries run on a separate read-only database alias, so model SQL
+# can't write and analytical reads don't contend with the app's own connection.
+# QUERY_DATABASE_URL defaults to DATABASE_URL; on PostgreSQL point it at a read-only role.
+# Connections are kept per worker thread for QUERY_DB_CONN_MAX_AGE seconds and
+# health-checked before reuse; QUERY_DB_POOL_SIZE > 0 uses psycopg's pool instead (PostgreSQL).
+QUERY_DATABASE_ALIAS = 'readonly'
+QUERY_DATABASE_URL = config('QUERY_DATABASE_URL', default=DATABASE_URL)
+QUERY_DB_CONN_MAX_AGE = config('QUERY_DB_CONN_MAX_AGE', default=600, cast=int)
+QUERY_DB_POOL_SIZE = config('QUERY_DB_POOL_SIZE', default=0, cast=int)
+QUERY_SQLITE_MMAP_SIZE = config('QUERY_SQLITE_MMAP_SIZE', default=256 * 1024 * 1024, cast=int)  # bytes
+QUERY_SQLITE_CACHE_SIZE = config('QUERY_SQLITE_CACHE_SIZE', default=-64 * 1024, cast=int)  # pages, or -KiB
+
+_query_database = dj_database_url.parse(
+    QUERY_DATABASE_URL,
+    conn_max_age=0 if QUERY_DB_POOL_SIZE else QUERY_DB_CONN_MAX_AGE,
+    conn_health_checks=True,
+)
+_query_options = _query_database.setdefault('OPTIONS', {})
+if _query_database['ENGINE'] == 'django.db.backends.sqlite3':
+    _query_database['NAME'] = f"{Path(_query_database['NAME']).resolve().as_uri()}?mode=ro"
+    _query_options['init_command'] = (
+        f"PRAGMA query_only = ON; PRAGMA mmap_size = {QUERY_SQLITE_MMAP_SIZE}; "
+        f"PRAGMA cache_size = {QUERY_SQLITE_CACHE_SIZE}"
+    )
+elif _query_database['ENGINE'] == 'django.db.backends.postgresql':
+    _query_options['options'] = '-c default_transaction_read_only=on'
+    if QUERY_DB_POOL_SIZE:
+        _query_options['pool'] = {'min_size': 1, 'max_size': QUERY_DB_POOL_SIZE, 'timeout': QUERY_TIMEOUT or 30}
+elif _query_database['ENGINE'] == 'django.db.backends.mysql':
+    _query_options['init_command'] = 'SET SESSION TRANSACTION READ ONLY'
+# Tests run generated queries against the test copy of the default database.
+_query_database['TEST'] = {'MIRROR': 'default'}
+DATABASES[QUERY_DATABASE_ALIAS] = _query_database
+
+# Distinct-value dictionary (api/values.py): literals compared with low-cardinality
+# text columns (at most VALUE_DICTIONARY_MAX_DISTINCT values) are rewritten to the
+# stored spelling when they differ from it only in case or whitespace, so `=` can
+# use a plain index; unresolved literals fall back to COLLATE NOCASE. A
+# VALUE_DICTIONARY_FUZZY_CUTOFF above 0 also rewrites near misses (difflib ratio),
+# which can change which rows match. Columns are read on first use, under QUERY_TIMEOUT.
+# Needs DATA_VERSIONS_CACHE_ALIAS (see the result cache), so no process keeps a stale
+# spelling after another one writes; without it literals always get NOCASE.
+VALUE_DICTIONARY_ENABLED = config('VALUE_DICTIONARY_ENABLED', default=True, cast=bool)
+VALUE_DICTIONARY_MAX_DISTINCT = config('VALUE_DICTIONARY_MAX_DISTINCT', default=1000, cast=int)
+VALUE_DICTIONARY_FUZZY_CUTOFF = config('VALUE_DICTIONARY_FUZZY_CUTOFF', default=0.0, cast=float)
+VALUE_DICTIONARY_TTL = config('VALUE_DICTIONARY_TTL', default=300, cast=int)
+
+# Workload log of executed generated queries (predicates, sort keys, join columns),
+# analyzed by `manage.py advise_indexes`. An empty path disables it.
+WORKLOAD_LOG_PATH = config('WORKLOAD_LOG_PATH', default=str(BASE_DIR / 'workload.jsonl'))
+WORKLOAD_LOG_MAX_BYTES = config('WORKLOAD_LOG_MAX_BYTES', default=10 * 1024 * 1024, cast=int)
+WORKLOAD_LOG_SAMPLE_RATE = config('WORKLOAD_LOG_SAMPLE_RATE', default=1.0, cast=float)
+
+
+# Question -> SQL cache
+# Set QUESTION_CACHE_SHARED_ALIAS to a CACHES alias to share entries between workers.
+
+QUESTION_CACHE_MAX_ENTRIES = config('QUESTION_CACHE_MAX_ENTRIES', default=1024, cast=int)
+QUESTION_CACHE_TTL = config('QUESTION_CACHE_TTL', default=3600, cast=int)
+QUESTION_CACHE_SHARED_ALIAS = config('QUESTION_CACHE_SHARED_ALIAS', default='')
+
+
+# Schema pruning (api/pruning.py)
+# Only the SCHEMA_PRUNING_TOP_K tables matching the question (plus tables needed
+# to join them, up to SCHEMA_PRUNING_MAX_TABLES, default 2 * top-k) are sent to
+# the model. Schemas with no more tables than that are sent whole; 0 disables.
+# SCHEMA_PRUNING_SYNONYMS adds question words for schema terms, e.g. {"patron": ["customer"]}.
+
+SCHEMA_PRUNING_TOP_K = config('SCHEMA_PRUNING_TOP_K', default=5, cast=int)
+SCHEMA_PRUNING_MAX_TABLES = config('SCHEMA_PRUNING_MAX_TABLES', default=0, cast=int)
+SCHEMA_PRUNING_SYNONYMS = config('SCHEMA_PRUNING_SYNONYMS', default='{}', cast=json.loads)
+
+
+# Query result cache
+# Results of executed generated SQL, keyed by normalized SQL + the write counters
+# of the tables it reads; LRU within RESULT_CACHE_MAX_BYTES (estimated).
+# The counters (api/versions.py) live in the DATA_VERSIONS_CACHE_ALIAS cache, which
+# every worker and management command must share (Redis, Memcached, database cache).
+# Without it they are per-process, and the result cache stays off.
+
+DATA_VERSIONS_CACHE_ALIAS = config('DATA_VERSIONS_CACHE_ALIAS', default='')
+RESULT_CACHE_ENABLED = config('RESULT_CACHE_ENABLED', default=True, cast=bool)
+RESULT_CACHE_MAX_BYTES = config('RESULT_CACHE_MAX_BYTES', default=64 * 1024 * 1024, cast=int)
+RESULT_CACHE_MAX_ENTRY_BYTES = config('RESULT_CACHE_MAX_ENTRY_BYTES', default=8 * 1024 * 1024, cast=int)
+RESULT_CACHE_TTL = config('RESULT_CACHE_TTL', default=300, cast=int)
+
+
+# Retrieval fast path (api/retrieval.py)
+# Questions close enough to a known pair (train.json, plus answers validated
+# through /api/retrieval/) get its SQL without calling the model.
+
+RETRIEVAL_ENABLED = config('RETRIEVAL_ENABLED', default=True, cast=bool)
+RETRIEVAL_THRESHOLD = config('RETRIEVAL_THRESHOLD', default=0.85, cast=float)
+RETRIEVAL_PAIRS_PATH = config('RETRIEVAL_PAIRS_PATH', default=str(BASE_DIR.parent / 'train.json'))
+RETRIEVAL_VALIDATED_PATH = config('RETRIEVAL_VALIDATED_PATH', default=str(BASE_DIR / 'validated_pairs.jsonl'))
+
+
+# Model evaluation
+# Runs are checkpointed as JSON so they can be polled and resumed. Gold query results
+# are cached (EVALUATION_GOLD_CACHE_SIZE) only with DATA_VERSIONS_CACHE_ALIAS set.
+
+EVALUATION_TEST_SETS = {
+    'default': BASE_DIR / 'api' / 'testsets' / 'default.json',
+    'train': BASE_DIR.parent / 'train.json',
+}
+EVALUATION_RUNS_DIR = config('EVALUATION_RUNS_DIR', default=str(BASE_DIR / 'evaluation_runs'))
+EVALUATION_WORKERS = config('EVALUATION_WORKERS', default=4, cast=int)
+EVALUATION_MAX_ROWS = config('EVALUATION_MAX_ROWS', default=1000000, cast=int)
+EVALUATION_GOLD_CACHE_SIZE = config('EVALUATION_GOLD_CACHE_SIZE', default=256, cast=int)
+
+
+# Async ask endpoint (/api/ask/async/, served under ASGI)
+
+ASK_REQUEST_TIMEOUT = config('ASK_REQUEST_TIMEOUT', default=60.0, cast=float)
+
+
+# Register the schema with the Space once and send only its id with each question.
+# Disable for Spaces that only expose the legacy /predict endpoint.
+
+MODEL_SCHEMA_HANDSHAKE = config('MODEL_SCHEMA_HANDSHAKE', default=True, cast=bool)
+
+
+# Observability
+# Stage timings go out in a Server-Timing header and to /metrics (Prometheus).
+# The sampling profiler behind /api/profiler/ can be started/stopped at runtime
+# when PROFILER_ENABLED is set.
+
+PROFILER_ENABLED = config('PROFILER_ENABLED', default=False, cast=bool)
@@ -59,8 +59,15 @@ export default function App() {
     setEvalResult(null);
 
     try {
-      const { data } = await axios.get(`${API_BASE}/evaluate/`);
-      setEvalResult(data);
+      // Evaluation runs as a background job: start it, then poll until it finishes.
+      const { data: job } = await axios.post(`${API_BASE}/evaluate/`, {});
+      let data = job;
+      while (data.status === 'running' || data.status === 'pending') {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        ({ data } = await axios.get(`${API_BASE}/evaluate/${job.run_id}/`));
+      }
+      if (data.status === 'failed') setEvalError(data.error || 'Evaluation failed');
+      else setEvalResult(data);
     } catch (err: any) {
       setEvalError(err.response?.data?.error || 'Failed to run evaluation');
     } finally {
@@ -1,19 +1,352 @@
+import ast
+import hashlib
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from collections import OrderedDict
+from concurrent.futures import Future
+from contextlib import contextmanager
+
 import gradio as gr
 import torch
-from transformers import T5Tokenizer, T5ForConditionalGeneration
+from transformers import T5TokenizerFast, T5ForConditionalGeneration
 from sentence_transformers import SentenceTransformer, util
 
 # --- CONFIGURATION ---
 FINE_TUNED_MODEL_ID = "hmyunis/t5-base-sql-custom" 
+COLUMN_INDEX_CACHE_SIZE = int(os.getenv("COLUMN_INDEX_CACHE_SIZE", "8"))  # schemas kept in memory
+COLUMN_INDEX_DIR = os.getenv("COLUMN_INDEX_DIR")  # optional: persist embeddings across restarts
+GENERATION_MAX_BATCH_SIZE = int(os.getenv("GENERATION_MAX_BATCH_SIZE", "8"))  # 1 disables batching
+GENERATION_BATCH_WAIT_MS = float(os.getenv("GENERATION_BATCH_WAIT_MS", "10"))
+GENERATION_QUEUE_DEPTH = int(os.getenv("GENERATION_QUEUE_DEPTH", "64"))
+GENERATION_CONCURRENCY = int(os.getenv("GENERATION_CONCURRENCY", "16"))  # gradio requests in flight
+SCHEMA_STORE_SIZE = int(os.getenv("SCHEMA_STORE_SIZE", "32"))  # registered schemas kept
+UNKNOWN_SCHEMA_ERROR = "Error: Unknown schema_id"
+# eager: fp32 PyTorch | int8: dynamic int8 quantization of the Linear layers |
+# onnx: ONNX Runtime encoder/decoder with KV cache (needs optimum[onnxruntime])
+INFERENCE_BACKEND = os.getenv("INFERENCE_BACKEND", "eager")
+# beam: always 4-beam search | adaptive: greedy first, beam search only when the greedy SQL looks wrong
+DECODING_MODE = os.getenv("DECODING_MODE", "beam")
+ADAPTIVE_MIN_CONFIDENCE = float(os.getenv("ADAPTIVE_MIN_CONFIDENCE", "0.85"))  # mean token probability
+
+logging.basicConfig(level=os.getenv("LOG_LEVEL", "INFO"), format="%(asctime)s %(levelname)s %(message)s")
+logger = logging.getLogger("text_to_sql_space")
+
+class StageStats:
+    """
+    Count/total/max duration per pipeline stage (embedding, tokenization,
+    generate, ...), served in Prometheus text format on the `metrics` endpoint.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {}
+
+    def record(self, name, seconds):
+        with self._lock:
+            count, total, longest = self._stats.get(name, (0, 0.0, 0.0))
+            self._stats[name] = (count + 1, total + seconds, max(longest, seconds))
+
+    @contextmanager
+    def time(self, name, into=None):
+        """Times the block; also stores the duration in the `into` dict when given."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.record(name, elapsed)
+            if into is not None:
+                into[name] = elapsed
+
+    def render(self):
+        with self._lock:
+            stats = sorted(self._stats.items())
+        lines = [
+            "# HELP text_to_sql_space_stage_seconds Time spent per Space pipeline stage.",
+            "# TYPE text_to_sql_space_stage_seconds summary",
+        ]
+        for name, (count, total, _) in stats:
+            lines.append(f'text_to_sql_space_stage_seconds_sum{{stage="{name}"}} {total}')
+            lines.append(f'text_to_sql_space_stage_seconds_count{{stage="{name}"}} {count}')
+        lines.append("# TYPE text_to_sql_space_stage_seconds_max gauge")
+        for name, (_, _, longest) in stats:
+            lines.append(f'text_to_sql_space_stage_seconds_max{{stage="{name}"}} {longest}')
+        return "\n".join(lines) + "\n"
+
+stage_stats = StageStats()
+
+def load_generator(backend):
+    if backend == "onnx":
+        from optimum.onnxruntime import ORTModelForSeq2SeqLM
+
+        return ORTModelForSeq2SeqLM.from_pretrained(FINE_TUNED_MODEL_ID, export=True, use_cache=True)
+
+    generator = T5ForConditionalGeneration.from_pretrained(FINE_TUNED_MODEL_ID)
+    generator.eval()
+    if backend == "int8":
+        generator = torch.ao.quantization.quantize_dynamic(generator, {torch.nn.Linear}, dtype=torch.qint8)
+    elif backend != "eager":
+        raise ValueError(f"Unknown INFERENCE_BACKEND: {backend}")
+    return generator
 
-print(f"Loading Model: {FINE_TUNED_MODEL_ID}...")
+logger.info("Loading Model: %s (%s)...", FINE_TUNED_MODEL_ID, INFERENCE_BACKEND)
 try:
-    tokenizer = T5Tokenizer.from_pretrained(FINE_TUNED_MODEL_ID)
-    model = T5ForConditionalGeneration.from_pretrained(FINE_TUNED_MODEL_ID)
+    tokenizer = T5TokenizerFast.from_pretrained(FINE_TUNED_MODEL_ID)
+    model = load_generator(INFERENCE_BACKEND)
     embedder = SentenceTransformer('all-MiniLM-L6-v2')
-    print("Models loaded successfully.")
+    logger.info("Models loaded successfully.")
 except Exception as e:
-    print(f"CRITICAL ERROR LOADING MODELS: {e}")
+    logger.critical("CRITICAL ERROR LOADING MODELS: %s", e)
+
+class ColumnEmbeddingIndex:
+    """
+    Column-name embeddings keyed by a hash of the column list.
+
+    The schema rarely changes, so each column list is encoded once and kept
+    in an LRU (several schemas can be cached side by side). With
+    COLUMN_INDEX_DIR set, tensors are also saved to disk and reloaded there.
+    """
+
+    def __init__(self, max_schemas=8, persist_dir=None):
+        self.max_schemas = max_schemas
+        self.persist_dir = persist_dir
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key_for(columns):
+        return hashlib.sha256("\n".join(columns).encode("utf-8")).hexdigest()[:16]
+
+    def _path(self, key):
+        return os.path.join(self.persist_dir, f"columns-{key}.pt")
+
+    def get(self, columns):
+        key = self.key_for(columns)
+        with self._lock:
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                return self._entries[key]
+
+        embeddings = None
+        if self.persist_dir and os.path.exists(self._path(key)):
+            embeddings = torch.load(self._path(key))
+        if embeddings is None:
+            embeddings = embedder.encode(columns, convert_to_tensor=True)
+            if self.persist_dir:
+                os.makedirs(self.persist_dir, exist_ok=True)
+                torch.save(embeddings, self._path(key))
+
+        with self._lock:
+            self._entries[key] = embeddings
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_schemas:
+                self._entries.popitem(last=False)
+        return embeddings
+
+
+column_index = ColumnEmbeddingIndex(COLUMN_INDEX_CACHE_SIZE, COLUMN_INDEX_DIR)
+
+_TABLE_REF_RE = re.compile(r"\b(?:FROM|JOIN)\s+([A-Za-z_]\w*)", re.IGNORECASE)
+_QUALIFIED_COLUMN_RE = re.compile(r"\b([A-Za-z_]\w*)\.([A-Za-z_]\w*)\b")
+
+def is_plausible_sql(sql, columns=None):
+    """
+    Cheap parseability check for the greedy fast path: a SELECT with balanced
+    parentheses/quotes whose tables (and table.column references) exist in
+    `columns` ('table.column' strings), when given.
+    """
+    if not sql.lstrip().upper().startswith("SELECT"):
+        return False
+    if sql.count("(") != sql.count(")") or sql.count("'") % 2:
+        return False
+    if not columns:
+        return True
+
+    known_columns = {column.lower() for column in columns}
+    known_tables = {column.split(".", 1)[0] for column in known_columns}
+    tables = [table.lower() for table in _TABLE_REF_RE.findall(sql)]
+    if not tables or any(table not in known_tables for table in tables):
+        return False
+    for table, column in _QUALIFIED_COLUMN_RE.findall(sql):
+        if table.lower() in known_tables and f"{table}.{column}".lower() not in known_columns:
+            return False
+    return True
+
+
+class DecodingStats:
+    """Fast-path counters for adaptive decoding (exposed on the decoding_stats endpoint)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.fast_path = 0
+        self.greedy_seconds = 0.0
+        self.beam_seconds = 0.0
+
+    def record(self, requests, escalated, greedy_seconds, beam_seconds):
+        with self._lock:
+            self.requests += requests
+            self.fast_path += requests - escalated
+            self.greedy_seconds += greedy_seconds
+            self.beam_seconds += beam_seconds
+
+    def snapshot(self):
+        with self._lock:
+            escalated = self.requests - self.fast_path
+            beam_per_request = self.beam_seconds / escalated if escalated else None
+            # Versus always running beam search: every request would have paid beam_per_request.
+            saved = (
+                self.requests * beam_per_request - (self.greedy_seconds + self.beam_seconds)
+                if beam_per_request is not None else None
+            )
+            return {
+                "mode": DECODING_MODE,
+                "requests": self.requests,
+                "fast_path": self.fast_path,
+                "fast_path_fraction": round(self.fast_path / self.requests, 4) if self.requests else None,
+                "estimated_seconds_saved": round(saved, 3) if saved is not None else None,
+            }
+
+
+decoding_stats = DecodingStats()
+
+def _beam_search(input_ids, attention_mask, generator):
+    with torch.inference_mode():
+        outputs = generator.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            max_length=128,
+            num_beams=4,
+            early_stopping=True
+        )
+    return tokenizer.batch_decode(outputs, skip_special_tokens=True)
+
+def _adaptive_decode(input_ids, attention_mask, generator, schemas):
+    """
+    Greedy first; beam search only for sequences whose greedy output has a
+    low mean token probability or doesn't look like valid SQL for its schema.
+    """
+    started = time.perf_counter()
+    with torch.inference_mode():
+        greedy = generator.generate(
+            input_ids,
+            attention_mask=attention_mask,
+            max_length=128,
+            num_beams=1,
+            do_sample=False,
+            output_scores=True,
+            return_dict_in_generate=True,
+        )
+        token_scores = generator.compute_transition_scores(greedy.sequences, greedy.scores, normalize_logits=True)
+    generated = greedy.sequences[:, 1:]  # drop the decoder start token
+    mask = generated != tokenizer.pad_token_id
+    confidence = torch.exp(token_scores.masked_fill(~mask, 0).sum(dim=1) / mask.sum(dim=1).clamp(min=1))
+    texts = tokenizer.batch_decode(greedy.sequences, skip_special_tokens=True)
+    greedy_seconds = time.perf_counter() - started
+
+    escalate = [
+        index for index, text in enumerate(texts)
+        if confidence[index] < ADAPTIVE_MIN_CONFIDENCE or not is_plausible_sql(text, schemas[index])
+    ]
+    beam_seconds = 0.0
+    if escalate:
+        started = time.perf_counter()
+        beam_texts = _beam_search(input_ids[escalate], attention_mask[escalate], generator)
+        beam_seconds = time.perf_counter() - started
+        for index, text in zip(escalate, beam_texts):
+            texts[index] = text
+
+    decoding_stats.record(len(texts), len(escalate), greedy_seconds, beam_seconds)
+    return texts
+
+def generate_batch(input_texts, generator=None, schemas=None):
+    """
+    Decodes several prompts in one padded batch: always beam search, or the
+    greedy-first adaptive mode when DECODING_MODE=adaptive. `schemas` holds
+    each prompt's column list for the adaptive SQL check.
+    """
+    generator = generator or model
+    with stage_stats.time("tokenization"):
+        inputs = tokenizer(input_texts, return_tensors="pt", padding=True)
+    with stage_stats.time("generate"):
+        if DECODING_MODE == "adaptive":
+            return _adaptive_decode(
+                inputs.input_ids, inputs.attention_mask, generator, schemas or [None] * len(input_texts)
+            )
+        return _beam_search(inputs.input_ids, inputs.attention_mask, generator)
+
+def get_decoding_stats():
+    return decoding_stats.snapshot()
+
+
+class GenerationBatcher:
+    """
+    Micro-batches concurrent generate() calls.
+
+    Callers enqueue a prompt and wait on a future; a single worker thread takes
+    the first waiting prompt, keeps collecting for up to `max_wait_ms` or until
+    `max_batch_size` prompts, and runs them as one padded `generate`.
+    A full queue (`queue_depth`) rejects new prompts instead of piling up.
+    """
+
+    def __init__(self, generate_fn, max_batch_size=8, max_wait_ms=10, queue_depth=64):
+        self.generate_fn = generate_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait = max_wait_ms / 1000
+        self._queue = queue.Queue(maxsize=queue_depth)
+        self._worker = threading.Thread(target=self._run, name="generation-batcher", daemon=True)
+        self._worker.start()
+
+    def submit(self, input_text, schema=None):
+        future = Future()
+        try:
+            self._queue.put_nowait((input_text, schema, future))
+        except queue.Full:
+            raise RuntimeError("Generation queue is full, try again later")
+        return future.result()
+
+    def _collect(self):
+        batch = [self._queue.get()]
+        deadline = time.monotonic() + self.max_wait
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(self._queue.get(timeout=remaining))
+            except queue.Empty:
+                break
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._collect()
+            try:
+                outputs = self.generate_fn(
+                    [input_text for input_text, _, _ in batch],
+                    schemas=[schema for _, schema, _ in batch],
+                )
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            for (_, _, future), output in zip(batch, outputs):
+                future.set_result(output)
+
+
+batcher = (
+    GenerationBatcher(generate_batch, GENERATION_MAX_BATCH_SIZE, GENERATION_BATCH_WAIT_MS, GENERATION_QUEUE_DEPTH)
+    if GENERATION_MAX_BATCH_SIZE > 1 else None
+)
+
+def generate_sql_text(input_text, schema=None):
+    if batcher is None:
+        return generate_batch([input_text], schemas=[schema])[0]
+    return batcher.submit(input_text, schema)
 
 def format_schema_like_training(raw_column_list):
     """
@@ -34,45 +367,131 @@ def format_schema_like_training(raw_column_list):
     parts = [f"{table}: {', '.join(cols)}" for table, cols in schema_map.items()]
     return " | ".join(parts)
 
-def get_sql_pipeline(question, all_columns_str):
-    print(f"Input Q: {question}")
-    
-    try:
-        # 1. Parse Columns
-        all_columns = eval(all_columns_str) 
-        
-        # 2. Schema Linking (Embeddings)
+class SchemaStore:
+    """
+    Schemas registered by the backend, keyed by schema id (the same hash the
+    column index uses), so predictions only need to send the id.
+    """
+
+    def __init__(self, max_schemas=32):
+        self.max_schemas = max_schemas
+        self._schemas = OrderedDict()
+        self._lock = threading.Lock()
+
+    def register(self, columns):
+        schema_id = ColumnEmbeddingIndex.key_for(columns)
+        with self._lock:
+            self._schemas[schema_id] = columns
+            self._schemas.move_to_end(schema_id)
+            while len(self._schemas) > self.max_schemas:
+                self._schemas.popitem(last=False)
+        return schema_id
+
+    def get(self, schema_id):
+        with self._lock:
+            columns = self._schemas.get(schema_id)
+            if columns is not None:
+                self._schemas.move_to_end(schema_id)
+            return columns
+
+
+schema_store = SchemaStore(SCHEMA_STORE_SIZE)
+
+def parse_columns(all_columns_str):
+    # literal_eval: the column list arrives over the network, never eval() it.
+    columns = ast.literal_eval(all_columns_str)
+    if not isinstance(columns, (list, tuple)) or not all(isinstance(col, str) for col in columns):
+        raise ValueError("Expected a list of 'table.column' strings")
+    return list(columns)
+
+def run_pipeline(question, all_columns):
+    timings = {}
+    logger.debug("Input Q: %s", question)
+
+    # 2. Schema Linking (Embeddings) - only the question is encoded per request
+    with stage_stats.time("embedding", into=timings):
         question_embedding = embedder.encode(question, convert_to_tensor=True)
-        column_embeddings = embedder.encode(all_columns, convert_to_tensor=True)
-        
+        column_embeddings = column_index.get(all_columns)
+
         # Increase Top-K to 10 to ensure we get enough context from the right table
         hits = util.semantic_search(question_embedding, column_embeddings, top_k=10)
-        relevant_cols = [all_columns[hit['corpus_id']] for hit in hits[0]]
-        
-        # 3. Formulate Prompt (CRITICAL FIX HERE)
-        # We re-format the list to look like "table: col1, col2"
-        schema_context = format_schema_like_training(relevant_cols)
-        
-        input_text = f"translate English to SQL: {question} </s> {schema_context}"
-        print(f"Prompt: {input_text}")
-        
-        # 4. Generate
-        input_ids = tokenizer(input_text, return_tensors="pt").input_ids
-        
-        outputs = model.generate(
-            input_ids, 
-            max_length=128, 
-            num_beams=4, 
-            early_stopping=True
-        )
-        
-        generated_sql = tokenizer.decode(outputs[0], skip_special_tokens=True)
-        print(f"Output: '{generated_sql}'")
-        
-        return generated_sql
+    relevant_cols = [all_columns[hit['corpus_id']] for hit in hits[0]]
+
+    # 3. Formulate Prompt (CRITICAL FIX HERE)
+    # We re-format the list to look like "table: col1, col2"
+    schema_context = format_schema_like_training(relevant_cols)
+
+    input_text = f"translate English to SQL: {question} </s> {schema_context}"
+    logger.debug("Prompt: %s", input_text)
+
+    # 4. Generate (micro-batched with other in-flight questions; includes the batch wait)
+    with stage_stats.time("generation", into=timings):
+        generated_sql = generate_sql_text(input_text, all_columns)
+    logger.info(
+        "Output: %r (%s)", generated_sql,
+        " ".join(f"{name}={seconds * 1000:.1f}ms" for name, seconds in timings.items()),
+    )
+
+    return generated_sql
+
+def get_metrics():
+    return stage_stats.render()
+
+def get_sql_pipeline(question, all_columns_str):
+    try:
+        # 1. Parse Columns
+        all_columns = parse_columns(all_columns_str)
+        return run_pipeline(question, all_columns)
 
     except Exception as e:
         return f"Error: {str(e)}"
 
-iface = gr.Interface(fn=get_sql_pipeline, inputs=["text", "text"], outputs="text")
-iface.launch()
\ No newline at end of file
+def register_schema(all_columns_str):
+    """Parses and caches a column list once; returns the schema id to predict with."""
+    try:
+        all_columns = parse_columns(all_columns_str)
+        schema_id = schema_store.register(all_columns)
+        column_index.get(all_columns)  # embed the columns now, not on the first question
+        return schema_id
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+def predict_with_schema(question, schema_id):
+    all_columns = schema_store.get(schema_id)
+    if all_columns is None:
+        # The backend re-registers when it sees this.
+        return f"{UNKNOWN_SCHEMA_ERROR} {schema_id}"
+    try:
+        return run_pipeline(question, all_columns)
+
+    except Exception as e:
+        return f"Error: {str(e)}"
+
+# Let concurrent requests reach the batcher instead of gradio serializing them.
+with gr.Blocks() as iface:
+    with gr.Tab("Predict"):
+        gr.Interface(
+            fn=get_sql_pipeline,
+            inputs=["text", "text"],
+            outputs="text",
+            api_name="predict",
+            concurrency_limit=GENERATION_CONCURRENCY,
+        )
+    with gr.Tab("Register schema"):
+        gr.Interface(fn=register_schema, inputs="text", outputs="text", api_name="register_schema")
+    with gr.Tab("Decoding stats"):
+        gr.Interface(fn=get_decoding_stats, inputs=None, outputs="json", api_name="decoding_stats")
+    with gr.Tab("Metrics"):
+        gr.Interface(fn=get_metrics, inputs=None, outputs="text", api_name="metrics")
+    with gr.Tab("Predict with schema"):
+        gr.Interface(
+            fn=predict_with_schema,
+            inputs=["text", "text"],
+            outputs="text",
+            api_name="predict_with_schema",
+            concurrency_limit=GENERATION_CONCURRENCY,
+        )
+
+if __name__ == "__main__":
+    iface.queue(max_size=GENERATION_QUEUE_DEPTH).launch()
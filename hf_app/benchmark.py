@@ -0,0 +1,244 @@
+"""
+CPU benchmarks for the Space pipeline. Loads the models from app.py (without
+launching gradio).
+
+    python benchmark.py batching --requests 64 --concurrency 16
+    python benchmark.py backends --backends eager int8 onnx
+    python benchmark.py decoding
+"""
+import argparse
+import importlib
+import json
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+TEST_SET = Path(__file__).resolve().parent.parent / "backend" / "api" / "testsets" / "default.json"
+# Same column list the backend sends (api.utils.get_all_columns_list).
+COLUMNS = [
+    "api_customer.id", "api_customer.name", "api_customer.email", "api_customer.city",
+    "api_product.id", "api_product.name", "api_product.price", "api_product.category",
+    "api_order.id", "api_order.customer", "api_order.product", "api_order.order_date", "api_order.quantity",
+]
+
+QUESTIONS = [
+    "Show me all customers",
+    "Who lives in Axum?",
+    "Count total orders",
+    "Show me products with price higher than 15",
+    "List valuable products",
+    "Show customers from Addis Ababa",
+    "Show products cheaper than 10",
+    "What is the average price of products?",
+]
+SCHEMA = "api_customer: id, name, email, city | api_product: id, name, price, category | api_order: id, customer, product, order_date, quantity"
+
+
+def _prompts(count):
+    return [
+        f"translate English to SQL: {QUESTIONS[i % len(QUESTIONS)]} </s> {SCHEMA}"
+        for i in range(count)
+    ]
+
+
+def _run(generate, prompts, concurrency):
+    latencies = []
+
+    def one(prompt):
+        started = time.perf_counter()
+        generate(prompt)
+        latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        list(executor.map(one, prompts))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "throughput": len(prompts) / elapsed,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "p95_ms": latencies[int(len(latencies) * 0.95)] * 1000,
+    }
+
+
+def _report(name, result):
+    print(f"{name:>12} {result['throughput']:>10.2f} {result['p50_ms']:>10.0f} {result['p95_ms']:>10.0f}")
+
+
+def _app():
+    # Imported lazily: loading app.py loads the models for INFERENCE_BACKEND.
+    return importlib.import_module("app")
+
+
+def bench_batching(args):
+    app = _app()
+    prompts = _prompts(args.requests)
+    app.generate_batch(prompts[:1])  # warm-up
+
+    # One prompt per forward pass, as before batching (the model runs one generate at a time).
+    lock = threading.Lock()
+
+    def unbatched(prompt):
+        with lock:
+            return app.generate_batch([prompt])[0]
+
+    batcher = app.GenerationBatcher(
+        app.generate_batch, args.max_batch_size, args.wait_ms, queue_depth=args.requests
+    )
+
+    print(f"{'mode':>12} {'req_per_s':>10} {'p50_ms':>10} {'p95_ms':>10}")
+    _report("unbatched", _run(unbatched, prompts, args.concurrency))
+    _report("batched", _run(batcher.submit, prompts, args.concurrency))
+
+
+def _fixture_db():
+    """Small deterministic copy of the backend tables for execution accuracy."""
+    rng = random.Random(0)
+    db = sqlite3.connect(":memory:")
+    db.executescript(
+        "CREATE TABLE api_customer (id INTEGER PRIMARY KEY, name TEXT, email TEXT, city TEXT);"
+        "CREATE TABLE api_product (id INTEGER PRIMARY KEY, name TEXT, price DECIMAL, category TEXT);"
+        "CREATE TABLE api_order (id INTEGER PRIMARY KEY, customer_id INTEGER, product_id INTEGER,"
+        " order_date DATE, quantity INTEGER);"
+    )
+    cities = ["Addis Ababa", "Axum", "Adama", "Gondar", "Hawassa"]
+    categories = ["Coffee", "Spices", "Books", "Textiles"]
+    db.executemany(
+        "INSERT INTO api_customer VALUES (?, ?, ?, ?)",
+        [(i, f"Customer {i}", f"customer{i}@example.com", rng.choice(cities)) for i in range(1, 31)],
+    )
+    db.executemany(
+        "INSERT INTO api_product VALUES (?, ?, ?, ?)",
+        [(i, f"Product {i}", round(rng.uniform(2, 35), 2), rng.choice(categories)) for i in range(1, 21)],
+    )
+    db.executemany(
+        "INSERT INTO api_order VALUES (?, ?, ?, ?, ?)",
+        [(i, rng.randint(1, 30), rng.randint(1, 20), "2025-01-01", rng.randint(1, 8)) for i in range(1, 51)],
+    )
+    return db
+
+
+def _same_result(db, generated_sql, gold_sql):
+    try:
+        generated = db.execute(generated_sql).fetchall()
+    except sqlite3.Error:
+        return False
+    gold = db.execute(gold_sql).fetchall()
+    return sorted(map(repr, generated)) == sorted(map(repr, gold))
+
+
+def bench_backend(args):
+    """Latency, peak memory and execution accuracy of the current INFERENCE_BACKEND."""
+    app = _app()
+    test_set = json.loads(TEST_SET.read_text())
+    db = _fixture_db()
+    app.run_pipeline(test_set[0]["question"], COLUMNS)  # warm-up
+
+    latencies = []
+    correct = 0
+    for item in test_set:
+        started = time.perf_counter()
+        generated_sql = app.run_pipeline(item["question"], COLUMNS)
+        latencies.append(time.perf_counter() - started)
+        correct += _same_result(db, generated_sql, item["gold_sql"])
+
+    latencies.sort()
+    print(json.dumps({
+        "backend": app.INFERENCE_BACKEND,
+        "p50_ms": latencies[len(latencies) // 2] * 1000,
+        "mean_ms": sum(latencies) / len(latencies) * 1000,
+        "peak_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+        "accuracy": correct / len(test_set),
+    }))
+
+
+def bench_backends(args):
+    """Runs `backend` once per backend in a fresh process, then applies the accuracy guard."""
+    results = []
+    for backend in args.backends:
+        env = dict(os.environ, INFERENCE_BACKEND=backend, GENERATION_MAX_BATCH_SIZE="1")
+        output = subprocess.run(
+            [sys.executable, __file__, "backend"], env=env, check=True, capture_output=True, text=True
+        ).stdout
+        results.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'backend':>8} {'p50_ms':>9} {'mean_ms':>9} {'peak_rss_mb':>12} {'accuracy':>9}")
+    for result in results:
+        print(
+            f"{result['backend']:>8} {result['p50_ms']:>9.0f} {result['mean_ms']:>9.0f} "
+            f"{result['peak_rss_mb']:>12.0f} {result['accuracy']:>9.2%}"
+        )
+
+    baseline = next((r for r in results if r["backend"] == "eager"), results[0])
+    regressed = [r["backend"] for r in results if r["accuracy"] < baseline["accuracy"] - args.max_accuracy_drop]
+    if regressed:
+        print(f"Accuracy guard failed for: {', '.join(regressed)}")
+        sys.exit(1)
+
+
+def bench_decoding(args):
+    """Always-beam vs adaptive decoding on the test set: latency, accuracy, fast-path share."""
+    app = _app()
+    test_set = json.loads(TEST_SET.read_text())
+    db = _fixture_db()
+
+    print(f"{'mode':>9} {'mean_ms':>9} {'accuracy':>9} {'fast_path':>10}")
+    for mode in ("beam", "adaptive"):
+        app.DECODING_MODE = mode
+        app.decoding_stats = app.DecodingStats()
+        app.run_pipeline(test_set[0]["question"], COLUMNS)  # warm-up
+        app.decoding_stats = app.DecodingStats()
+
+        elapsed = 0.0
+        correct = 0
+        for item in test_set:
+            started = time.perf_counter()
+            generated_sql = app.run_pipeline(item["question"], COLUMNS)
+            elapsed += time.perf_counter() - started
+            correct += _same_result(db, generated_sql, item["gold_sql"])
+
+        fast_path = app.decoding_stats.snapshot()["fast_path_fraction"]
+        print(
+            f"{mode:>9} {elapsed / len(test_set) * 1000:>9.0f} {correct / len(test_set):>9.2%} "
+            f"{'-' if fast_path is None else f'{fast_path:.0%}':>10}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="benchmark", required=True)
+
+    batching = subparsers.add_parser("batching", help="Micro-batched vs one-at-a-time generation.")
+    batching.add_argument("--requests", type=int, default=64)
+    batching.add_argument("--concurrency", type=int, default=16)
+    batching.add_argument("--max-batch-size", type=int, default=8)
+    batching.add_argument("--wait-ms", type=float, default=10)
+    batching.set_defaults(func=bench_batching)
+
+    backend = subparsers.add_parser("backend", help="Measure the backend selected by INFERENCE_BACKEND.")
+    backend.set_defaults(func=bench_backend)
+
+    backends = subparsers.add_parser("backends", help="Compare inference backends with an accuracy guard.")
+    backends.add_argument("--backends", nargs="+", default=["eager", "int8", "onnx"])
+    backends.add_argument(
+        "--max-accuracy-drop", type=float, default=0.0,
+        help="Allowed execution-accuracy drop versus eager before the guard fails.",
+    )
+    backends.set_defaults(func=bench_backends)
+
+    decoding = subparsers.add_parser("decoding", help="Always-beam vs adaptive greedy-first decoding.")
+    decoding.set_defaults(func=bench_decoding)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
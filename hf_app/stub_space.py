@@ -0,0 +1,49 @@
+"""
+Local stand-in for the model Space: the same gradio endpoints as app.py with
+a fixed latency and canned SQL, and no model download. For benchmarking the
+backend end to end without calling Hugging Face.
+
+    STUB_LATENCY=0.3 python hf_app/stub_space.py
+    cd backend && python manage.py bench_e2e --model-url http://127.0.0.1:7860/
+"""
+import json
+import os
+import re
+import time
+from pathlib import Path
+
+import gradio as gr
+
+STUB_LATENCY = float(os.getenv("STUB_LATENCY", "0.3"))  # seconds per prediction
+STUB_DEFAULT_SQL = os.getenv("STUB_DEFAULT_SQL", "SELECT COUNT(*) FROM api_order")
+STUB_CONCURRENCY = int(os.getenv("STUB_CONCURRENCY", "64"))
+TEST_SET = Path(
+    os.getenv("STUB_TEST_SET", Path(__file__).resolve().parent.parent / "backend" / "api" / "testsets" / "default.json")
+)
+
+def _normalize(question):
+    # Same normalization as the backend's question cache.
+    return re.sub(r"\s+", " ", question.lower()).strip(" ?!.,;:'\"")
+
+# Known test-set questions get their gold SQL, so evaluation runs score 100%.
+ANSWERS = {_normalize(item["question"]): item["gold_sql"] for item in json.loads(TEST_SET.read_text())}
+
+def predict(question, all_columns_str):
+    time.sleep(STUB_LATENCY)
+    return ANSWERS.get(_normalize(question), STUB_DEFAULT_SQL)
+
+def register_schema(all_columns_str):
+    return "stub-schema"
+
+def predict_with_schema(question, schema_id):
+    return predict(question, None)
+
+with gr.Blocks() as iface:
+    gr.Interface(fn=predict, inputs=["text", "text"], outputs="text", api_name="predict",
+                 concurrency_limit=STUB_CONCURRENCY)
+    gr.Interface(fn=register_schema, inputs="text", outputs="text", api_name="register_schema")
+    gr.Interface(fn=predict_with_schema, inputs=["text", "text"], outputs="text", api_name="predict_with_schema",
+                 concurrency_limit=STUB_CONCURRENCY)
+
+if __name__ == "__main__":
+    iface.queue(max_size=None).launch()
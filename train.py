@@ -0,0 +1,358 @@
+"""
+Fine-tunes the text-to-SQL model on train.json (the headless version of
+trainer.ipynb).
+
+The tokenized dataset is cached once per (data, tokenizer, max lengths) in a
+memory-mapped token file, so reruns skip tokenization and large datasets are
+not held in memory. Batches are built from examples of similar length and
+padded only to the longest one in the batch, instead of to a fixed 256/128
+tokens. Training logs report tokens/sec and the padding ratio, and each epoch
+is scored with the backend's execution-accuracy metric (compare_query_results),
+which needs a migrated and seeded backend database.
+
+    pip install transformers torch sentencepiece numpy
+    python train.py --model google-t5/t5-base --epochs 12 --hub-model-id hmyunis/t5-base-sql-custom
+    python train.py --tiny --epochs 1 --max-steps 20   # CPU smoke test with a tiny random model
+
+Pushing to the Hub reads the token from HF_TOKEN (or a prior `huggingface-cli login`).
+"""
+import argparse
+import hashlib
+import json
+import math
+import os
+import random
+import sys
+import time
+from pathlib import Path
+
+import numpy as np
+import torch
+from transformers import (
+    AutoModelForSeq2SeqLM, AutoTokenizer, T5Config, T5ForConditionalGeneration, get_linear_schedule_with_warmup,
+)
+
+ROOT = Path(__file__).resolve().parent
+PROMPT_TEMPLATE = "translate English to SQL: {question} </s> {context}"
+# The notebook padded every example to these lengths.
+FIXED_SOURCE_LENGTH = 256
+FIXED_TARGET_LENGTH = 128
+TOKENIZE_CHUNK = 10000
+
+
+class TokenizedPairs:
+    """
+    Read-only view of a tokenized dataset cache: `tokens.bin` holds each
+    example's source ids followed by its target ids, `index.npy` one
+    (offset, source length, target length) row per example.
+    """
+
+    def __init__(self, cache_dir):
+        self.cache_dir = Path(cache_dir)
+        self.meta = json.loads((self.cache_dir / "meta.json").read_text())
+        self.tokens = np.memmap(self.cache_dir / "tokens.bin", dtype=self.meta["dtype"], mode="r")
+        self.index = np.load(self.cache_dir / "index.npy")
+        self.answers = json.loads((self.cache_dir / "answers.json").read_text())
+
+    def __len__(self):
+        return len(self.index)
+
+    def source(self, i):
+        offset, source_length, _ = self.index[i]
+        return self.tokens[offset:offset + source_length]
+
+    def target(self, i):
+        offset, source_length, target_length = self.index[i]
+        return self.tokens[offset + source_length:offset + source_length + target_length]
+
+    @property
+    def source_lengths(self):
+        return self.index[:, 1]
+
+    @property
+    def target_lengths(self):
+        return self.index[:, 2]
+
+
+def load_or_build_cache(data_path, tokenizer, cache_root, max_source_length, max_target_length):
+    raw = Path(data_path).read_bytes()
+    key = hashlib.sha256(raw)
+    key.update(
+        f"{PROMPT_TEMPLATE}|{tokenizer.name_or_path}|{len(tokenizer)}|{max_source_length}|{max_target_length}".encode()
+    )
+    cache_dir = Path(cache_root) / key.hexdigest()[:16]
+    if (cache_dir / "meta.json").exists():
+        print(f"Using tokenized cache {cache_dir}")
+        return TokenizedPairs(cache_dir)
+
+    started = time.perf_counter()
+    examples = [item for item in json.loads(raw) if item.get("question") and item.get("answer")]
+    dtype = "uint16" if len(tokenizer) <= np.iinfo(np.uint16).max else "int32"
+    tmp_dir = cache_dir.with_name(f"{cache_dir.name}.tmp{os.getpid()}")
+    tmp_dir.mkdir(parents=True, exist_ok=True)
+
+    index = np.zeros((len(examples), 3), dtype=np.int64)
+    offset = 0
+    with open(tmp_dir / "tokens.bin", "wb") as f:
+        # Tokenized in chunks, so memory stays bounded by the chunk size.
+        for start in range(0, len(examples), TOKENIZE_CHUNK):
+            chunk = examples[start:start + TOKENIZE_CHUNK]
+            sources = tokenizer(
+                [PROMPT_TEMPLATE.format(question=item["question"], context=item.get("context", "")) for item in chunk],
+                max_length=max_source_length, truncation=True,
+            )["input_ids"]
+            targets = tokenizer(
+                [item["answer"] for item in chunk], max_length=max_target_length, truncation=True,
+            )["input_ids"]
+            for row, (source, target) in enumerate(zip(sources, targets), start=start):
+                index[row] = (offset, len(source), len(target))
+                np.asarray(source + target, dtype=dtype).tofile(f)
+                offset += len(source) + len(target)
+
+    np.save(tmp_dir / "index.npy", index)
+    (tmp_dir / "answers.json").write_text(json.dumps([item["answer"] for item in examples]))
+    (tmp_dir / "meta.json").write_text(json.dumps({
+        "data": str(data_path),
+        "data_sha256": hashlib.sha256(raw).hexdigest(),
+        "tokenizer": tokenizer.name_or_path,
+        "dtype": dtype,
+        "examples": len(examples),
+        "tokens": offset,
+        "max_source_length": max_source_length,
+        "max_target_length": max_target_length,
+    }, indent=2))
+    try:
+        os.replace(tmp_dir, cache_dir)
+    except OSError:
+        pass  # another run finished the same cache first
+    print(f"Tokenized {len(examples)} examples ({offset} tokens) in {time.perf_counter() - started:.1f}s -> {cache_dir}")
+    return TokenizedPairs(cache_dir)
+
+
+def length_bucketed_batches(lengths, indices, batch_size, rng, bucket_batches=50):
+    """
+    Shuffles `indices`, sorts each window of `batch_size * bucket_batches`
+    examples by length and cuts it into batches, then shuffles the batch
+    order: batches hold similar lengths but epochs still differ.
+    """
+    indices = list(indices)
+    rng.shuffle(indices)
+    window = batch_size * bucket_batches
+    batches = []
+    for start in range(0, len(indices), window):
+        bucket = sorted(indices[start:start + window], key=lambda i: lengths[i])
+        batches.extend(bucket[i:i + batch_size] for i in range(0, len(bucket), batch_size))
+    rng.shuffle(batches)
+    return batches
+
+
+def _round_up(value, multiple):
+    return -(-value // multiple) * multiple
+
+
+def collate(dataset, batch, pad_token_id, pad_to_multiple_of=1):
+    """
+    Pads a batch to its own longest source/target. Returns the model inputs
+    plus (real tokens, tokens including padding) for the padding ratio.
+    """
+    sources = [dataset.source(i) for i in batch]
+    targets = [dataset.target(i) for i in batch]
+    source_width = _round_up(max(len(s) for s in sources), pad_to_multiple_of)
+    target_width = _round_up(max(len(t) for t in targets), pad_to_multiple_of)
+
+    input_ids = torch.full((len(batch), source_width), pad_token_id, dtype=torch.long)
+    attention_mask = torch.zeros((len(batch), source_width), dtype=torch.long)
+    # -100 so the loss ignores padding
+    labels = torch.full((len(batch), target_width), -100, dtype=torch.long)
+    for row, (source, target) in enumerate(zip(sources, targets)):
+        input_ids[row, :len(source)] = torch.from_numpy(source.astype(np.int64))
+        attention_mask[row, :len(source)] = 1
+        labels[row, :len(target)] = torch.from_numpy(target.astype(np.int64))
+
+    real = sum(len(s) for s in sources) + sum(len(t) for t in targets)
+    padded = len(batch) * (source_width + target_width)
+    return {"input_ids": input_ids, "attention_mask": attention_mask, "labels": labels}, real, padded
+
+
+def tiny_model(tokenizer):
+    """Randomly initialized two-layer T5 for CPU smoke tests (no weight download)."""
+    config = T5Config(
+        vocab_size=len(tokenizer), d_model=64, d_kv=16, d_ff=128, num_layers=2, num_decoder_layers=2,
+        num_heads=4, decoder_start_token_id=tokenizer.pad_token_id,
+        pad_token_id=tokenizer.pad_token_id, eos_token_id=tokenizer.eos_token_id,
+    )
+    return T5ForConditionalGeneration(config)
+
+
+def execution_accuracy_metric():
+    """The backend's compare_query_results, run against its configured database."""
+    sys.path.insert(0, str(ROOT / "backend"))
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "core.settings")
+    import django
+
+    django.setup()
+    from api.evaluation import compare_query_results
+
+    return compare_query_results
+
+
+def evaluate(model, tokenizer, dataset, indices, compare, args, device):
+    """Greedy/beam decodes the eval split and scores it by execution accuracy."""
+    model.eval()
+    correct = 0
+    order = sorted(indices, key=lambda i: dataset.source_lengths[i])
+    with torch.no_grad():
+        for start in range(0, len(order), args.eval_batch_size):
+            batch = order[start:start + args.eval_batch_size]
+            inputs, _, _ = collate(dataset, batch, tokenizer.pad_token_id)
+            outputs = model.generate(
+                input_ids=inputs["input_ids"].to(device),
+                attention_mask=inputs["attention_mask"].to(device),
+                max_new_tokens=args.max_target_length,
+                num_beams=args.eval_beams,
+            )
+            for i, generated_sql in zip(batch, tokenizer.batch_decode(outputs, skip_special_tokens=True)):
+                is_correct, _ = compare(generated_sql.strip(), dataset.answers[i])
+                correct += bool(is_correct)
+    model.train()
+    return correct / len(indices) if indices else None
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--data", default=str(ROOT / "train.json"))
+    parser.add_argument("--model", default="google-t5/t5-base", help="Checkpoint to fine-tune (and its tokenizer).")
+    parser.add_argument("--tiny", action="store_true", help="Train a tiny random T5 on CPU (smoke tests).")
+    parser.add_argument("--output-dir", default="t5-base-sql-custom")
+    parser.add_argument("--cache-dir", default=str(ROOT / ".train_cache"), help="Tokenized dataset cache.")
+    parser.add_argument("--max-source-length", type=int, default=FIXED_SOURCE_LENGTH)
+    parser.add_argument("--max-target-length", type=int, default=FIXED_TARGET_LENGTH)
+    parser.add_argument("--epochs", type=int, default=12)
+    parser.add_argument("--max-steps", type=int, default=None, help="Stop after this many optimizer steps.")
+    parser.add_argument("--batch-size", type=int, default=4)
+    parser.add_argument("--bucket-batches", type=int, default=50, help="Batches per length-sorted window.")
+    parser.add_argument("--pad-to-multiple-of", type=int, default=1, help="8 helps tensor cores on GPU.")
+    parser.add_argument("--learning-rate", type=float, default=3e-4)
+    parser.add_argument("--weight-decay", type=float, default=0.01)
+    parser.add_argument("--warmup-ratio", type=float, default=0.0)
+    parser.add_argument("--fp16", action="store_true", help="Mixed precision (CUDA only).")
+    parser.add_argument("--device", default=None, help="cpu or cuda (default: cuda when available; cpu with --tiny).")
+    parser.add_argument("--eval-split", type=float, default=0.1)
+    parser.add_argument("--eval-batch-size", type=int, default=16)
+    parser.add_argument("--eval-beams", type=int, default=1)
+    parser.add_argument("--no-eval", action="store_true", help="Skip execution-accuracy evaluation.")
+    parser.add_argument("--log-every", type=int, default=10, help="Steps between progress lines.")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--hub-model-id", help="Push the best checkpoint to this Hub repository.")
+    return parser.parse_args(argv)
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    random.seed(args.seed)
+    np.random.seed(args.seed)
+    torch.manual_seed(args.seed)
+    device = torch.device(args.device or ("cpu" if args.tiny or not torch.cuda.is_available() else "cuda"))
+    use_fp16 = args.fp16 and device.type == "cuda"
+
+    tokenizer = AutoTokenizer.from_pretrained(args.model)
+    dataset = load_or_build_cache(
+        args.data, tokenizer, args.cache_dir, args.max_source_length, args.max_target_length
+    )
+    model = tiny_model(tokenizer) if args.tiny else AutoModelForSeq2SeqLM.from_pretrained(args.model)
+    model.to(device)
+    model.train()
+
+    rng = random.Random(args.seed)
+    indices = list(range(len(dataset)))
+    rng.shuffle(indices)
+    eval_count = 0 if args.no_eval else max(1, round(len(indices) * args.eval_split))
+    eval_indices, train_indices = indices[:eval_count], indices[eval_count:]
+    compare = None if args.no_eval else execution_accuracy_metric()
+
+    lengths = dataset.source_lengths + dataset.target_lengths
+    fixed_tokens = len(train_indices) * (args.max_source_length + args.max_target_length)
+    real_tokens = int(lengths[train_indices].sum())
+    print(
+        f"{len(train_indices)} train / {len(eval_indices)} eval examples on {device}; "
+        f"fixed-length padding would be {1 - real_tokens / fixed_tokens:.1%} of each epoch's tokens"
+    )
+
+    steps_per_epoch = math.ceil(len(train_indices) / args.batch_size)
+    total_steps = min(args.max_steps or math.inf, steps_per_epoch * args.epochs)
+    optimizer = torch.optim.AdamW(model.parameters(), lr=args.learning_rate, weight_decay=args.weight_decay)
+    scheduler = get_linear_schedule_with_warmup(optimizer, int(total_steps * args.warmup_ratio), total_steps)
+    scaler = torch.amp.GradScaler("cuda", enabled=use_fp16)
+
+    history = []
+    best_accuracy = None
+    step = 0
+    output_dir = Path(args.output_dir)
+    for epoch in range(1, args.epochs + 1):
+        epoch_started = time.perf_counter()
+        window_started = epoch_started
+        epoch_real = epoch_padded = window_real = 0
+        loss_sum = 0.0
+        batches = length_bucketed_batches(lengths, train_indices, args.batch_size, rng, args.bucket_batches)
+        for batch in batches:
+            inputs, real, padded = collate(dataset, batch, tokenizer.pad_token_id, args.pad_to_multiple_of)
+            inputs = {name: tensor.to(device) for name, tensor in inputs.items()}
+            with torch.autocast(device.type, dtype=torch.float16, enabled=use_fp16):
+                loss = model(**inputs).loss
+            scaler.scale(loss).backward()
+            scaler.step(optimizer)
+            scaler.update()
+            scheduler.step()
+            optimizer.zero_grad(set_to_none=True)
+
+            step += 1
+            loss_sum += loss.item()
+            epoch_real += real
+            epoch_padded += padded
+            window_real += real
+            if step % args.log_every == 0:
+                now = time.perf_counter()
+                print(
+                    f"epoch {epoch} step {step}/{total_steps} loss {loss.item():.4f} "
+                    f"tokens/s {window_real / (now - window_started):.0f} "
+                    f"padding {1 - epoch_real / epoch_padded:.1%}"
+                )
+                window_started, window_real = now, 0
+            if step >= total_steps:
+                break
+
+        elapsed = time.perf_counter() - epoch_started
+        record = {
+            "epoch": epoch,
+            "steps": step,
+            "loss": round(loss_sum / max(1, len(batches)), 4),
+            "tokens_per_second": round(epoch_real / elapsed, 1),
+            "padding_ratio": round(1 - epoch_real / epoch_padded, 4) if epoch_padded else None,
+            "seconds": round(elapsed, 1),
+        }
+        if compare is not None:
+            record["execution_accuracy"] = evaluate(model, tokenizer, dataset, eval_indices, compare, args, device)
+        history.append(record)
+        print(json.dumps(record))
+
+        accuracy = record.get("execution_accuracy")
+        # Without evaluation the latest epoch is kept.
+        if accuracy is None or best_accuracy is None or accuracy > best_accuracy:
+            best_accuracy = accuracy
+            model.save_pretrained(output_dir)
+            tokenizer.save_pretrained(output_dir)
+        if step >= total_steps:
+            break
+
+    (output_dir / "train_metrics.json").write_text(json.dumps({"args": vars(args), "epochs": history}, indent=2))
+    print(f"Saved to {output_dir} (best execution accuracy: {best_accuracy})")
+
+    if args.hub_model_id:
+        best = AutoModelForSeq2SeqLM.from_pretrained(output_dir)
+        best.push_to_hub(args.hub_model_id)
+        tokenizer.push_to_hub(args.hub_model_id)
+        print(f"Pushed to https://huggingface.co/{args.hub_model_id}")
+
+
+if __name__ == "__main__":
+    main()